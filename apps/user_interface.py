@@ -1,9 +1,17 @@
 import streamlit as st
 from streamlit_echarts import st_echarts
 import json
-from services.adk_service import initialize_adk, run_adk_sync
+from services.adk_service import initialize_adk, stream_adk_sync
 from config.settings import MESSAGE_HISTORY_KEY, get_api_key
 
+def parse_chart_option(chart_objects: str):
+    """Parses the chart option JSON written by data_chart_agent, returns None if it is not valid."""
+    try:
+        return json.loads(chart_objects.strip().removeprefix("```json").removesuffix("```").strip())
+    except Exception as e:
+        print(f"Error in json.loads of the chart option: {e}")
+        return None
+
 def run_streamlit_app():
     """
     Sets up and runs the Streamlit web application for the ADK chat assistant.
@@ -19,8 +27,8 @@ def run_streamlit_app():
     if not api_key:
         st.error("⚠️ Action Required: Google API Key Not Found or Invalid! Please set GOOGLE_API_KEY in your .env file. ⚠️")
         st.stop() # Stop the application if the API key is missing, prompting the user for action.
-    # Initialize ADK runner and session ID (cached to run only once).
-    adk_runner, current_session_id = initialize_adk()
+    # Shared ADK runner, plus the ADK user and session IDs of this browser session.
+    adk_runner, current_user_id, current_session_id = initialize_adk()
 
     # # Sidebar for session management
     # with st.sidebar:
@@ -29,7 +37,7 @@ def run_streamlit_app():
     #     if st.button("➕ New Session"):
     #         for key in list(st.session_state.keys()):
     #             del st.session_state[key]
-    #         adk_runner, current_session_id = initialize_adk()
+    #         adk_runner, current_user_id, current_session_id = initialize_adk()
     #         st.rerun()
     
     st.subheader("Chat with the Assistant") # Subheading for the chat section.
@@ -53,18 +61,35 @@ def run_streamlit_app():
             st.markdown(prompt)
         # Process the user's message with the ADK agent and display the response.
         with st.chat_message("assistant"):
+            stage_placeholder = st.empty() # Shows which stage of the pipeline is running.
             message_placeholder = st.empty() # Create an empty placeholder to update with the assistant's response.
-            with st.spinner("Assistant is thinking..."): # Show a spinner while the agent processes the request.
-                agent_response_text, agent_response_chart_option = run_adk_sync(adk_runner, current_session_id, prompt) # Call the synchronous ADK runner.
-                message_placeholder.markdown(agent_response_text) # Update the placeholder with the final response.
-                if agent_response_chart_option:
-                    agent_response_chart_option = agent_response_chart_option.strip().removeprefix("```json").removesuffix("```").strip()
-                    try:
-                        agent_response_chart_option = json.loads(agent_response_chart_option)
-                        st_echarts(options=agent_response_chart_option, height="300px")
-                    except Exception as e:
-                        print(f"Error in json.loads or st_echarts: {e}")
-                        agent_response_chart_option = None
-            
+            chart_placeholder = st.empty() # The chart is shown as soon as data_chart_agent has built it.
+            agent_response_text, agent_response_chart_option, shown_chart = "", None, None
+            # Stream the turn: stage changes, the chart and the partial answer are rendered as they arrive.
+            for update in stream_adk_sync(adk_runner, current_user_id, current_session_id, prompt):
+                chart_objects = None
+                if update.kind == "queued":
+                    stage_placeholder.caption(f"⏳ Other questions are being answered, you are number {update.value} in line ...")
+                elif update.kind == "stage":
+                    stage_placeholder.caption(f"⏳ {update.value} ...")
+                elif update.kind == "text":
+                    message_placeholder.markdown(update.value + "▌")
+                elif update.kind == "chart":
+                    chart_objects = update.value
+                elif update.kind == "done":
+                    agent_response_text, chart_objects = update.value
+                    stage_placeholder.empty()
+                    message_placeholder.markdown(agent_response_text) # Update the placeholder with the final response.
+                if chart_objects and chart_objects != shown_chart:
+                    shown_chart = chart_objects
+                    agent_response_chart_option = parse_chart_option(chart_objects)
+                    if agent_response_chart_option:
+                        try:
+                            with chart_placeholder.container():
+                                st_echarts(options=agent_response_chart_option, height="300px")
+                        except Exception as e:
+                            print(f"Error in st_echarts: {e}")
+                            agent_response_chart_option = None
+
         # Append assistant's response to history.
         st.session_state[MESSAGE_HISTORY_KEY].append({"role": "assistant", "content": agent_response_text, "chart_option":agent_response_chart_option})
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Benchmark of the statement fetching done by `get_data_tables`: serial block reads against the concurrent `fetch_blocks`.
+
+Yahoo is replaced by a local stand-in ticker that sleeps for an injected latency on every block, and the statement
+cache is pointed at a throw-away directory so that every run is a cold fetch.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_get_data_tables --latency 0.4 --jitter 0.2 --repeats 5 --slow-block cashflow
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+os.environ["ANALYTICS_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_get_data_tables_") # Must be set before config.settings is imported.
+
+import pandas as pd
+
+from master_agent.sub_agents.data_chart_agent.statements import STATEMENT_BLOCKS, fetch_blocks, load_block
+
+
+class FakeTicker:
+    """Local stand-in for `yf.Ticker` that serves small synthetic blocks after an injected latency."""
+
+    def __init__(self, ticker: str, latency: float, jitter: float, slow_block: str = None, slow_latency: float = 0.0):
+        self.ticker = ticker
+        self._latency = latency
+        self._jitter = jitter
+        self._slow_block = slow_block
+        self._slow_latency = slow_latency
+
+    def _sleep(self, block: str):
+        delay = self._slow_latency if block == self._slow_block else self._latency + random.uniform(0, self._jitter)
+        time.sleep(delay)
+
+    @property
+    def info(self):
+        self._sleep("info")
+        return {"sector": "Financial Services", "marketCap": 12_000_000_000_000}
+
+    def _statement(self, block: str):
+        self._sleep(block)
+        periods = pd.to_datetime(["2025-03-31", "2024-03-31", "2023-03-31", "2022-03-31"])
+        return pd.DataFrame([[1.0e12, 0.9e12, 0.8e12, 0.7e12], [2.0e11, 1.8e11, 1.5e11, 1.2e11]],
+                            index=["Total Revenue", "Net Income"], columns=periods)
+
+    financials = property(lambda self: self._statement("financials"))
+    balance_sheet = property(lambda self: self._statement("balance_sheet"))
+    cashflow = property(lambda self: self._statement("cashflow"))
+    income_stmt = property(lambda self: self._statement("income_stmt"))
+
+
+def fetch_serial(ticker):
+    """The original behaviour of `get_data_tables`: one block after another."""
+    fetched, missing = dict(), dict()
+    for block in STATEMENT_BLOCKS:
+        try:
+            fetched[block] = load_block(ticker, block)
+        except Exception as e:
+            missing[block] = str(e)
+    return fetched, missing
+
+
+def run(label, fetch, args):
+    timings, missing = [], {}
+    for i in range(args.repeats):
+        # A fresh symbol on every run keeps the statement cache cold.
+        ticker = FakeTicker(f"BENCH{label}{i}", args.latency, args.jitter, args.slow_block, args.slow_latency)
+        start = time.perf_counter()
+        _, missing = fetch(ticker)
+        timings.append(time.perf_counter() - start)
+    print(f"{label:<12} mean {statistics.mean(timings):7.3f}s   min {min(timings):7.3f}s   max {max(timings):7.3f}s   missing {sorted(missing) or '-'}")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.4, help="Base latency in seconds injected on every block.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform random extra latency in seconds.")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of cold fetches per variant.")
+    parser.add_argument("--slow-block", default=None, choices=STATEMENT_BLOCKS, help="Block that is made pathologically slow.")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Latency in seconds of --slow-block.")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Per-block timeout of the concurrent variant.")
+    args = parser.parse_args()
+
+    print(f"{len(STATEMENT_BLOCKS)} blocks, latency {args.latency}s + U(0, {args.jitter})s, repeats {args.repeats}")
+    serial = run("serial", fetch_serial, args)
+    concurrent = run("concurrent", lambda ticker: fetch_blocks(ticker, timeout=args.timeout), args)
+    print(f"speedup      {serial / concurrent:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Offline benchmark of a whole turn: `root_agent` run through a `Runner` (with the SQLite session store and the
+TracingPlugin, as in the app) on a corpus of queries, by several concurrent clients going through `stream_adk_sync`.
+
+Nothing leaves the machine. Every agent's Gemini model is replaced by a stand-in that replays the recorded responses
+of fixtures/llm_responses.json (filled in from the corpus entry of the turn) with a configurable time to first token
+and streaming, google_search by a function tool serving fixtures/search_results.json, and `yf.Ticker` by a stand-in
+serving fixtures/statements.json after an injected latency. Caches live in a throw-away directory: the first pass over
+the corpus is cold, later passes (--passes) hit the statement and search caches. The answer cache is off unless
+--answer-cache is given.
+
+The report gives the throughput, the turn and first output (chart or answer text) latency percentiles, the per-stage
+percentiles collected by the tracer and the peak RSS. It can be saved as a baseline and compared against one, exiting
+with status 1 when a metric regresses by more than --max-regression, so performance changes can be checked in CI.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_pipeline --concurrency 4 --passes 2 --llm-latency-scale 0.5
+    python -m benchmarks.bench_pipeline --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --baseline benchmarks/baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import resource
+import string
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Dict, List
+
+# Must be set before config.settings is imported.
+os.environ["ANALYTICS_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_pipeline_")
+os.environ["TRACING_ENABLED"] = "1"
+os.environ["TRACING_METRICS_PORT"] = "0"
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "1" if "--answer-cache" in sys.argv else "0")
+
+import pandas as pd
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import Runner
+from google.genai import types
+
+from config.settings import APP_NAME_FOR_ADK
+from master_agent import root_agent
+from master_agent.sub_agents.content_retriever_agent import content_retriever_agent
+from master_agent.sub_agents.data_chart_agent import data_chart_agent
+from master_agent.sub_agents.query_input_agent import query_input_agent
+from master_agent.sub_agents.query_response_agent import query_response_agent
+from services import adk_service
+from services.admission import get_admission_controller
+from services.session_store import SqliteSessionService
+from services.tracing import TracingPlugin, get_tracer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+LLM_AGENTS = (query_input_agent, content_retriever_agent, data_chart_agent, query_response_agent)
+# Answers that mean the turn did not complete.
+FAILED_RESPONSES = (adk_service.DEFAULT_ERROR_RESPONSE, adk_service.TIMEOUT_RESPONSE, adk_service.BUSY_RESPONSE)
+# Metrics compared against a baseline, and whether a higher value is better.
+BASELINE_METRICS = {
+    "throughput_turns_per_second": True,
+    "turn.p50": False,
+    "turn.p95": False,
+    "first_output.p50": False,
+    "first_output.p95": False,
+    "peak_rss_mb": False,
+}
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """Reads the query corpus: one JSON object per line with the "query" and the details the stand-ins replay."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def turn_variables(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Values the placeholders ($user_query, $tickers, ...) of the recorded responses are filled with."""
+    companies = entry.get("companies", [])
+    line_items = entry.get("line_items", ["Total Revenue"])
+    country = entry.get("country", [])
+    market = entry.get("market", [])
+    return {
+        "user_query": entry["query"],
+        "relevance": entry.get("relevance", "yes"),
+        "companies": companies,
+        "company_names": " and ".join(companies) or "The companies",
+        "tickers": entry.get("tickers", []),
+        "country": country,
+        "country_names": ", ".join(country) or "the region",
+        "market": market,
+        "market_names": ", ".join(market) or "wider",
+        "line_items": line_items,
+        "line_item_names": ", ".join(line_items),
+        "statement": entry.get("statement", "financials"),
+        "chart_type": entry.get("chart_type", "grouped_bar"),
+        "last_n_periods": entry.get("last_n_periods", 4),
+        "title": entry.get("title") or f"{' vs '.join(companies)}: {', '.join(line_items)}",
+        "units": entry.get("units", "auto"),
+    }
+
+def fill(value: Any, variables: Dict[str, Any]) -> Any:
+    """Fills the placeholders of a recorded value; a string that is a single placeholder takes the raw value (e.g. a list)."""
+    if isinstance(value, dict):
+        return {key: fill(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, variables) for item in value]
+    if not isinstance(value, str):
+        return value
+    match = re.fullmatch(r"\$(\w+)", value)
+    if match and match.group(1) in variables:
+        return variables[match.group(1)]
+    text_values = {key: item if isinstance(item, str) else json.dumps(item) for key, item in variables.items()}
+    return string.Template(value).safe_substitute(text_values)
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ReplayLlm(BaseLlm):
+    """
+    Stand-in for the Gemini model of one agent that replays its recorded steps.
+
+    The turn is recognised by the user query found in the request, and the step by the number of tool responses the
+    agent has received since that query, so a tool calling agent walks through call, response, summary. Text is
+    streamed in chunks when the runner asks for streaming, followed by the aggregated response as Gemini does.
+    """
+    steps: List[Dict[str, Any]]
+    corpus: Dict[str, Dict[str, Any]]
+    ttft_seconds: float = 0.0
+    seconds_per_chunk: float = 0.0
+    chunk_chars: int = 48
+
+    def _turn(self, llm_request: LlmRequest):
+        # Returns the corpus entry of the turn and the index of the step to replay.
+        entry, tool_responses = None, 0
+        for content in llm_request.contents:
+            for part in content.parts or []:
+                if part.text and part.text in self.corpus:
+                    entry, tool_responses = self.corpus[part.text], 0
+                elif part.function_response:
+                    tool_responses += 1
+        return entry, tool_responses
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        entry, step_index = self._turn(llm_request)
+        step = self.steps[step_index] if entry is not None and step_index < len(self.steps) else {"text": "Done."}
+        step = fill(step, turn_variables(entry) if entry is not None else {})
+        prompt_text = str(llm_request.config.system_instruction or "") + "".join(
+            part.text or "" for content in llm_request.contents for part in content.parts or [])
+        await asyncio.sleep(self.ttft_seconds * random.uniform(0.8, 1.2))
+
+        if "function_call" in step:
+            call = types.FunctionCall(name=step["function_call"]["name"], args=step["function_call"]["args"])
+            yield self._response(types.Part(function_call=call), prompt_text, json.dumps(step["function_call"]))
+            return
+        text = step["text"]
+        if stream:
+            for start in range(0, len(text), self.chunk_chars):
+                if start:
+                    await asyncio.sleep(self.seconds_per_chunk)
+                yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text[start:start + self.chunk_chars])]), partial=True)
+        else:
+            await asyncio.sleep(self.seconds_per_chunk * (len(text) // self.chunk_chars))
+        yield self._response(types.Part(text=text), prompt_text, text)
+
+    @staticmethod
+    def _response(part: types.Part, prompt_text: str, output_text: str) -> LlmResponse:
+        return LlmResponse(
+            content=types.Content(role="model", parts=[part]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=estimate_tokens(prompt_text), candidates_token_count=estimate_tokens(output_text)),
+        )
+
+
+class FixtureTicker:
+    """Local stand-in for `yf.Ticker` that serves the recorded blocks of fixtures/statements.json after an injected latency."""
+
+    def __init__(self, ticker: str, statements: Dict[str, Any], latency: float, jitter: float):
+        self.ticker = ticker
+        self._blocks = statements.get(ticker, {})
+        self._latency = latency
+        self._jitter = jitter
+
+    def _sleep(self):
+        time.sleep(self._latency + random.uniform(0, self._jitter))
+
+    @property
+    def info(self):
+        self._sleep()
+        return dict(self._blocks.get("info", {}))
+
+    def _statement(self, block: str):
+        self._sleep()
+        if block not in self._blocks:
+            return pd.DataFrame()
+        frame = pd.DataFrame(**self._blocks[block])
+        frame.columns = pd.to_datetime(frame.columns)
+        return frame
+
+    financials = property(lambda self: self._statement("financials"))
+    balance_sheet = property(lambda self: self._statement("balance_sheet"))
+    cashflow = property(lambda self: self._statement("cashflow"))
+    income_stmt = property(lambda self: self._statement("income_stmt"))
+
+
+def make_search_tool(results: List[Dict[str, Any]], latency: float):
+    """Returns the stand-in google_search tool, which ranks the recorded results by keyword overlap with the query."""
+
+    async def google_search(query: str) -> Dict:
+        '''
+            Tool that searches trusted online blogs and industry reports.
+
+            Input:
+                query (str): Search query.
+            Output:
+                Returns a dictionary with the "results" found: title, url and snippet of each one.
+        '''
+        await asyncio.sleep(latency)
+        words = set(re.findall(r"[a-z0-9]+", query.lower()))
+        ranked = sorted(results, key=lambda result: -len(words & set(result["keywords"])))
+        return {"status": "success", "results": [
+            {key: result[key] for key in ("title", "url", "snippet")} for result in ranked[:3] if words & set(result["keywords"])
+        ]}
+
+    return google_search
+
+def install_stand_ins(args, corpus: List[Dict[str, Any]]) -> None:
+    """Swaps the models, google_search and yfinance of the pipeline for the local stand-ins."""
+    with open(os.path.join(FIXTURES_DIR, "llm_responses.json"), encoding="utf-8") as f:
+        recorded = json.load(f)
+    with open(os.path.join(FIXTURES_DIR, "statements.json"), encoding="utf-8") as f:
+        statements = json.load(f)
+    with open(os.path.join(FIXTURES_DIR, "search_results.json"), encoding="utf-8") as f:
+        search_results = json.load(f)
+
+    by_query = {entry["query"]: entry for entry in corpus}
+    for agent in LLM_AGENTS:
+        model = recorded[agent.name]
+        agent.model = ReplayLlm(
+            model=agent.model if isinstance(agent.model, str) else agent.model.model, # Keeps the model labels of the traces.
+            steps=model["steps"],
+            corpus=by_query,
+            ttft_seconds=model["ttft_seconds"] * args.llm_latency_scale,
+            seconds_per_chunk=model["seconds_per_chunk"] * args.llm_latency_scale,
+        )
+    # The built-in google_search only runs inside Gemini, so it is replaced by a function tool of the same name.
+    content_retriever_agent.tools = [make_search_tool(search_results, args.search_latency)]
+    data_chart_module = importlib.import_module("master_agent.sub_agents.data_chart_agent.agent")
+    data_chart_module.make_ticker = lambda symbol: FixtureTicker(symbol.strip().upper(), statements, args.yahoo_latency, args.yahoo_jitter)
+
+
+def run_turn(runner: Runner, index: int, query: str) -> Dict[str, Any]:
+    """Runs one turn in its own session, as a new browser session would, and times it from the client side."""
+    user_id, session_id = f"bench_user_{index}", f"bench_session_{index}"
+    adk_service.run_coroutine(adk_service.create_adk_session(runner.session_service, user_id, session_id))
+    started = time.perf_counter()
+    first_output, response = None, None
+    for update in adk_service.stream_adk_sync(runner, user_id, session_id, query):
+        if update.kind in ("chart", "text") and first_output is None:
+            first_output = time.perf_counter() - started
+        elif update.kind == "done":
+            response = update.value[0]
+    seconds = time.perf_counter() - started
+    return {"query": query, "seconds": seconds, "first_output": first_output if first_output is not None else seconds,
+            "ok": response not in FAILED_RESPONSES}
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+    return {f"p{q}": round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 4) for q in (50, 95, 99)}
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1) # Bytes on macOS, KiB on Linux.
+
+def run(args) -> Dict[str, Any]:
+    corpus = load_corpus(args.corpus)
+    install_stand_ins(args, corpus)
+    get_admission_controller().max_concurrent = args.slots
+    runner = Runner(
+        app_name=APP_NAME_FOR_ADK,
+        agent=root_agent,
+        session_service=SqliteSessionService(os.path.join(os.environ["ANALYTICS_CACHE_DIR"], "bench_sessions.sqlite3")),
+        plugins=[TracingPlugin()],
+    )
+    queries = [entry["query"] for _ in range(args.passes) for entry in corpus]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bench_client") as clients:
+        turns = list(clients.map(lambda item: run_turn(runner, *item), enumerate(queries)))
+    wall_seconds = time.perf_counter() - started
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("json_out", "save_baseline", "baseline")},
+        "turns": len(turns),
+        "failed_turns": sum(not turn["ok"] for turn in turns),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_turns_per_second": round(len(turns) / wall_seconds, 3),
+        "turn": percentiles([turn["seconds"] for turn in turns]),
+        "first_output": percentiles([turn["first_output"] for turn in turns]),
+        "stages": get_tracer().percentiles(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def metric(report: Dict[str, Any], name: str) -> float:
+    value = report
+    for key in name.split("."):
+        value = value[key]
+    return value
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Returns a line per metric that is worse than the baseline by more than `max_regression` (a fraction)."""
+    found = []
+    for name, higher_is_better in BASELINE_METRICS.items():
+        current, previous = metric(report, name), metric(baseline, name)
+        if not previous:
+            continue
+        change = (previous - current) / previous if higher_is_better else (current - previous) / previous
+        if change > max_regression:
+            found.append(f"{name}: {previous} -> {current} ({change:+.0%} worse)")
+    return found
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"turns {report['turns']} (failed {report['failed_turns']}) in {report['wall_seconds']:.2f}s   "
+          f"throughput {report['throughput_turns_per_second']:.2f} turns/s   peak RSS {report['peak_rss_mb']:.1f} MB")
+    for label in ("turn", "first_output"):
+        print(f"{label:<40} " + "   ".join(f"{q} {value:7.3f}s" for q, value in report[label].items()))
+    print("stages:")
+    for stage, stats in report["stages"].items():
+        print(f"  {stage:<38} n {stats['count']:<5} " + "   ".join(f"{q} {stats[q]:7.3f}s" for q in ("p50", "p95", "p99")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(FIXTURES_DIR, "queries.jsonl"), help="Query corpus, one JSON object per line.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of clients sending turns at the same time.")
+    parser.add_argument("--slots", type=int, default=get_admission_controller().max_concurrent,
+                        help="Turns the admission controller lets run at once (ADMISSION_MAX_CONCURRENT_TURNS).")
+    parser.add_argument("--passes", type=int, default=1, help="Times the corpus is sent; passes after the first run on warm caches.")
+    parser.add_argument("--llm-latency-scale", type=float, default=1.0, help="Factor applied to the recorded time to first token and per chunk delay.")
+    parser.add_argument("--search-latency", type=float, default=0.4, help="Seconds the stand-in google_search takes.")
+    parser.add_argument("--yahoo-latency", type=float, default=0.3, help="Base latency in seconds of every yfinance block.")
+    parser.add_argument("--yahoo-jitter", type=float, default=0.2, help="Random extra latency (0 to jitter) of every yfinance block.")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache on (repeated queries skip the pipeline).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latency jitter.")
+    parser.add_argument("--json-out", help="Write the report to this JSON file.")
+    parser.add_argument("--save-baseline", help="Write the report to this JSON file as the baseline of later runs.")
+    parser.add_argument("--baseline", help="Compare against this baseline report and exit with status 1 on a regression.")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed relative regression of each baseline metric.")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = run(args)
+    print_report(report)
+    for path in (args.json_out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"report written to {path}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+        print(f"no regression beyond {args.max_regression:.0%} against {args.baseline}")
+    if report["failed_turns"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
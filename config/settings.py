@@ -9,17 +9,116 @@ logging.basicConfig(level=logging.ERROR)
 # MODEL_GEMINI = "gemini-2.0-flash"
 
 APP_NAME_FOR_ADK = "business_analytics_chatapp" # A unique name for your application within ADK, used for session management.
-USER_ID = "drs" # A default user ID. In a real application, this would be dynamic (e.g., from a login system).
 # Defines the initial state for new ADK sessions. This provides default values for user information.
 INITIAL_STATE = {
     "user_name": "Evil Dr. S",
     "query_key_params": {},
     "retrieved_content": "",
     "chart_objects": [],
+    "response_context": "",
+    "chart_summary": "",
     "query_response": ""
 }
 MESSAGE_HISTORY_KEY = "messages_final_mem_v2" # Key used by Streamlit to store the chat history in its session state.
 ADK_SESSION_KEY = "adk_session_id" # Key used by Streamlit to store the unique ADK session ID.
+ADK_USER_KEY = "adk_user_id" # Key used by Streamlit to store the ADK user ID of the browser session (there is no login).
+ADK_TURN_TIMEOUT_SECONDS = float(os.environ.get("ADK_TURN_TIMEOUT_SECONDS", "180")) # A turn still running this long after it was submitted (queue wait included) is cancelled.
+ADMISSION_MAX_CONCURRENT_TURNS = int(os.environ.get("ADMISSION_MAX_CONCURRENT_TURNS", "4")) # Pipeline runs executing at the same time, across all users.
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32")) # Turns allowed to wait for a slot; further ones are turned away.
+ADMISSION_QUEUE_TIMEOUT_SECONDS = 120 # A turn that waited this long for a slot is given up.
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # Root folder of the repository.
+# Offline listing (symbol, name, aliases) used to resolve company names to exchange tickers without calling the LLM.
+SYMBOL_LISTING_PATH = os.environ.get("SYMBOL_LISTING_PATH", os.path.join(PROJECT_DIR, "data", "symbol_listings.csv"))
+SYMBOL_MATCH_MIN_SCORE = 0.5 # Minimum trigram similarity (0-1) for a fuzzy company name match.
+SYMBOL_MATCH_MIN_CHARS = 4 # Shorter names ("Inf", "Ban") only resolve on an exact match, not a prefix or fuzzy one.
+
+# Local pre-filter in front of query_input_agent: clear on/off-topic queries are settled in-process, only ambiguous ones reach the LLM.
+PREFILTER_ENABLED = os.environ.get("PREFILTER_ENABLED", "1") == "1"
+PREFILTER_SEED_PATH = os.path.join(PROJECT_DIR, "data", "prefilter_seed.csv") # Labelled queries (1 = on-topic) the linear model is trained on.
+PREFILTER_ON_TOPIC_THRESHOLD = 0.9 # Minimum probability for a query to be accepted without the LLM.
+PREFILTER_OFF_TOPIC_THRESHOLD = 0.1 # Maximum probability for a query to be declined without the LLM.
+
+# Local on-disk caches live here. They are shared by every Streamlit session (and process) running on the host.
+CACHE_DIR = os.environ.get("ANALYTICS_CACHE_DIR", os.path.join(PROJECT_DIR, ".cache"))
+FUNDAMENTALS_CACHE_PATH = os.path.join(CACHE_DIR, "fundamentals.sqlite3") # SQLite file holding the yfinance statement blocks.
+FUNDAMENTALS_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Least recently used entries are evicted once the cache grows beyond this size.
+# Time-to-live (in seconds) of each yfinance block. Company info (market cap) moves every day, statements only change on results.
+FUNDAMENTALS_CACHE_TTLS = {
+    "info": 6 * 60 * 60,
+    "financials": 24 * 60 * 60,
+    "balance_sheet": 24 * 60 * 60,
+    "cashflow": 24 * 60 * 60,
+    "income_stmt": 24 * 60 * 60,
+    "quarterly_financials": 24 * 60 * 60,
+    "quarterly_balance_sheet": 24 * 60 * 60,
+    "quarterly_cashflow": 24 * 60 * 60,
+    "quarterly_income_stmt": 24 * 60 * 60,
+}
+# Statements of a ticker whose report calendar is known ignore the TTLs above: they stay valid until its next expected report.
+EARNINGS_REPORT_LAG_DAYS = 60 # Expected days between the end of a fiscal quarter and its results, when Yahoo announced no earnings date.
+STATEMENT_EMPTY_BLOCK_TTL_SECONDS = 6 * 60 * 60 # A block Yahoo returned empty is not warmed again for this long (user turns still retry it).
+STATEMENT_REVALIDATE_SECONDS = 6 * 60 * 60 # Once the report date has passed, the newest period of a frequency is checked at most this often.
+STATEMENT_FETCH_WORKERS = 8 # Size of the thread pool that fetches the yfinance blocks of a ticker concurrently.
+STATEMENT_BLOCK_TIMEOUT_SECONDS = 10 # A block that is not fetched within this time is reported as missing instead of stalling the tool.
+METRICS_MEMO_MAX_ENTRIES = 512 # Derived metrics of this many (ticker, frequency, statement snapshot) are kept in memory.
+PRICE_STORE_DIR = os.path.join(CACHE_DIR, "prices") # Daily OHLCV per ticker, one memory-mapped file per column.
+PRICE_HISTORY_INITIAL_PERIOD = "5y" # History downloaded the first time a ticker is asked about; later refreshes only append.
+PRICE_REFRESH_SECONDS = 60 * 60 # Stored prices younger than this are served without asking Yahoo for new bars.
+PRICE_CHART_MAX_POINTS = 260 # Price charts switch to weekly, then monthly bars to stay under this many points per series.
+SEARCH_CACHE_PATH = os.path.join(CACHE_DIR, "search.sqlite3") # SQLite file (with an FTS5 index) holding google_search results.
+SEARCH_CACHE_TTL_SECONDS = 30 * 60 # Search results are news: they are served as fresh for this long only.
+SEARCH_CACHE_MAX_STALE_SECONDS = 6 * 60 * 60 # Older results are kept this long and only served when no fresh search can be made.
+SEARCH_CACHE_MIN_OVERLAP = 0.6 # Minimum token overlap (Jaccard) for a full-text match to be served for a different query.
+SEARCH_CACHE_MAX_ENTRIES = 5000 # Oldest results are pruned beyond this count.
+SINGLE_FLIGHT_SEARCH_WAIT_SECONDS = 30 # A search waiting on the identical search of another session makes its own after this long.
+# Outbound calls (services/resilience.py): a token bucket per upstream (requests per second, burst), retries with jittered
+# exponential backoff on throttling and transient errors, and a circuit breaker while which callers serve stale cache.
+UPSTREAM_LIMITS = {
+    "gemini": {"rate_per_second": 5.0, "burst": 10},
+    "google_search": {"rate_per_second": 2.0, "burst": 4},
+    "yfinance": {"rate_per_second": 10.0, "burst": 20},
+}
+RETRY_MAX_ATTEMPTS = 4 # Attempts per call, the first one included.
+RETRY_BASE_DELAY_SECONDS = 0.5 # Retry n waits a random time up to min(RETRY_MAX_DELAY_SECONDS, base * 2 ** n).
+RETRY_MAX_DELAY_SECONDS = 8.0
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive transient failures that open the circuit of an upstream.
+CIRCUIT_RESET_SECONDS = 30 # An open circuit fails fast for this long, then lets one trial call through.
+# Background warm-up (services/prefetch.py) of the statement, price and search caches for the names the analysts cover.
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_WATCHLIST_PATH = os.environ.get("PREFETCH_WATCHLIST_PATH", os.path.join(PROJECT_DIR, "data", "watchlist.txt")) # One ticker per line.
+PREFETCH_INTERVAL_SECONDS = 60 * 60 # A pass over the watchlist runs at start-up and then this long after the previous one started.
+PREFETCH_REQUESTS_PER_MINUTE = 60 # Upstream requests (statement block, price refresh, search) the warmer makes per minute at most.
+PREFETCH_MAX_RUNNING_TURNS = 1 # The warmer pauses while more interactive turns than this are running, or any turn is waiting.
+PREFETCH_SEARCH_ENABLED = os.environ.get("PREFETCH_SEARCH_ENABLED", "0") == "1" # Search warming makes a paid Gemini call per ticker and pass, it is opt-in.
+PREFETCH_SEARCH_QUERY = "{company} latest news and quarterly results" # Search warmed per ticker ("" disables search warming).
+PREFETCH_SEARCH_LOCALES = {".NS": "India", ".BO": "India"} # Country of the warmed search by ticker suffix, "global" otherwise.
+
+# In-process cache of final answers, checked before the agent pipeline runs. Repeated and near-duplicate questions are served from it.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL_SECONDS = 60 * 60 # Answers include news, so they are not reused for longer than this.
+ANSWER_CACHE_MAX_ENTRIES = 512 # Least recently used answers are evicted beyond this count.
+ANSWER_CACHE_MIN_SIMILARITY = 0.7 # Minimum estimated Jaccard similarity of two questions about the same companies to share an answer.
+# Durable ADK sessions (services/session_store.py): SQLite on disk, only recently active sessions are kept in memory.
+SESSION_STORE_PATH = os.path.join(CACHE_DIR, "sessions.sqlite3")
+SESSION_CACHE_MAX_SESSIONS = 256 # Hot sessions kept in memory, the least recently used ones are evicted to disk beyond this count.
+SESSION_MAX_EVENTS_IN_MEMORY = 100 # Most recent events kept in memory (and returned by get_session) per session, older ones stay on disk.
+SESSION_TTL_SECONDS = 24 * 60 * 60 # Sessions idle for longer than this are expired and deleted.
+SESSION_STORE_BATCH_SIZE = 64 # Pending writes that trigger a flush, otherwise writes are flushed every SESSION_STORE_FLUSH_INTERVAL_SECONDS.
+SESSION_STORE_FLUSH_INTERVAL_SECONDS = 1.0
+# Tracing of the agent pipeline (services/tracing.py): spans are written as JSONL, stage latencies are served as Prometheus text.
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") == "1"
+TRACE_JSONL_PATH = os.path.join(CACHE_DIR, "traces.jsonl")
+TRACE_JSONL_MAX_BYTES = 64 * 1024 * 1024 # The JSONL file is rotated (to traces.jsonl.1) beyond this size.
+TRACE_EXPORT_FLUSH_INTERVAL_SECONDS = 1.0 # Finished spans are written to the JSONL file in batches, by a background thread, this often.
+TRACE_EXPORT_MAX_PENDING = 10000 # Spans waiting to be written beyond this count are dropped (and counted) rather than held in memory.
+TRACING_RESERVOIR_SIZE = 2048 # Most recent durations per stage the p50/p95/p99 are computed over.
+TRACING_METRICS_PORT = int(os.environ.get("TRACING_METRICS_PORT", "9464")) # Port of the /metrics endpoint, 0 disables it.
+TRACING_METRICS_HOST = os.environ.get("TRACING_METRICS_HOST", "127.0.0.1") # Interface /metrics listens on, e.g. "0.0.0.0" for a Prometheus on another host.
+# Prompt budget of query_response_agent: the search content is chunked, de-duplicated, ranked (BM25) and packed up to this many tokens.
+RESPONSE_CONTEXT_TOKEN_BUDGET = int(os.environ.get("RESPONSE_CONTEXT_TOKEN_BUDGET", "1200"))
+RESPONSE_CHUNK_MAX_TOKENS = 120 # Longer passages of the search content are split on sentences into chunks of about this size.
+RESPONSE_DEDUP_MIN_SIMILARITY = 0.6 # Chunks whose word 3-gram overlap (Jaccard) with a kept chunk reaches this are dropped as near-duplicates.
 def get_api_key():
     """Retrieves the Google API Key from environment variables."""
     api_key = os.environ.get("GOOGLE_API_KEY")
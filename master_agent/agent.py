@@ -1,11 +1,19 @@
-from google.adk.agents import SequentialAgent
+from google.adk.agents import ParallelAgent, SequentialAgent
 from .sub_agents.query_input_agent import query_input_agent
 from .sub_agents.content_retriever_agent import content_retriever_agent
 from .sub_agents.data_chart_agent import data_chart_agent
 from .sub_agents.query_response_agent import query_response_agent
 
+# Both stages only read query_key_params and write their own state key (retrieved_content / chart_objects),
+# so they run concurrently and the turn waits for max(retrieval, chart) instead of their sum.
+research_agent = ParallelAgent(
+    name="research_agent",
+    description="Runs content retrieval and data/chart extraction concurrently.",
+    sub_agents=[content_retriever_agent, data_chart_agent],
+)
+
 root_agent = SequentialAgent(
     name="master_agent",
     description="Master Pipeline that orchestrates the sequences of sub agents.",
-    sub_agents=[query_input_agent, content_retriever_agent, data_chart_agent, query_response_agent],
+    sub_agents=[query_input_agent, research_agent, query_response_agent],
 )
\ No newline at end of file
@@ -1,9 +1,24 @@
 from google.adk.agents import LlmAgent
 from google.adk.tools import google_search
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
 from google.genai import types
-from typing import Optional
-import json
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from config.settings import SINGLE_FLIGHT_SEARCH_WAIT_SECONDS
+from .search_cache import get_search_cache
+from services.resilience import ResilientGemini
+from services.single_flight import get_single_flight
+from services.tracing import traced_callback
+from ..query_input_agent.params import get_query_key_params
+
+# Searches made by this process, by invocation (key, future, monotonic time claimed): the identical searches of other
+# sessions wait for their result.
+_search_flight = get_single_flight("search", abandon_after=SINGLE_FLIGHT_SEARCH_WAIT_SECONDS)
+_search_claims: Dict[str, Tuple[str, Future, float]] = dict()
 
 def irrelevant_user_query_check(callback_context: CallbackContext) -> Optional[types.Content]:
     """
@@ -19,21 +34,13 @@ def irrelevant_user_query_check(callback_context: CallbackContext) -> Optional[t
     state = callback_context.state
     agent_name = callback_context.agent_name
 
-    if "query_key_params" not in state:
+    query_key_params = get_query_key_params(state)
+    if query_key_params is None:
         print("Warning: query_key_params not found in ADK state.")
         return None
-    
-    query_key_params = state["query_key_params"].strip().removeprefix("```json").removesuffix("```").strip()
-    try:
-        query_key_params = json.loads(query_key_params)
-    except Exception as e:
-        print("Error: caught during json.loads in callback function of {agent_name}.")
-    if "relevance" not in query_key_params:
-        print("Warning: relevance not in query_key_params.")
-        return None
 
-    if query_key_params["relevance"].lower().strip() == "no":
-        print("Info: User Query is outside the App's capabilities.\nSkipping the {agent_name}.")
+    if not query_key_params.is_relevant:
+        print(f"Info: User Query is outside the App's capabilities.\nSkipping the {agent_name}.")
         state["retrieved_content"] = ""
         return types.Content(
             parts=[types.Part(text=f"Agent {agent_name} skipped by before_agent_callback due to state.")],
@@ -42,11 +49,131 @@ def irrelevant_user_query_check(callback_context: CallbackContext) -> Optional[t
     else:
         print(f"Info: [Callback] State condition not met: Proceeding with agent {agent_name}.")
         return None
+
+def _search_query(state) -> Tuple[str, str, List[str]]:
+    """Returns the (query, locale, tickers) the google_search results of this turn are cached under."""
+    query_key_params = get_query_key_params(state)
+    if query_key_params is None:
+        return "", "global", []
+    locale = query_key_params.country[0] if query_key_params.country else "global"
+    return query_key_params.user_query, locale, query_key_params.tickers
+
+def _release_search(invocation_id: str, text: str = "", error: Optional[BaseException] = None) -> None:
+    """Hands the result of a search this invocation made to the identical searches waiting on it."""
+    claim = _search_claims.pop(invocation_id, None)
+    if claim is not None:
+        _search_flight.resolve(claim[0], claim[1], text, error)
+
+def _prune_search_claims() -> None:
+    """
+    Gives up the searches of invocations that never released them, e.g. a turn abandoned mid-search, once the identical
+    searches have stopped waiting on them (SINGLE_FLIGHT_SEARCH_WAIT_SECONDS).
+    """
+    expired = time.monotonic() - SINGLE_FLIGHT_SEARCH_WAIT_SECONDS
+    for invocation_id in [invocation_id for invocation_id, claim in list(_search_claims.items()) if claim[2] < expired]:
+        _release_search(invocation_id, error=TimeoutError(f"search not released within {SINGLE_FLIGHT_SEARCH_WAIT_SECONDS}s"))
+
+async def serve_cached_search(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    Callback that answers from the search cache when the same or a close query was searched recently, or with the
+    result of the identical search another session is making right now.
+
+    google_search is a built-in tool executed by Gemini itself, so the cache and the coalescing sit around the model
+    call: the first session to miss the cache makes the search and the others wait for it (at most
+    SINGLE_FLIGHT_SEARCH_WAIT_SECONDS, then they search themselves).
+
+    Args:
+        callback_context: Contains state and context information.
+        llm_request: The request about to be sent to the model.
+
+    Returns:
+        None to call the model (and google_search).
+        LlmResponse with the cached search result to skip the model call.
+    """
+    _prune_search_claims()
+    query, locale, tickers = _search_query(callback_context.state)
+    search_cache = get_search_cache()
+    cached = search_cache.lookup(query, locale, tickers=tickers)
+    if cached is None:
+        key = search_cache.cache_key(query, locale, tickers)
+        if key is None or callback_context.invocation_id in _search_claims:
+            return None
+        future, leader = _search_flight.claim(key)
+        if leader:
+            _search_claims[callback_context.invocation_id] = (key, future, time.monotonic())
+            return None
+        try:
+            text = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), SINGLE_FLIGHT_SEARCH_WAIT_SECONDS)
+        except Exception as e:
+            print(f"Info: [Callback] identical search in flight gave no result ({type(e).__name__}), searching in {callback_context.agent_name}.")
+            return None
+        if not text:
+            return None
+        print(f"Info: [Callback] search coalesced with an identical search in flight in {callback_context.agent_name}. Stats: {_search_flight.stats()}")
+        return LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            custom_metadata={"search_cache": "coalesced"},
+        )
+    print(f"Info: [Callback] search cache {cached.match} hit ({cached.age_seconds:.0f}s old) in {callback_context.agent_name}. Stats: {search_cache.stats()}")
+    return LlmResponse(
+        content=types.Content(role="model", parts=[types.Part(text=cached.response)]),
+        custom_metadata={"search_cache": cached.match},
+    )
+
+def store_search_result(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """
+    Callback that stores the final, search grounded text of the model in the search cache.
+
+    Returns:
+        None to keep the model response unchanged.
+    """
+    if llm_response.partial or (llm_response.custom_metadata or {}).get("search_cache"):
+        return None
+    if not llm_response.content or not llm_response.content.parts:
+        return None
+    if any(part.function_call for part in llm_response.content.parts):
+        return None
+    text = "".join(part.text for part in llm_response.content.parts if part.text and not part.thought)
+    query, locale, tickers = _search_query(callback_context.state)
+    get_search_cache().store(query, text, locale, tickers)
+    _release_search(callback_context.invocation_id, text)
+    return None
+
+def serve_stale_search(callback_context: CallbackContext, llm_request: LlmRequest, error: Exception) -> Optional[LlmResponse]:
+    """
+    Callback that answers with a stale cached result of the search when the model call (and google_search) failed,
+    e.g. after its retries or while its circuit is open. The sessions waiting on the search of this invocation are
+    released to search themselves.
+
+    Returns:
+        LlmResponse with the stale search result, or None to let the error propagate when there is none.
+    """
+    _release_search(callback_context.invocation_id, error=error)
+    query, locale, tickers = _search_query(callback_context.state)
+    cached = get_search_cache().lookup(query, locale, allow_stale=True, tickers=tickers)
+    if cached is None:
+        return None
+    print(f"Warning: google_search failed ({type(error).__name__}: {error}), serving a {cached.age_seconds / 60:.0f} min old result in {callback_context.agent_name}.")
+    return LlmResponse(
+        content=types.Content(role="model", parts=[types.Part(text=cached.response)]),
+        custom_metadata={"search_cache": "stale"},
+    )
+
+def release_search(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Callback that releases a search of this invocation which ended without a result, e.g. an empty model response.
+
+    Returns:
+        None to keep the agent output unchanged.
+    """
+    _release_search(callback_context.invocation_id)
+    return None
     
 
 content_retriever_agent = LlmAgent(
     name="content_retriever_agent",
-    model="gemini-2.0-flash",
+    # google_search runs inside these model calls: they are rate limited and circuit broken as the "google_search" upstream.
+    model=ResilientGemini(model="gemini-2.0-flash", upstream="google_search"),
     description="Agent that gather contents from online trusted sources.",
     instruction="""You will have access to trusted online blogs and industry reports.
     Based on the user query, you will first have to generate key tokens that will help you serach relevant content.
@@ -54,5 +181,9 @@ content_retriever_agent = LlmAgent(
     """,
     tools=[google_search],
     output_key="retrieved_content",
-    before_agent_callback=irrelevant_user_query_check,
+    before_agent_callback=traced_callback(irrelevant_user_query_check),
+    before_model_callback=traced_callback(serve_cached_search),
+    after_model_callback=traced_callback(store_search_result),
+    on_model_error_callback=traced_callback(serve_stale_search),
+    after_agent_callback=traced_callback(release_search),
 )
\ No newline at end of file
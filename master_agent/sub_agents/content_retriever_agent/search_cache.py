@@ -0,0 +1,241 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from config.settings import (
+    SEARCH_CACHE_PATH, SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_MAX_STALE_SECONDS, SEARCH_CACHE_MIN_OVERLAP, SEARCH_CACHE_MAX_ENTRIES
+)
+from services.symbol_index import SymbolIndex, get_symbol_index
+
+# Words that do not change what a search returns.
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "at", "to", "and", "or", "is", "are", "was", "were", "be", "what", "whats",
+    "how", "has", "have", "had", "did", "does", "do", "me", "show", "tell", "about", "please", "give", "its", "their",
+    "this", "that", "with", "by", "from", "as", "can", "you", "i", "my", "which",
+}
+# Words that do not change the subject of a search: two queries may differ in these only. Every other word (a metric,
+# a sector, a period such as 2024 or q4) must be the same in both for one to be served the other's result.
+GENERIC_WORDS = {
+    "latest", "recent", "current", "today", "now", "news", "update", "updates", "headlines", "trend", "trends",
+    "results", "result", "quarterly", "report", "reports", "analysis", "outlook", "performance", "overview", "summary",
+    "developments", "announcements",
+}
+
+
+def query_tokens(query: str) -> List[str]:
+    """Normalised search tokens of a query: lower-cased words without stopwords, de-duplicated and sorted."""
+    words = re.findall(r"[a-z0-9]+", query.lower().replace("'s", ""))
+    return sorted({word for word in words if word not in STOPWORDS})
+
+def company_key(tickers: Sequence[str]) -> str:
+    """Companies a search is about: its tickers without exchange suffix, lower-cased and sorted ("INFY.NS" -> "infy")."""
+    return " ".join(sorted({ticker.strip().lower().rsplit(".", 1)[0] for ticker in tickers if ticker.strip()}))
+
+def search_terms(query: str, tickers: Sequence[str] = (), index: Optional[SymbolIndex] = None) -> Tuple[str, List[str]]:
+    """
+    Returns the (company key, tokens) a search is cached under. Ticker words ("infy", "ns") and the words of the company
+    names the query mentions ("hdfc", "bank", found with `index`) are left out of the tokens: they are the same for
+    every search about the same companies and would make any two of them look close.
+    """
+    company_tokens = set(query_tokens(" ".join(tickers)))
+    if index is not None:
+        company_tokens.update(word for name, _ in index.find_in_text(query) for word in name.split())
+    return company_key(tickers), [token for token in query_tokens(query) if token not in company_tokens]
+
+def specific_terms(tokens: Sequence[str]) -> Set[str]:
+    """Tokens that set the subject of a search (metrics, sectors, periods): all but the GENERIC_WORDS."""
+    return {token for token in tokens if token not in GENERIC_WORDS}
+
+
+class CachedSearch(NamedTuple):
+    response: str
+    age_seconds: float
+    match: str # "exact" or "fulltext".
+    stale: bool
+
+
+class SearchCache:
+    """
+    On-disk cache of google_search backed answers of content_retriever_agent.
+
+    Entries are keyed on the companies searched (their tickers), the normalised query tokens and a locale. Searches
+    that resolved no tickers (e.g. a follow-up such as "and its outlook?") are neither cached nor served. Exact keys
+    are looked up directly and close queries through an SQLite FTS5 index ranked with bm25, accepted when they are
+    about the same set of companies, have the same specific terms (metrics, sectors, periods) and their token overlap
+    reaches `min_overlap`.
+    Results younger than `ttl_seconds` are fresh; stale results (up to `max_stale_seconds`) are only served when the
+    caller allows it, e.g. when the upstream is unavailable. Hits, stale serves and refreshes are counted host-wide.
+    Every lookup that finds a result, fresh or not, records when it was asked for (`looked_up_at`), so that the
+    prefetcher only refreshes the searches users actually make.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_PATH,
+                 ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+                 max_stale_seconds: float = SEARCH_CACHE_MAX_STALE_SECONDS,
+                 min_overlap: float = SEARCH_CACHE_MIN_OVERLAP,
+                 max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+                 index: Optional[SymbolIndex] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.min_overlap = min_overlap
+        self.max_entries = max_entries
+        self.index = index
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS searches (
+                id INTEGER PRIMARY KEY,
+                cache_key TEXT NOT NULL UNIQUE,
+                locale TEXT NOT NULL,
+                companies TEXT NOT NULL,
+                tokens TEXT NOT NULL,
+                response TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                looked_up_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS searches_fts USING fts5(tokens, content='searches', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS searches_ai AFTER INSERT ON searches BEGIN
+                INSERT INTO searches_fts(rowid, tokens) VALUES (new.id, new.tokens);
+            END;
+            CREATE TRIGGER IF NOT EXISTS searches_ad AFTER DELETE ON searches BEGIN
+                INSERT INTO searches_fts(searches_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+            END;
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """
+        )
+
+    def cache_key(self, query: str, locale: str = "global", tickers: Sequence[str] = ()) -> Optional[str]:
+        """Key of the exact search, or None when it is not cached: the query resolved no tickers."""
+        companies, tokens = search_terms(query, tickers, self.index)
+        if not companies:
+            return None
+        return f"{locale.strip().lower() or 'global'}|{companies}|{' '.join(tokens)}"
+
+    def lookup(self, query: str, locale: str = "global", allow_stale: bool = False,
+               tickers: Sequence[str] = ()) -> Optional[CachedSearch]:
+        """
+        Returns the cached result of the same or a close query about the same companies in the same locale, or None.
+
+        Args:
+            query: Text the search is made for.
+            locale: Country or market the results are about, "global" if none.
+            allow_stale: Also serve results older than the TTL (but younger than the max staleness).
+            tickers: Tickers of the companies the search is about. A result is never served for other companies.
+        """
+        key = self.cache_key(query, locale, tickers)
+        if key is None:
+            return None
+        companies, tokens = search_terms(query, tickers, self.index)
+        locale = locale.strip().lower() or "global"
+        now = time.time()
+        max_age = self.max_stale_seconds if allow_stale else self.ttl_seconds
+        with self._lock:
+            # Results are looked for up to the max staleness so that the search is recorded as asked for even when
+            # it is too old to be served; fresh candidates are ranked first.
+            row = self._conn.execute(
+                "SELECT id, response, stored_at FROM searches WHERE cache_key = ? AND stored_at >= ?",
+                (key, now - self.max_stale_seconds),
+            ).fetchone()
+            match = "exact"
+            if row is None and tokens:
+                match = "fulltext"
+                fts_query = " OR ".join(f'"{token}"' for token in tokens)
+                for search_id, response, stored_at, candidate in self._conn.execute(
+                    """SELECT s.id, s.response, s.stored_at, s.tokens FROM searches_fts f JOIN searches s ON s.id = f.rowid
+                       WHERE searches_fts MATCH ? AND s.locale = ? AND s.companies = ? AND s.stored_at >= ?
+                       ORDER BY s.stored_at >= ? DESC, bm25(searches_fts) LIMIT 5""",
+                    (fts_query, locale, companies, now - self.max_stale_seconds, now - max_age),
+                ):
+                    candidate = set(candidate.split())
+                    if specific_terms(candidate) != specific_terms(tokens):
+                        continue
+                    if len(candidate & set(tokens)) / len(candidate | set(tokens)) >= self.min_overlap:
+                        row = (search_id, response, stored_at)
+                        break
+            if row is not None:
+                self._conn.execute("UPDATE searches SET looked_up_at = ? WHERE id = ?", (now, row[0]))
+            if row is None or now - row[2] > max_age:
+                self._bump_counter("misses")
+                return None
+            stale = now - row[2] > self.ttl_seconds
+            self._bump_counter("stale_serves" if stale else f"{match}_hits")
+        return CachedSearch(row[1], now - row[2], match, stale)
+
+    def is_fresh(self, query: str, locale: str = "global", tickers: Sequence[str] = ()) -> bool:
+        """Whether the exact query has a fresh result, without counting a lookup (used by the prefetcher)."""
+        key = self.cache_key(query, locale, tickers)
+        if key is None:
+            return False
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM searches WHERE cache_key = ? AND stored_at >= ?", (key, time.time() - self.ttl_seconds)
+            ).fetchone() is not None
+
+    def looked_up_at(self, query: str, locale: str = "global", tickers: Sequence[str] = ()) -> Optional[float]:
+        """
+        When a lookup last found the exact query (0.0 if never), or None when it is not cached. Used by the prefetcher,
+        it does not count as a lookup itself.
+        """
+        key = self.cache_key(query, locale, tickers)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT looked_up_at FROM searches WHERE cache_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def store(self, query: str, response: str, locale: str = "global", tickers: Sequence[str] = ()) -> None:
+        """Stores a search result, replacing (and counting as a refresh) an older result of the same query, whose lookup time is kept."""
+        key = self.cache_key(query, locale, tickers)
+        if key is None or not response.strip():
+            return
+        companies, tokens = search_terms(query, tickers, self.index)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            previous = self._conn.execute("SELECT looked_up_at FROM searches WHERE cache_key = ?", (key,)).fetchone()
+            refreshed = self._conn.execute("DELETE FROM searches WHERE cache_key = ?", (key,)).rowcount
+            self._conn.execute(
+                "INSERT INTO searches (cache_key, locale, companies, tokens, response, stored_at, looked_up_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, locale.strip().lower() or "global", companies, " ".join(tokens), response, time.time(),
+                 previous[0] if previous else 0.0),
+            )
+            if refreshed:
+                self._bump_counter("refreshes")
+            self._conn.execute(
+                "DELETE FROM searches WHERE id IN (SELECT id FROM searches ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.execute("COMMIT")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the host-wide counters (exact_hits, fulltext_hits, stale_serves, refreshes, misses) and the entry count."""
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            counters["entries"] = self._conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+        return counters
+
+    def _bump_counter(self, name: str) -> None:
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+        )
+
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache() -> SearchCache:
+    """Returns the process wide SearchCache, opening the SQLite file on first use."""
+    global _search_cache
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                _search_cache = SearchCache(index=get_symbol_index())
+    return _search_cache
@@ -1,9 +1,22 @@
 from google.adk.agents import LlmAgent
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.tools import ToolContext
 from google.genai import types
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+import asyncio
 import json
-import yfinance as yf
+import numpy as np
+
+from config.settings import PRICE_CHART_MAX_POINTS
+from services.resilience import ResilientGemini
+from services.tracing import traced_callback
+from ..query_input_agent.params import get_query_key_params
+from .chart_builder import ChartSpecError, build_chart_option, build_line_chart_option
+from .encoding import encode_aligned, encode_frame, payload_size, project_frame
+from .metrics import METRIC_BLOCKS, METRICS, MetricsError, get_metrics_engine, select_metrics
+from .price_store import INTERVALS, days_to_iso, get_price_store, parse_day
+from .statement_cache import get_statement_cache
+from .statements import FREQUENCY_BLOCKS, STATEMENT_BLOCKS, align_statements, fetch_blocks, fetch_many, make_ticker
 
 
 def irrelevant_user_query_check(callback_context: CallbackContext) -> Optional[types.Content]:
@@ -20,21 +33,13 @@ def irrelevant_user_query_check(callback_context: CallbackContext) -> Optional[t
     state = callback_context.state
     agent_name = callback_context.agent_name
 
-    if "query_key_params" not in state:
+    query_key_params = get_query_key_params(state)
+    if query_key_params is None:
         print("Warning: query_key_params not found in ADK state.")
         return None
-    
-    query_key_params = state["query_key_params"].strip().removeprefix("```json").removesuffix("```").strip()
-    try:
-        query_key_params = json.loads(query_key_params)
-    except Exception as e:
-        print("Error: caught during json.loads in callback function of {agent_name}.")
-    if "relevance" not in query_key_params:
-        print("Warning: relevance not in query_key_params.")
-        return None
 
-    if query_key_params["relevance"].lower().strip() == "no":
-        print("Info: User Query is outside the App's capabilities.\nSkipping the {agent_name}.")
+    if not query_key_params.is_relevant:
+        print(f"Info: User Query is outside the App's capabilities.\nSkipping the {agent_name}.")
         state["chart_objects"] = "```json {}```"
         return types.Content(
             parts=[types.Part(text=f"Agent {agent_name} skipped by before_agent_callback due to state.")],
@@ -42,224 +47,398 @@ def irrelevant_user_query_check(callback_context: CallbackContext) -> Optional[t
         )
     else:
         print(f"Info: [Callback] State condition not met: Proceeding with agent {agent_name}.")
+        state["chart_objects"] = "" # Cleared so a turn without a chart does not show the previous turn's chart.
         return None
     
-def get_data_tables(company_name: str) -> Dict:
+async def get_data_tables(company_name: str, line_items: Optional[List[str]] = None, periods: Optional[List[str]] = None,
+                          frequency: str = "annual") -> Dict:
     '''
         Tool that returns various data tables for a `company_name` using the famous yfinance api.
 
         Input:
             company_name (str): Official stock exchange abbreviation of the company.
                                 For company listed in India, add ".NS" at the end of teh company_name.
+            line_items (List[str], optional): Only return these rows of the tables, e.g. ["Total Revenue", "Net Income"].
+                                              A partial name such as "revenue" returns every row containing it.
+                                              Leave empty to get every row.
+            periods (List[str], optional): Only return these periods, as years ("2024") or dates ("2024-03-31").
+                                           Leave empty to get every period.
+            frequency (str): "annual" for the fiscal year tables (default) or "quarterly" for the quarterly tables
+                             ("quarterly_financials", "quarterly_balance_sheet", ...).
         Output:
-            Returns a dictionary of various data tables in json object format of the company_name.
+            Returns a dictionary of various data tables of the company_name. Each table has a "periods" axis
+            (period end dates) and value arrays per line item: "in_millions" holds amounts in millions of the
+            reporting currency, "as_reported" holds small figures (per share values, ratios) unchanged.
+            Tables that could not be fetched in time are listed in "missing_blocks" and the status is "partial".
+            "report_calendar" gives the last reported periods and the next expected results date, when known.
             In case of error, will return a dict with error message.
     '''
+    if frequency not in FREQUENCY_BLOCKS:
+        return {"status": "failure", "error_msg": f"frequency must be one of {list(FREQUENCY_BLOCKS)}."}
+    statement_blocks = FREQUENCY_BLOCKS[frequency]
     try:
-        ticker = yf.Ticker(company_name)
-    except:
+        ticker = make_ticker(company_name)
+    except Exception as e:
         return {
             "status": "failure",
-            "error_msg": "company_name is invalid."
+            "error_msg": f"company_name is invalid: {e}"
         }
-    info = ticker.info
+    # All blocks are fetched concurrently, so the latency is that of the slowest block rather than their sum.
+    # The blocking fetch runs off the event loop so that agents running in parallel are not stalled.
+    blocks, missing_blocks = await asyncio.to_thread(fetch_blocks, ticker, statement_blocks)
+    info = blocks.get("info") or {}
+    return_dict = {key: info[key] for key in ("sector", "marketCap") if key in info}
 
-    return_dict = dict()
-    try:
-        return_dict["sector"] = info["sector"]
-    except Exception as e:
-        print(f"Agent - data_chart_agent - Tool - get_data_tables: error in 'sector': {e}")
+    before = {"bytes": 0, "tokens": 0}
+    for block in statement_blocks[1:]:
+        if block not in blocks:
+            continue
+        try:
+            for key, size in payload_size(blocks[block].to_json(orient='records')).items(): # The former encoding.
+                before[key] += size
+            return_dict[block] = encode_frame(project_frame(blocks[block], line_items, periods))
+        except Exception as e:
+            missing_blocks[block] = f"{type(e).__name__}: {e}" # A table that cannot be encoded is reported like a missing one.
+    if missing_blocks:
+        print(f"Agent - data_chart_agent - Tool - get_data_tables: missing blocks of {ticker.ticker}: {missing_blocks}")
+
+    after = payload_size(return_dict)
+    return_dict["payload_stats"] = {
+        "bytes_before": before["bytes"],
+        "bytes_after": after["bytes"],
+        "tokens_before": before["tokens"],
+        "tokens_after": after["tokens"],
+    }
+    print(f"Agent - data_chart_agent - Tool - get_data_tables: payload {return_dict['payload_stats']}")
+    report_calendar = get_statement_cache().report_calendar(ticker.ticker)
+    if report_calendar:
+        return_dict["report_calendar"] = report_calendar
+
+    if not missing_blocks:
+        return_dict["status"] = "success"
+    elif len(missing_blocks) < len(statement_blocks):
+        return_dict["status"] = "partial"
+        return_dict["missing_blocks"] = missing_blocks
+    else:
+        return {
+            "status": "failure",
+            "error_msg": f"no data could be fetched for {company_name}.",
+            "missing_blocks": missing_blocks
+        }
+    return return_dict
+
+async def get_data_tables_batch(company_names: List[str], line_items: Optional[List[str]] = None, periods: Optional[List[str]] = None) -> Dict:
+    '''
+        Tool that returns the data tables of several companies in one call, e.g. to compare HDFC, ICICI and SBI.
+
+        Input:
+            company_names (List[str]): Official stock exchange abbreviations of the companies.
+                                       For company listed in India, add ".NS" at the end of each company_name.
+            line_items (List[str], optional): Only return these rows of the tables, same as in `get_data_tables`.
+            periods (List[str], optional): Only return these fiscal years, e.g. ["2024", "2023"].
+        Output:
+            Returns a dictionary with "companies" (sector and marketCap of each ticker), and for each of
+            "financials", "balance_sheet", "cashflow" and "income_stmt" one merged table whose "periods"
+            (fiscal years) are aligned across tickers. "in_millions" and "as_reported" map each line item to
+            the value array of every ticker.
+            Tickers or tables that could not be fetched are reported per ticker in "errors", tables that could not
+            be built per table name; the status is then "partial".
+    '''
+    tickers, errors = list(), dict()
+    for company_name in dict.fromkeys(company_names): # Drops duplicates, keeps order.
+        try:
+            tickers.append(make_ticker(company_name))
+        except Exception as e:
+            errors[company_name] = {"ticker": f"company_name is invalid: {e}"}
+    if not tickers:
+        return {
+            "status": "failure",
+            "error_msg": "none of the company_names is valid.",
+            "errors": errors
+        }
 
+    # Blocks of all tickers are fetched in parallel on the shared pool and HTTP session.
+    results = await asyncio.to_thread(fetch_many, tickers)
+
+    return_dict = {"companies": dict()}
+    for symbol, (blocks, missing_blocks) in results.items():
+        info = blocks.get("info") or {}
+        return_dict["companies"][symbol] = {"sector": info.get("sector"), "marketCap": info.get("marketCap")}
+        if missing_blocks:
+            print(f"Agent - data_chart_agent - Tool - get_data_tables_batch: error in {symbol}: {missing_blocks}")
+            errors[symbol] = missing_blocks
+
+    for block in ("financials", "balance_sheet", "cashflow", "income_stmt"):
+        try:
+            frames = {symbol: project_frame(blocks[block], line_items, periods)
+                      for symbol, (blocks, _) in results.items() if blocks.get(block) is not None}
+            return_dict[block] = encode_aligned(align_statements(frames))
+        except Exception as e:
+            print(f"Agent - data_chart_agent - Tool - get_data_tables_batch: error in '{block}': {e}")
+            errors[block] = f"{type(e).__name__}: {e}" # A table that cannot be encoded is reported like a missing one.
+
+    failed = [symbol for symbol, (blocks, _) in results.items() if not blocks]
+    return_dict["errors"] = errors
+    return_dict["status"] = "success" if not errors else ("failure" if len(failed) == len(results) else "partial")
+    return return_dict
+
+async def get_financial_metrics(company_names: List[str],
+                                metrics: List[str],
+                                frequency: str = "annual",
+                                periods: Optional[List[str]] = None,
+                                last_n_periods: int = 4) -> Dict:
+    '''
+        Tool that returns derived financial metrics of one or several companies, computed from the yfinance statements.
+        Use it instead of working out growth rates, margins or ratios from the raw tables.
+
+        Input:
+            company_names (List[str]): Official stock exchange abbreviations of the companies.
+                                       For company listed in India, add ".NS" at the end of each company_name.
+            metrics (List[str]): Names of the metrics: "revenue_yoy_growth", "revenue_qoq_growth", "net_income_yoy_growth",
+                                 "net_income_qoq_growth", "eps_yoy_growth", "revenue_cagr", "net_income_cagr", "gross_margin",
+                                 "operating_margin", "net_margin", "roe", "roa", "debt_to_equity", "free_cash_flow", "fcf_margin".
+            frequency (str): "annual" (fiscal years) or "quarterly" (the *_qoq_growth metrics need "quarterly").
+            periods (List[str], optional): Periods to return, e.g. ["2024", "2023"]. Leave empty for the latest ones.
+            last_n_periods (int): Number of most recent periods to return when `periods` is empty.
+        Output:
+            Returns a dictionary with the "periods" axis (newest first), the "units" of each metric ("percent", "ratio"
+            or "millions" of the reporting currency) and "metrics": for each metric, the values of every ticker per period
+            (a single value per ticker for the *_cagr metrics). Values that cannot be computed are null.
+            Tickers that could not be fetched are reported in "errors".
+    '''
+    frequency = frequency.strip().lower()
+    if frequency not in METRIC_BLOCKS:
+        return {"status": "failure", "error_msg": f"frequency must be one of {list(METRIC_BLOCKS)}."}
+    unknown = [name for name in metrics if name not in METRICS]
+    if unknown:
+        return {"status": "failure", "error_msg": f"unknown metrics {unknown}. Available metrics: {list(METRICS)}"}
     try:
-        return_dict["marketCap"] = info["marketCap"]
+        tickers = [make_ticker(company_name) for company_name in dict.fromkeys(company_names)]
     except Exception as e:
-        print(f"Agent - data_chart_agent - Tool - get_data_tables: error in 'marketCap': {e}")
+        return {"status": "failure", "error_msg": f"company_names are invalid: {e}"}
 
+    results = await asyncio.to_thread(fetch_many, tickers, METRIC_BLOCKS[frequency])
+    blocks_by_symbol, errors = dict(), dict()
+    for symbol, (blocks, missing_blocks) in results.items():
+        if missing_blocks:
+            errors[symbol] = missing_blocks
+        if any(frame is not None and not frame.empty for frame in blocks.values()):
+            blocks_by_symbol[symbol] = blocks
+        else:
+            errors.setdefault(symbol, "no data")
+    if not blocks_by_symbol:
+        return {"status": "failure", "error_msg": f"no {frequency} statements could be fetched.", "errors": errors}
+
+    engine = get_metrics_engine()
     try:
-        return_dict["financials"] = ticker.financials.to_json(orient='records')
-    except Exception as e:
-        print(f"Agent - data_chart_agent - Tool - get_data_tables: error in 'financials': {e}")
+        return_dict = select_metrics(engine.metrics_for(blocks_by_symbol, frequency), metrics, frequency, periods, last_n_periods)
+    except MetricsError as e:
+        return {"status": "failure", "error_msg": str(e), "errors": errors}
+    print(f"Agent - data_chart_agent - Tool - get_financial_metrics: {metrics} of {list(blocks_by_symbol)}, memo hits {engine.hits} misses {engine.misses}")
+    return_dict["errors"] = errors
+    return_dict["status"] = "success" if not errors else "partial"
+    return return_dict
+
+async def build_chart(company_names: List[str],
+                      line_items: List[str],
+                      chart_type: str = "grouped_bar",
+                      statement: str = "financials",
+                      periods: Optional[List[str]] = None,
+                      last_n_periods: int = 4,
+                      title: str = "",
+                      units: str = "auto",
+                      tool_context: ToolContext = None) -> Dict:
+    '''
+        Tool that renders the chart of the user query from a chart spec. The apache echarts option is built
+        in Python from the yfinance tables and stored as the `chart_objects` of the turn.
 
+        Input:
+            company_names (List[str]): Official stock exchange abbreviations of the companies to chart.
+                                       For company listed in India, add ".NS" at the end of each company_name.
+            line_items (List[str]): Line items to chart, e.g. ["Total Revenue", "Net Income"]. One series per line item and company.
+            chart_type (str): One of "line", "bar", "grouped_bar", "stacked_bar", "stacked_line", "horizontal_bar".
+            statement (str): Table holding the line items: "financials", "balance_sheet", "cashflow" or "income_stmt".
+            periods (List[str], optional): Fiscal years to show, e.g. ["2022", "2023", "2024"].
+            last_n_periods (int): Number of most recent fiscal years to show when `periods` is empty.
+            title (str): Chart title.
+            units (str): "auto", "thousands", "lakhs", "millions", "crores" or "billions".
+        Output:
+            On success the chart is rendered and a short summary is returned.
+            Otherwise a dict with the error message (e.g. the available line items) so the spec can be corrected.
+    '''
+    if statement not in STATEMENT_BLOCKS or statement == "info":
+        return {"status": "failure", "error_msg": f"statement must be one of {list(STATEMENT_BLOCKS[1:])}."}
     try:
-        return_dict["balance_sheet"] = ticker.balance_sheet.to_json(orient='records')
+        tickers = [make_ticker(company_name) for company_name in dict.fromkeys(company_names)]
     except Exception as e:
-        print(f"Agent - data_chart_agent - Tool - get_data_tables: error in 'balance_sheet': {e}")
+        return {"status": "failure", "error_msg": f"company_names are invalid: {e}"}
+
+    frames, errors = dict(), dict()
+    results = await asyncio.to_thread(fetch_many, tickers, (statement,))
+    for symbol, (blocks, missing_blocks) in results.items():
+        if statement in blocks and blocks[statement] is not None and not blocks[statement].empty:
+            frames[symbol] = blocks[statement]
+        else:
+            errors[symbol] = missing_blocks.get(statement, "no data")
+    if not frames:
+        return {"status": "failure", "error_msg": f"no '{statement}' data could be fetched.", "errors": errors}
 
     try:
-        return_dict["cashflow"] = ticker.cashflow.to_json(orient='records')
-    except Exception as e:
-        print(f"Agent - data_chart_agent - Tool - get_data_tables: error in 'cashflow': {e}")
+        option = build_chart_option(frames, line_items, chart_type, periods, last_n_periods, title, units)
+    except ChartSpecError as e:
+        return {"status": "failure", "error_msg": str(e), "errors": errors}
 
+    tool_context.state["chart_objects"] = json.dumps(option)
+    # The option is complete, so there is nothing left for the model to write: end the agent on this tool response.
+    tool_context.actions.skip_summarization = True
+    return {
+        "status": "success" if not errors else "partial",
+        "series": [entry["name"] for entry in option["series"]],
+        "periods": option["yAxis" if chart_type == "horizontal_bar" else "xAxis"]["data"],
+        "errors": errors,
+    }
+
+# Length in days of the lookback periods of `get_price_history` ("ytd" and "max" are handled apart).
+PRICE_PERIODS = {"1m": 31, "3m": 92, "6m": 183, "1y": 366, "2y": 731, "3y": 1096, "5y": 1827}
+
+def _round_prices(values) -> List[Optional[float]]:
+    return [None if np.isnan(v) else round(float(v), 2) for v in values]
+
+async def get_price_history(company_names: List[str],
+                            period: str = "1y",
+                            start: str = "",
+                            end: str = "",
+                            interval: str = "auto",
+                            moving_averages: Optional[List[int]] = None,
+                            title: str = "",
+                            tool_context: ToolContext = None) -> Dict:
+    '''
+        Tool that renders the share price chart of one or several companies and returns their price performance.
+        Use it for questions about the stock or share price, e.g. "how has TCS stock done this year".
+
+        Input:
+            company_names (List[str]): Official stock exchange abbreviations of the companies.
+                                       For company listed in India, add ".NS" at the end of each company_name.
+            period (str): Lookback ending today: "1m", "3m", "6m", "ytd", "1y", "2y", "3y", "5y" or "max".
+            start (str, optional): First day ("2024-01-01"), overrides `period`.
+            end (str, optional): Last day, defaults to the latest trading day.
+            interval (str): "daily", "weekly", "monthly" or "auto" (the finest that keeps the chart readable).
+            moving_averages (List[int], optional): Windows in trading days of the moving averages of the close, e.g. [50, 200].
+                                                   Only drawn for a single company.
+            title (str): Chart title.
+        Output:
+            On success the chart is rendered (several companies are rebased to 100 at the start) and, per ticker,
+            the first and last close, total return, high, low and annualised volatility (in percent) are returned.
+            Otherwise a dict with the error message.
+    '''
+    interval = interval.strip().lower()
+    if interval not in INTERVALS + ("auto",):
+        return {"status": "failure", "error_msg": f"interval must be one of {list(INTERVALS) + ['auto']}."}
+    period = period.strip().lower()
+    if not start and period not in PRICE_PERIODS and period not in ("ytd", "max"):
+        return {"status": "failure", "error_msg": f"period must be one of {list(PRICE_PERIODS) + ['ytd', 'max']}."}
     try:
-        return_dict["income_stmt"] = ticker.income_stmt.to_json(orient='records')
+        tickers = [make_ticker(company_name) for company_name in dict.fromkeys(company_names)]
+        end_day = parse_day(end) if end else None
+        start_day = parse_day(start) if start else None
     except Exception as e:
-        print(f"Agent - data_chart_agent - Tool - get_data_tables: error in 'income_stmt': {e}")
+        return {"status": "failure", "error_msg": f"company_names or dates are invalid: {e}"}
 
+    store = get_price_store()
+    # Stored prices are brought up to date concurrently, each refresh only downloads the missing days.
+    refreshed = await asyncio.gather(*(asyncio.to_thread(store.refresh, ticker) for ticker in tickers), return_exceptions=True)
+    histories, errors = dict(), dict()
+    for ticker, history in zip(tickers, refreshed):
+        if isinstance(history, Exception):
+            errors[ticker.ticker] = f"{type(history).__name__}: {history}"
+        elif len(history) == 0:
+            errors[ticker.ticker] = "no price history"
+        else:
+            histories[ticker.ticker] = history
+    if not histories:
+        return {"status": "failure", "error_msg": "no price history could be fetched.", "errors": errors}
 
-    return_dict["status"] = "success"
-    return return_dict
+    last_day = end_day if end_day is not None else max(int(history["date"][-1]) for history in histories.values())
+    if start_day is None:
+        if period == "max":
+            start_day = min(int(history["date"][0]) for history in histories.values())
+        elif period == "ytd":
+            start_day = parse_day(f"{days_to_iso([last_day])[0][:4]}-01-01")
+        else:
+            start_day = last_day - PRICE_PERIODS[period]
+    ranges = {symbol: history.between(start_day, last_day) for symbol, history in histories.items()}
+    ranges = {symbol: series for symbol, series in ranges.items() if len(series)}
+    if not ranges:
+        return {"status": "failure", "error_msg": f"no prices between {days_to_iso([start_day])[0]} and {days_to_iso([last_day])[0]}.", "errors": errors}
+
+    if interval == "auto":
+        for interval in INTERVALS: # Finest interval that keeps every series under the point limit, else monthly.
+            if max(len(series.resample(interval)) for series in ranges.values()) <= PRICE_CHART_MAX_POINTS:
+                break
+    bars = {symbol: series.resample(interval) for symbol, series in ranges.items()}
+    axis = np.unique(np.concatenate([series["date"] for series in bars.values()]))
+
+    chart_series, rebased = dict(), len(bars) > 1
+    for symbol, series in bars.items():
+        close = np.full(len(axis), np.nan)
+        close[np.searchsorted(axis, series["date"])] = series["close"]
+        chart_series[symbol] = _round_prices(close / series["close"][0] * 100 if rebased else close)
+        if not rebased:
+            history = histories[symbol]
+            for window in moving_averages or []:
+                # Computed on the whole daily history so the average is defined from the first day of the chart.
+                average = history.moving_average(int(window))[np.searchsorted(history["date"], series["date"])]
+                chart_series[f"{symbol} {int(window)}-day average"] = _round_prices(average)
+
+    option = build_line_chart_option(
+        days_to_iso(axis), chart_series,
+        title or f"{' vs '.join(bars)} share price",
+        "Rebased (start = 100)" if rebased else "Price",
+    )
+    tool_context.state["chart_objects"] = json.dumps(option)
+    # The chart is complete, so there is nothing left for the model to write: end the agent on this tool response.
+    tool_context.actions.skip_summarization = True
+    print(f"Agent - data_chart_agent - Tool - get_price_history: {list(bars)} {interval}, store {store.counters}")
+    return {
+        "status": "success" if not errors else "partial",
+        "interval": interval,
+        "performance": {symbol: series.summary() for symbol, series in ranges.items()},
+        "errors": errors,
+    }
 
 
 data_chart_agent = LlmAgent(
     name="data_chart_agent",
-    model="gemini-2.5-flash",
+    model=ResilientGemini(model="gemini-2.5-flash"),
     description="Agent that extract data relevant to query and renders a json apache echarts object.",
-    instruction="""You're a helpful agent that extracts relvant data for charts using `get_data_tables` tool and returns json objects for each chart.
-    Based on the data received and the user query, select the most appropriate data field received from the tool.
-    Once the most appropriate data is selected then create apache echarts json object of a illustrative chart.
-    
-    Response Style: echarts json object
-    Some sample echarts json objects:
-    # Stacked Line Chart
-    ```json
-    {
-        title: {
-            text: 'Stacked Line'
-        },
-        tooltip: {
-            trigger: 'axis'
-        },
-        legend: {
-            data: ['Email', 'Union Ads', 'Video Ads', 'Direct', 'Search Engine']
-        },
-        grid: {
-            left: '3%',
-            right: '4%',
-            bottom: '3%',
-            containLabel: true
-        },
-        toolbox: {
-            feature: {
-            saveAsImage: {}
-            }
-        },
-        xAxis: {
-            type: 'category',
-            boundaryGap: false,
-            data: ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-        },
-        yAxis: {
-            type: 'value'
-        },
-        series: [
-            {
-            name: 'Email',
-            type: 'line',
-            stack: 'Total',
-            data: [120, 132, 101, 134, 90, 230, 210]
-            },
-            {
-            name: 'Union Ads',
-            type: 'line',
-            stack: 'Total',
-            data: [220, 182, 191, 234, 290, 330, 310]
-            },
-            {
-            name: 'Video Ads',
-            type: 'line',
-            stack: 'Total',
-            data: [150, 232, 201, 154, 190, 330, 410]
-            },
-            {
-            name: 'Direct',
-            type: 'line',
-            stack: 'Total',
-            data: [320, 332, 301, 334, 390, 330, 320]
-            },
-            {
-            name: 'Search Engine',
-            type: 'line',
-            stack: 'Total',
-            data: [820, 932, 901, 934, 1290, 1330, 1320]
-            }
-        ]
-    };
-    ```
-
-    # Stacked Horizontal Bar Chart
-    ```json
-    {
-        tooltip: {
-            trigger: 'axis',
-            axisPointer: {
-            // Use axis to trigger tooltip
-            type: 'shadow' // 'shadow' as default; can also be 'line' or 'shadow'
-            }
-        },
-        legend: {},
-        xAxis: {
-            type: 'value'
-        },
-        yAxis: {
-            type: 'category',
-            data: ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-        },
-        series: [
-            {
-            name: 'Direct',
-            type: 'bar',
-            stack: 'total',
-            label: {
-                show: true
-            },
-            emphasis: {
-                focus: 'series'
-            },
-            data: [320, 302, 301, 334, 390, 330, 320]
-            },
-            {
-            name: 'Mail Ad',
-            type: 'bar',
-            stack: 'total',
-            label: {
-                show: true
-            },
-            emphasis: {
-                focus: 'series'
-            },
-            data: [120, 132, 101, 134, 90, 230, 210]
-            },
-            {
-            name: 'Affiliate Ad',
-            type: 'bar',
-            stack: 'total',
-            label: {
-                show: true
-            },
-            emphasis: {
-                focus: 'series'
-            },
-            data: [220, 182, 191, 234, 290, 330, 310]
-            },
-            {
-            name: 'Video Ad',
-            type: 'bar',
-            stack: 'total',
-            label: {
-                show: true
-            },
-            emphasis: {
-                focus: 'series'
-            },
-            data: [150, 212, 201, 154, 190, 330, 410]
-            },
-            {
-            name: 'Search Engine',
-            type: 'bar',
-            stack: 'total',
-            label: {
-                show: true
-            },
-            emphasis: {
-                focus: 'series'
-            },
-            data: [820, 832, 901, 934, 1290, 1330, 1320]
-            }
-        ]
-    };
-    ```
+    instruction="""You're a helpful agent that picks the most illustrative chart for the user query and renders it with the `build_chart` tool.
+    You do NOT write echarts json yourself: decide the chart spec and call `build_chart` exactly once.
+
+    # INPUT QUERY DETAILS:
+    {query_key_params}
+
+    Chart spec:
+    - company_names: use the "tickers" of the query details, they are already resolved. Only for "unresolved_companies" work out
+      the official stock exchange abbreviation yourself; for company listed in India, add ".NS".
+    - line_items: yfinance line items that answer the query, e.g. "Total Revenue", "Net Income", "Operating Income", "Total Debt", "Free Cash Flow".
+    - statement: table holding those line items ("financials", "balance_sheet", "cashflow" or "income_stmt").
+    - chart_type: "line" for trends, "grouped_bar" to compare companies or line items, "stacked_bar"/"stacked_line" for parts of a whole.
+    - periods or last_n_periods, title and units ("crores" for Indian companies, "millions" or "billions" otherwise).
+
+    Example: "Revenue and Net Income of HDFC Bank over the last 4 years" ->
+    build_chart(company_names=["HDFCBANK.NS"], line_items=["Total Revenue", "Net Income"], chart_type="grouped_bar",
+                statement="financials", last_n_periods=4, title="HDFC Bank Revenue vs Net Income", units="crores")
+
+    For questions about the share or stock price (performance, returns, moving averages), call `get_price_history` instead of
+    `build_chart`, e.g. "How has TCS stock done this year" -> get_price_history(company_names=["TCS.NS"], period="ytd").
+
+    If the query asks about growth, CAGR, margins, returns (ROE, ROA), leverage or free cash flow, first call `get_financial_metrics`
+    with the named metrics (the answer is written from them), then call `build_chart`. Never compute such figures yourself.
+
+    If `build_chart` reports that a line item was not found, retry with one of the available line items it lists.
+    Only if you cannot tell which line items exist, look them up with `get_data_tables` (or `get_data_tables_batch` for several
+    companies), passing `line_items` and `periods` to keep the tables small (and frequency="quarterly" for quarterly tables).
     """,
-    tools=[get_data_tables],
-    output_key="chart_objects",
-    before_agent_callback=irrelevant_user_query_check,
+    tools=[build_chart, get_price_history, get_financial_metrics, get_data_tables, get_data_tables_batch],
+    before_agent_callback=traced_callback(irrelevant_user_query_check),
 )
@@ -0,0 +1,165 @@
+from typing import Any, Dict, List, Optional
+import pandas as pd
+
+from .statements import align_statements
+
+# Chart types the agent may pick. "grouped_bar" draws the series side by side, "stacked_*" piles them up.
+CHART_TYPES = ("line", "bar", "grouped_bar", "stacked_bar", "stacked_line", "horizontal_bar")
+
+# Divisor and axis label of each unit. "auto" picks the largest unit that keeps values above 1.
+UNITS = {
+    "": (1, ""),
+    "units": (1, ""),
+    "thousands": (1e3, "Thousands"),
+    "lakhs": (1e5, "Lakhs"),
+    "millions": (1e6, "Millions"),
+    "crores": (1e7, "Crores"),
+    "billions": (1e9, "Billions"),
+}
+
+
+class ChartSpecError(ValueError):
+    """Raised when a chart spec cannot be built from the available data. The message is meant for the LLM."""
+
+
+def resolve_line_item(frame: pd.DataFrame, name: str) -> Optional[str]:
+    """
+    Returns the row label of `frame` that best matches `name`: the case-insensitive exact label,
+    otherwise the shortest label containing it (e.g. "revenue" -> "Total Revenue"), otherwise None.
+    """
+    wanted = name.strip().lower()
+    labels = [str(label) for label in frame.index]
+    for label in labels:
+        if label.lower() == wanted:
+            return label
+    candidates = [label for label in labels if wanted in label.lower()]
+    return min(candidates, key=len) if candidates else None
+
+def _pick_unit(values: List[float], units: str):
+    units = (units or "auto").strip().lower()
+    if units in UNITS:
+        return UNITS[units]
+    largest = max((abs(v) for v in values if v is not None), default=0)
+    for key in ("billions", "millions", "thousands"):
+        if largest >= UNITS[key][0]:
+            return UNITS[key]
+    return UNITS[""]
+
+def build_chart_option(frames: Dict[str, pd.DataFrame],
+                       line_items: List[str],
+                       chart_type: str = "grouped_bar",
+                       periods: Optional[List[str]] = None,
+                       last_n_periods: int = 4,
+                       title: str = "",
+                       units: str = "auto") -> Dict[str, Any]:
+    """
+    Builds an Apache ECharts option from yfinance statements, e.g. a grouped bar chart of
+    Revenue and Net Income over the last 4 years.
+
+    Args:
+        frames: One statement DataFrame (line items x period end dates) per ticker symbol.
+        line_items: Line items to chart, one series per line item and ticker.
+        chart_type: One of CHART_TYPES.
+        periods: Fiscal years to show ("2024" or "FY2024"). Defaults to the last `last_n_periods` years.
+        last_n_periods: Number of most recent fiscal years shown when `periods` is not given.
+        title: Chart title.
+        units: One of UNITS (e.g. "millions", "crores") or "auto".
+
+    Returns:
+        The ECharts option as a JSON serialisable dict.
+
+    Raises:
+        ChartSpecError: The chart type is unknown, a line item is missing, two line items resolve to the same row
+                        or there is no data for the periods.
+    """
+    chart_type = chart_type.strip().lower()
+    if chart_type not in CHART_TYPES:
+        raise ChartSpecError(f"chart_type '{chart_type}' is not supported, use one of {list(CHART_TYPES)}.")
+
+    line_items = list(dict.fromkeys(line_items))
+    selected, display_names = dict(), dict()
+    for symbol, frame in frames.items():
+        rows = dict()
+        for item in line_items:
+            label = resolve_line_item(frame, item)
+            if label is None:
+                raise ChartSpecError(f"line item '{item}' not found for {symbol}. Available line items: {[str(l) for l in frame.index]}")
+            if label in rows:
+                raise ChartSpecError(f"line items '{rows[label]}' and '{item}' both resolve to '{label}' for {symbol}. "
+                                     f"Ask for it once or name another line item. Available line items: {[str(l) for l in frame.index]}")
+            rows[label] = item
+            display_names.setdefault(item, label) # Series are named after the row label, e.g. "Total Revenue".
+        selected[symbol] = frame.loc[list(rows)].rename(index=rows)
+
+    aligned = align_statements(selected)
+    if periods:
+        wanted = {f"FY{str(p).strip().upper().removeprefix('FY')[:4]}" for p in periods}
+        keep = [i for i, period in enumerate(aligned["periods"]) if period in wanted]
+    else:
+        keep = list(range(min(last_n_periods, len(aligned["periods"]))))
+    if not keep:
+        raise ChartSpecError(f"no data for periods {periods}. Available periods: {aligned['periods']}")
+    keep.reverse() # Oldest period first so the x axis reads left to right.
+
+    raw_series = list()
+    for item in line_items:
+        for symbol, values in aligned["line_items"].get(item, {}).items():
+            name = display_names[item] if len(frames) == 1 else f"{symbol} {display_names[item]}"
+            raw_series.append((name, [values[i] for i in keep]))
+
+    divisor, unit_label = _pick_unit([v for _, values in raw_series for v in values], units)
+    horizontal = chart_type == "horizontal_bar"
+    stacked = chart_type.startswith("stacked_")
+    series_type = "line" if chart_type in ("line", "stacked_line") else "bar"
+    series = list()
+    for name, values in raw_series:
+        entry = {
+            "name": name,
+            "type": series_type,
+            "data": [None if v is None else round(v / divisor, 2) for v in values],
+            "emphasis": {"focus": "series"},
+        }
+        if stacked:
+            entry["stack"] = "total"
+            if series_type == "line":
+                entry["areaStyle"] = {}
+        series.append(entry)
+
+    category_axis = {"type": "category", "data": [aligned["periods"][i] for i in keep]}
+    value_axis = {"type": "value", "name": unit_label}
+    return {
+        "title": {"text": title or ", ".join(display_names[item] for item in line_items), "left": "center"},
+        "tooltip": {"trigger": "axis", "axisPointer": {"type": "shadow" if series_type == "bar" else "line"}},
+        "legend": {"data": [entry["name"] for entry in series], "bottom": 0},
+        "grid": {"left": "3%", "right": "4%", "bottom": "10%", "containLabel": True},
+        "xAxis": value_axis if horizontal else category_axis,
+        "yAxis": category_axis if horizontal else value_axis,
+        "series": series,
+    }
+
+
+def build_line_chart_option(dates: List[str], series: Dict[str, List[Optional[float]]], title: str, value_name: str = "") -> Dict[str, Any]:
+    """
+    Builds an Apache ECharts line chart over a date axis, e.g. share prices and their moving averages.
+
+    Args:
+        dates: ISO dates of the x axis, oldest first.
+        series: Values of each series (one per date, None where missing), keyed by series name.
+        title: Chart title.
+        value_name: Label of the value axis.
+
+    Returns:
+        The ECharts option as a JSON serialisable dict.
+    """
+    return {
+        "title": {"text": title, "left": "center"},
+        "tooltip": {"trigger": "axis", "axisPointer": {"type": "line"}},
+        "legend": {"data": list(series), "bottom": 0},
+        "grid": {"left": "3%", "right": "4%", "bottom": "10%", "containLabel": True},
+        "xAxis": {"type": "category", "data": dates},
+        "yAxis": {"type": "value", "name": value_name, "scale": True},
+        "series": [
+            {"name": name, "type": "line", "data": values, "showSymbol": False, "connectNulls": True, "emphasis": {"focus": "series"}}
+            for name, values in series.items()
+        ],
+    }
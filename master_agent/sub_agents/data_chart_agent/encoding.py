@@ -0,0 +1,99 @@
+from typing import Any, Dict, List, Optional
+import json
+import math
+import pandas as pd
+
+MILLION = 1_000_000
+CHARS_PER_TOKEN = 4 # Rough average for English text and JSON with Gemini tokenizers.
+SIGNIFICANT_DIGITS = 4 # Precision kept for values reported as-is (per share figures, ratios, ...).
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens of a string."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def payload_size(payload: Any) -> Dict[str, int]:
+    """Returns the size of a tool payload in bytes and in estimated tokens once serialised to JSON."""
+    text = payload if isinstance(payload, str) else json.dumps(payload, separators=(",", ":"), default=str)
+    return {"bytes": len(text.encode("utf-8")), "tokens": estimate_tokens(text)}
+
+def _matches(label: str, wanted: List[str]) -> bool:
+    label = label.lower()
+    return any(w == label for w in wanted) or any(w in label for w in wanted)
+
+def project_frame(frame: pd.DataFrame, line_items: Optional[List[str]] = None, periods: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Keeps only the requested line items (rows) and periods (columns) of a yfinance statement.
+
+    Args:
+        frame: Statement with line items as index and period end dates as columns.
+        line_items: Case-insensitive names of the rows to keep. A name that is not an exact row label keeps every
+                    row containing it, e.g. "revenue" keeps "Total Revenue" and "Operating Revenue".
+        periods: Periods to keep as years ("2024", "FY2024") or date prefixes ("2024-03", "2024-03-31").
+
+    Returns:
+        The projected DataFrame. Without filters the frame is returned unchanged.
+    """
+    if line_items:
+        wanted = [item.strip().lower() for item in line_items if item.strip()]
+        exact = [label for label in frame.index if str(label).lower() in wanted]
+        rows = exact if len(exact) == len(wanted) else [label for label in frame.index if _matches(str(label), wanted)]
+        frame = frame.loc[rows]
+    if periods:
+        wanted = [str(period).strip().upper().removeprefix("FY") for period in periods]
+        columns = [column for column in frame.columns
+                   if any(pd.Timestamp(column).strftime("%Y-%m-%d").startswith(w) for w in wanted)]
+        frame = frame[columns]
+    return frame
+
+def _round(value: float, in_millions: bool):
+    """Rounding rules: monetary rows to 2 decimals of a million, everything else to SIGNIFICANT_DIGITS digits."""
+    if value is None or pd.isna(value):
+        return None
+    if in_millions:
+        value = round(value / MILLION, 2)
+    elif value != 0:
+        value = round(value, SIGNIFICANT_DIGITS - 1 - int(math.floor(math.log10(abs(value)))))
+    return int(value) if float(value).is_integer() else float(value)
+
+def _encode_rows(rows: Dict[str, List[float]]) -> Dict[str, Dict[str, list]]:
+    # A row is expressed in millions when any of its values reaches a million (amounts in currency units);
+    # smaller rows (EPS, tax rate, share counts in small companies) are kept as reported.
+    encoded = {"in_millions": dict(), "as_reported": dict()}
+    for item, values in rows.items():
+        present = [abs(v) for v in values if v is not None and not pd.isna(v)]
+        in_millions = bool(present) and max(present) >= MILLION
+        encoded["in_millions" if in_millions else "as_reported"][str(item)] = [_round(v, in_millions) for v in values]
+    return {key: rows for key, rows in encoded.items() if rows}
+
+def encode_frame(frame: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Compact columnar encoding of a statement: one period axis and one value array per line item.
+
+    Returns:
+        {"periods": ["2025-03-31", ...], "in_millions": {"Total Revenue": [...]}, "as_reported": {"Diluted EPS": [...]}}
+        Line items whose rows are entirely empty are dropped.
+    """
+    frame = frame.dropna(how="all")
+    return {
+        "periods": [pd.Timestamp(column).strftime("%Y-%m-%d") for column in frame.columns],
+        **_encode_rows({item: list(values) for item, values in frame.iterrows()}),
+    }
+
+def encode_aligned(aligned: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Applies the rounding rules of `encode_frame` to a multi-ticker table produced by `align_statements`.
+
+    Returns:
+        {"periods": [...], "in_millions": {item: {ticker: [...]}}, "as_reported": {item: {ticker: [...]}}}
+    """
+    encoded = {"periods": aligned["periods"], "in_millions": dict(), "as_reported": dict()}
+    for item, by_ticker in aligned["line_items"].items():
+        present = [abs(v) for values in by_ticker.values() for v in values if v is not None]
+        if not present:
+            continue
+        in_millions = max(present) >= MILLION
+        encoded["in_millions" if in_millions else "as_reported"][item] = {
+            symbol: [_round(v, in_millions) for v in values] for symbol, values in by_ticker.items()
+        }
+    return {key: value for key, value in encoded.items() if value}
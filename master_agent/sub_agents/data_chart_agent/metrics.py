@@ -0,0 +1,272 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import threading
+import numpy as np
+import pandas as pd
+
+from config.settings import METRICS_MEMO_MAX_ENTRIES
+
+# Statement blocks the metrics are computed from, per frequency. `financials` duplicates `income_stmt`.
+METRIC_BLOCKS = {
+    "annual": ("income_stmt", "balance_sheet", "cashflow"),
+    "quarterly": ("quarterly_income_stmt", "quarterly_balance_sheet", "quarterly_cashflow"),
+}
+# Periods per year of each frequency: year on year growth compares a period with the one this many periods before.
+PERIODS_PER_YEAR = {"annual": 1, "quarterly": 4}
+
+# yfinance row labels of each input, in order of preference (banks and insurers report different rows).
+LINE_ITEMS = {
+    "revenue": ("Total Revenue", "Operating Revenue"),
+    "gross_profit": ("Gross Profit",),
+    "operating_income": ("Operating Income", "EBIT"),
+    "net_income": ("Net Income", "Net Income Common Stockholders", "Net Income From Continuing Operation Net Minority Interest"),
+    "eps": ("Diluted EPS", "Basic EPS"),
+    "total_assets": ("Total Assets",),
+    "equity": ("Stockholders Equity", "Common Stock Equity", "Total Equity Gross Minority Interest"),
+    "total_debt": ("Total Debt",),
+    "operating_cash_flow": ("Operating Cash Flow",),
+    "capital_expenditure": ("Capital Expenditure",),
+    "free_cash_flow": ("Free Cash Flow",),
+}
+
+
+class MetricSpec(NamedTuple):
+    unit: str # "percent", "ratio" (times) or "millions" (of the reporting currency).
+    per_period: bool # False for a single value per ticker over the whole span (CAGR).
+    description: str
+
+
+# Metrics agents can ask for by name.
+METRICS = {
+    "revenue_yoy_growth": MetricSpec("percent", True, "Total revenue growth against the same period a year before."),
+    "revenue_qoq_growth": MetricSpec("percent", True, "Total revenue growth against the previous quarter (quarterly only)."),
+    "net_income_yoy_growth": MetricSpec("percent", True, "Net income growth against the same period a year before."),
+    "net_income_qoq_growth": MetricSpec("percent", True, "Net income growth against the previous quarter (quarterly only)."),
+    "eps_yoy_growth": MetricSpec("percent", True, "Diluted EPS growth against the same period a year before."),
+    "revenue_cagr": MetricSpec("percent", False, "Compound annual growth rate of total revenue over the periods available."),
+    "net_income_cagr": MetricSpec("percent", False, "Compound annual growth rate of net income over the periods available."),
+    "gross_margin": MetricSpec("percent", True, "Gross profit / total revenue."),
+    "operating_margin": MetricSpec("percent", True, "Operating income / total revenue."),
+    "net_margin": MetricSpec("percent", True, "Net income / total revenue."),
+    "roe": MetricSpec("percent", True, "Return on equity: net income / average stockholders' equity (annualised for quarters)."),
+    "roa": MetricSpec("percent", True, "Return on assets: net income / average total assets (annualised for quarters)."),
+    "debt_to_equity": MetricSpec("ratio", True, "Total debt / stockholders' equity."),
+    "free_cash_flow": MetricSpec("millions", True, "Operating cash flow + capital expenditure (reported free cash flow when available)."),
+    "fcf_margin": MetricSpec("percent", True, "Free cash flow / total revenue."),
+}
+
+
+class MetricsError(ValueError):
+    """Raised when metrics cannot be computed from the request. The message is meant for the LLM."""
+
+
+def statement_panel(blocks_by_symbol: Dict[str, Dict[str, pd.DataFrame]]) -> pd.DataFrame:
+    """
+    Stacks the statement blocks of every ticker into one numeric panel: a row per (ticker, period end) in
+    chronological order and a column per line item, so that metrics are column operations over all tickers at once.
+    """
+    frames = dict()
+    for symbol, blocks in blocks_by_symbol.items():
+        stacked = None
+        for frame in blocks.values():
+            if frame is None or getattr(frame, "empty", True):
+                continue
+            frame = frame.T
+            frame.index = pd.to_datetime(frame.index)
+            frame = frame[~frame.index.duplicated()]
+            stacked = frame if stacked is None else stacked.combine_first(frame)
+        if stacked is not None:
+            frames[symbol] = stacked
+    if not frames:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=["ticker", "period"]))
+    panel = pd.concat(frames, names=["ticker", "period"]).sort_index()
+    return panel.apply(pd.to_numeric, errors="coerce")
+
+def _column(panel: pd.DataFrame, name: str) -> pd.Series:
+    # First reported row among the labels of the input, per (ticker, period).
+    labels = [label for label in LINE_ITEMS[name] if label in panel.columns]
+    if not labels:
+        return pd.Series(np.nan, index=panel.index)
+    return panel[labels].bfill(axis=1).iloc[:, 0]
+
+def _ratio(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    return numerator / denominator.where(denominator != 0)
+
+def _growth(values: pd.Series, lag: int) -> pd.Series:
+    previous = values.groupby(level="ticker").shift(lag)
+    return _ratio(values - previous, previous.abs())
+
+def _average(values: pd.Series) -> pd.Series:
+    # Mean of the opening and closing balance, the closing balance alone for the first period.
+    return ((values + values.groupby(level="ticker").shift(1)) / 2).fillna(values)
+
+def _cagr(values: pd.Series) -> pd.Series:
+    present = values.dropna()
+    present = present[present > 0]
+    if present.empty:
+        return pd.Series(dtype=float)
+    dates = present.index.get_level_values("period").to_series(index=present.index)
+    grouped = present.groupby(level="ticker")
+    years = (dates.groupby(level="ticker").max() - dates.groupby(level="ticker").min()).dt.days / 365.25
+    cagr = (grouped.last() / grouped.first()) ** (1 / years.where(years >= 0.75)) - 1
+    return cagr
+
+def compute_metrics(panel: pd.DataFrame, frequency: str = "annual") -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Computes every metric of METRICS over a statement panel.
+
+    Returns:
+        A tuple (per_period, per_ticker): `per_period` has the rows of the panel and a column per period metric,
+        `per_ticker` a row per ticker and a column per span metric (CAGR). Ratios are fractions, amounts in currency units.
+    """
+    periods_per_year = PERIODS_PER_YEAR[frequency]
+    revenue = _column(panel, "revenue")
+    net_income = _column(panel, "net_income")
+    free_cash_flow = _column(panel, "free_cash_flow").fillna(
+        _column(panel, "operating_cash_flow") + _column(panel, "capital_expenditure")) # Capex is reported negative.
+
+    per_period = pd.DataFrame({
+        "revenue_yoy_growth": _growth(revenue, periods_per_year),
+        "revenue_qoq_growth": _growth(revenue, 1) if frequency == "quarterly" else np.nan,
+        "net_income_yoy_growth": _growth(net_income, periods_per_year),
+        "net_income_qoq_growth": _growth(net_income, 1) if frequency == "quarterly" else np.nan,
+        "eps_yoy_growth": _growth(_column(panel, "eps"), periods_per_year),
+        "gross_margin": _ratio(_column(panel, "gross_profit"), revenue),
+        "operating_margin": _ratio(_column(panel, "operating_income"), revenue),
+        "net_margin": _ratio(net_income, revenue),
+        # Returns annualise the income of a quarter against the balance at its end.
+        "roe": _ratio(net_income * periods_per_year, _average(_column(panel, "equity"))),
+        "roa": _ratio(net_income * periods_per_year, _average(_column(panel, "total_assets"))),
+        "debt_to_equity": _ratio(_column(panel, "total_debt"), _column(panel, "equity")),
+        "free_cash_flow": free_cash_flow,
+        "fcf_margin": _ratio(free_cash_flow, revenue),
+    }, index=panel.index)
+    per_ticker = pd.DataFrame({
+        "revenue_cagr": _cagr(revenue),
+        "net_income_cagr": _cagr(net_income),
+    })
+    return per_period, per_ticker
+
+def snapshot_key(blocks: Dict[str, Any]) -> int:
+    """Fingerprint of the statement blocks of a ticker: metrics are memoised until the fetched data changes."""
+    parts = list()
+    for block in sorted(blocks):
+        frame = blocks[block]
+        if isinstance(frame, pd.DataFrame) and not frame.empty:
+            parts.append((block, int(pd.util.hash_pandas_object(frame, index=True).sum()), tuple(str(c) for c in frame.columns)))
+    return hash(tuple(parts))
+
+
+class MetricsEngine:
+    """
+    Computes the METRICS of several tickers with vectorised operations over a stacked statement panel.
+
+    Results are memoised per (ticker, frequency, snapshot of its statements), so a ticker asked about again is not
+    recomputed until its statements change; the tickers that miss are computed together in one pass.
+    """
+
+    def __init__(self, max_entries: int = METRICS_MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memo: "OrderedDict[Tuple[str, str, int], Tuple[pd.DataFrame, pd.Series]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def metrics_for(self, blocks_by_symbol: Dict[str, Dict[str, pd.DataFrame]],
+                    frequency: str = "annual") -> Dict[str, Tuple[pd.DataFrame, pd.Series]]:
+        """
+        Returns, per ticker symbol, its per period metrics (period end dates as index, oldest first) and its span metrics.
+        """
+        keys = {symbol: (symbol, frequency, snapshot_key(blocks)) for symbol, blocks in blocks_by_symbol.items()}
+        results, missing = dict(), dict()
+        with self._lock:
+            for symbol, key in keys.items():
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    results[symbol] = self._memo[key]
+                    self.hits += 1
+                else:
+                    missing[symbol] = blocks_by_symbol[symbol]
+                    self.misses += 1
+        if not missing:
+            return results
+
+        per_period, per_ticker = compute_metrics(statement_panel(missing), frequency)
+        computed = dict()
+        for symbol in missing:
+            rows = per_period.xs(symbol, level="ticker") if symbol in per_period.index.get_level_values("ticker") else per_period.iloc[0:0]
+            span = per_ticker.loc[symbol] if symbol in per_ticker.index else pd.Series(np.nan, index=per_ticker.columns)
+            computed[symbol] = (rows, span)
+        with self._lock:
+            for symbol, value in computed.items():
+                self._memo[keys[symbol]] = value
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        results.update(computed)
+        return results
+
+
+def _period_label(period: pd.Timestamp, frequency: str) -> str:
+    return f"FY{period.year}" if frequency == "annual" else f"{period.year}-Q{period.quarter}"
+
+def _encode_value(value: float, unit: str) -> Optional[float]:
+    if value is None or pd.isna(value) or np.isinf(value):
+        return None
+    if unit == "percent":
+        return round(float(value) * 100, 2)
+    if unit == "millions":
+        return round(float(value) / 1e6, 2)
+    return round(float(value), 3)
+
+def select_metrics(results: Dict[str, Tuple[pd.DataFrame, pd.Series]],
+                   names: List[str],
+                   frequency: str = "annual",
+                   periods: Optional[List[str]] = None,
+                   last_n_periods: int = 4) -> Dict[str, Any]:
+    """
+    Lays out the requested metrics of several tickers on one period axis (fiscal years "FY2024", or quarters
+    "2024-Q1"), newest first, in the units of METRICS.
+
+    Raises:
+        MetricsError: A metric name is unknown.
+    """
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise MetricsError(f"unknown metrics {unknown}. Available metrics: {list(METRICS)}")
+
+    labelled = dict()
+    for symbol, (rows, _) in results.items():
+        rows = rows.copy()
+        rows.index = [_period_label(period, frequency) for period in rows.index]
+        labelled[symbol] = rows[~rows.index.duplicated(keep="last")]
+    axis = sorted({label for rows in labelled.values() for label in rows.index}, reverse=True)
+    if periods:
+        wanted = {str(period).strip().upper().removeprefix("FY") for period in periods}
+        axis = [label for label in axis if label.removeprefix("FY") in wanted or label[:4] in wanted]
+    else:
+        axis = axis[:last_n_periods]
+
+    output = {"periods": axis, "units": dict(), "metrics": dict()}
+    for name in names:
+        spec = METRICS[name]
+        output["units"][name] = spec.unit
+        if spec.per_period:
+            output["metrics"][name] = {
+                symbol: [_encode_value(rows[name].get(label), spec.unit) for label in axis] for symbol, rows in labelled.items()
+            }
+        else:
+            output["metrics"][name] = {symbol: _encode_value(span.get(name), spec.unit) for symbol, (_, span) in results.items()}
+    return output
+
+
+_metrics_engine: Optional[MetricsEngine] = None
+_metrics_engine_lock = threading.Lock()
+
+def get_metrics_engine() -> MetricsEngine:
+    """Returns the process wide MetricsEngine, whose memo is shared by every session."""
+    global _metrics_engine
+    if _metrics_engine is None:
+        with _metrics_engine_lock:
+            if _metrics_engine is None:
+                _metrics_engine = MetricsEngine()
+    return _metrics_engine
@@ -0,0 +1,269 @@
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from config.settings import PRICE_STORE_DIR, PRICE_HISTORY_INITIAL_PERIOD, PRICE_REFRESH_SECONDS
+from services.resilience import get_upstream
+from services.single_flight import get_single_flight
+
+# Columns of the store, one file each. Dates are days since 1970-01-01, prices are adjusted for splits and dividends.
+COLUMNS = {"date": np.int64, "open": np.float64, "high": np.float64, "low": np.float64, "close": np.float64, "volume": np.float64}
+HISTORY_COLUMNS = {"open": "Open", "high": "High", "low": "Low", "close": "Close", "volume": "Volume"}
+INTERVALS = ("daily", "weekly", "monthly")
+TRADING_DAYS_PER_YEAR = 252
+ADJUSTMENT_TOLERANCE = 1e-6 # Relative change of an already stored close that means the history was re-adjusted.
+
+
+def _to_days(index: pd.Index) -> np.ndarray:
+    # Trading day of each bar (exchange local date) as days since the epoch.
+    dates = pd.DatetimeIndex(index)
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return dates.normalize().values.astype("datetime64[D]").astype(np.int64)
+
+def days_to_iso(days: np.ndarray) -> List[str]:
+    return np.datetime_as_string(np.asarray(days).astype("datetime64[D]"), unit="D").tolist()
+
+def parse_day(value: str) -> int:
+    return int(np.datetime64(pd.Timestamp(value).date(), "D").astype(np.int64))
+
+
+class PriceSeries:
+    """Daily OHLCV of a ticker as read-only arrays (memory-mapped from the store), oldest bar first."""
+
+    def __init__(self, ticker: str, columns: Dict[str, np.ndarray]):
+        self.ticker = ticker
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["date"])
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    def between(self, start: Optional[int] = None, end: Optional[int] = None) -> "PriceSeries":
+        """Bars with start <= date <= end (days since the epoch), found by binary search."""
+        dates = self.columns["date"]
+        first = 0 if start is None else int(np.searchsorted(dates, start, side="left"))
+        last = len(dates) if end is None else int(np.searchsorted(dates, end, side="right"))
+        return PriceSeries(self.ticker, {name: values[first:last] for name, values in self.columns.items()})
+
+    def resample(self, interval: str) -> "PriceSeries":
+        """
+        OHLCV bars of each week (starting Monday) or calendar month: first open, highest high, lowest low, last close
+        and total volume, computed with ufunc reduceat over the group boundaries. Bars are dated on their last day.
+        """
+        if interval == "daily" or len(self) == 0:
+            return self
+        dates = self.columns["date"]
+        if interval == "weekly":
+            keys = (dates + 3) // 7 # 1970-01-01 was a Thursday.
+        elif interval == "monthly":
+            keys = dates.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        else:
+            raise ValueError(f"interval must be one of {list(INTERVALS)}.")
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        ends = np.concatenate((starts[1:], [len(dates)])) - 1
+        return PriceSeries(self.ticker, {
+            "date": dates[ends],
+            "open": self.columns["open"][starts],
+            "high": np.maximum.reduceat(self.columns["high"], starts),
+            "low": np.minimum.reduceat(self.columns["low"], starts),
+            "close": self.columns["close"][ends],
+            "volume": np.add.reduceat(self.columns["volume"], starts),
+        })
+
+    def returns(self) -> np.ndarray:
+        """Simple return of each bar against the previous one (NaN for the first bar)."""
+        close = self.columns["close"]
+        out = np.full(len(close), np.nan)
+        out[1:] = close[1:] / close[:-1] - 1
+        return out
+
+    def moving_average(self, window: int) -> np.ndarray:
+        """Rolling mean of the close over `window` bars (NaN until the window is full), from cumulative sums."""
+        close = self.columns["close"]
+        out = np.full(len(close), np.nan)
+        if 0 < window <= len(close):
+            totals = np.cumsum(np.concatenate(([0.0], close)))
+            out[window - 1:] = (totals[window:] - totals[:-window]) / window
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        """First and last close, total return, range and annualised volatility of the daily returns, in percent."""
+        if len(self) == 0:
+            return {}
+        close, dates = self.columns["close"], self.columns["date"]
+        daily = self.returns()[1:]
+        return {
+            "start_date": days_to_iso(dates[:1])[0],
+            "end_date": days_to_iso(dates[-1:])[0],
+            "start_close": round(float(close[0]), 2),
+            "end_close": round(float(close[-1]), 2),
+            "total_return_pct": round(float(close[-1] / close[0] - 1) * 100, 2),
+            "high": round(float(np.max(self.columns["high"])), 2),
+            "low": round(float(np.min(self.columns["low"])), 2),
+            "annualised_volatility_pct": round(float(np.std(daily) * np.sqrt(TRADING_DAYS_PER_YEAR)) * 100, 2) if len(daily) > 1 else None,
+        }
+
+
+class PriceStore:
+    """
+    Local store of daily OHLCV per ticker, filled from `yf.Ticker.history`.
+
+    Each ticker has a directory with one binary file per column, read as NumPy memory maps, and a meta.json holding
+    the number of valid rows. A refresh downloads only the bars from the last stored day on: the last bar is
+    overwritten (during trading hours it was stored while the session was still open) and the newer bars are appended
+    to the column files; the row count is updated last, so readers never see a partial append. When Yahoo re-adjusts
+    the history (a split or dividend changes past prices, seen on the settled bar before the last one), the ticker is
+    downloaded again in full. Concurrent refreshes of a ticker share one download, and the stored bars are served when
+    Yahoo fails.
+    """
+
+    def __init__(self, root: str = PRICE_STORE_DIR,
+                 initial_period: str = PRICE_HISTORY_INITIAL_PERIOD,
+                 refresh_seconds: float = PRICE_REFRESH_SECONDS):
+        self.root = root
+        self.initial_period = initial_period
+        self.refresh_seconds = refresh_seconds
+        self.counters = {"full_downloads": 0, "appends": 0, "rows_appended": 0, "fresh": 0, "stale_serves": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, ticker: str) -> str:
+        return os.path.join(self.root, ticker.replace(os.sep, "_"))
+
+    def _read_meta(self, ticker: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self._dir(ticker), "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"rows": 0, "refreshed_at": 0.0}
+
+    def _write_meta(self, ticker: str, meta: Dict[str, Any]) -> None:
+        path = os.path.join(self._dir(ticker), "meta.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self, ticker: str) -> PriceSeries:
+        """Returns the stored bars of a ticker without refreshing them."""
+        ticker = ticker.strip().upper()
+        rows = self._read_meta(ticker)["rows"]
+        columns = dict()
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(self._dir(ticker), f"{name}.bin")
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(rows,)) if rows else np.empty(0, dtype=dtype)
+        return PriceSeries(ticker, columns)
+
+    def is_fresh(self, ticker: str) -> bool:
+        """Whether the bars of a ticker are stored and were refreshed less than `refresh_seconds` ago."""
+        meta = self._read_meta(ticker.strip().upper())
+        return bool(meta["rows"]) and time.time() - meta["refreshed_at"] < self.refresh_seconds
+
+    def refresh(self, ticker: Any) -> PriceSeries:
+        """
+        Brings the bars of a yfinance Ticker up to date (when older than `refresh_seconds`) and returns them.
+
+        Args:
+            ticker: yfinance Ticker (or any object exposing `ticker` and `history`).
+        """
+        symbol = ticker.ticker.strip().upper()
+        return get_single_flight("prices").do((self.root, symbol), self._refresh, ticker, symbol)
+
+    def _refresh(self, ticker: Any, symbol: str) -> PriceSeries:
+        # Only one refresh of a ticker runs at a time, see refresh.
+        try:
+            return self._update(ticker, symbol)
+        except Exception as e:
+            stored = self.load(symbol)
+            if len(stored) == 0:
+                raise
+            print(f"Warning: serving the stored prices of {symbol} up to {days_to_iso(stored['date'][-1:])[0]}, Yahoo failed: {type(e).__name__}: {e}")
+            self.counters["stale_serves"] += 1
+            return stored
+
+    def _history(self, ticker: Any, **kwargs) -> pd.DataFrame:
+        return get_upstream("yfinance").call(ticker.history, **kwargs)
+
+    def _update(self, ticker: Any, symbol: str) -> PriceSeries:
+        meta = self._read_meta(symbol)
+        if meta["rows"] and time.time() - meta["refreshed_at"] < self.refresh_seconds:
+            self.counters["fresh"] += 1
+            return self.load(symbol)
+        stored = self.load(symbol)
+        if not meta["rows"]:
+            self._rewrite(symbol, self._history(ticker, period=self.initial_period, interval="1d"))
+            return self.load(symbol)
+
+        # The last stored bar may have been the live bar of a session still open: it is downloaded again and replaced.
+        # The settled bar before it is downloaded too, its close tells whether past prices were re-adjusted.
+        last_day = int(stored["date"][-1])
+        settled_day = int(stored["date"][-2]) if len(stored) > 1 else None
+        frame = self._history(ticker, start=days_to_iso([last_day if settled_day is None else settled_day])[0], interval="1d")
+        frame = frame.dropna(subset=["Close"]) if len(frame) else frame
+        days = _to_days(frame.index) if len(frame) else np.empty(0, dtype=np.int64)
+        overlap = np.flatnonzero(days == settled_day)
+        if overlap.size:
+            previous, current = float(stored["close"][-2]), float(frame["Close"].iloc[overlap[0]])
+            if abs(current - previous) > ADJUSTMENT_TOLERANCE * max(abs(previous), 1.0):
+                self._rewrite(symbol, self._history(ticker, period=self.initial_period, interval="1d"))
+                return self.load(symbol)
+        rows = meta["rows"]
+        tail = days >= last_day
+        if tail.any(): # Otherwise Yahoo returned nothing new and the last bar is kept as stored.
+            values = {name: frame[column].to_numpy(dtype=np.float64)[tail] for name, column in HISTORY_COLUMNS.items()}
+            # The stored last bar is only replaced by a bar of the same day; when Yahoo left that day out, it is kept
+            # and the new bars are appended after it.
+            first_row = rows - 1 if days[tail][0] == last_day else rows
+            self._write_tail(symbol, first_row, days[tail], values)
+            appended = first_row + int(tail.sum()) - rows
+            rows += appended
+            if appended:
+                self.counters["appends"] += 1
+                self.counters["rows_appended"] += appended
+        self._write_meta(symbol, {"rows": rows, "refreshed_at": time.time()})
+        return self.load(symbol)
+
+    def _rewrite(self, symbol: str, frame: pd.DataFrame) -> None:
+        # Replaces every column file of a ticker with a full download.
+        os.makedirs(self._dir(symbol), exist_ok=True)
+        frame = frame.dropna(subset=["Close"]) if len(frame) else frame
+        days = _to_days(frame.index) if len(frame) else np.empty(0, dtype=np.int64)
+        self._write_meta(symbol, {"rows": 0, "refreshed_at": 0.0}) # Readers see no rows while the files are replaced.
+        values = {"date": days, **{name: frame[column].to_numpy(dtype=np.float64) if len(frame) else np.empty(0)
+                                   for name, column in HISTORY_COLUMNS.items()}}
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(self._dir(symbol), f"{name}.bin")
+            with open(path + ".tmp", "wb") as f:
+                f.write(np.ascontiguousarray(values[name], dtype=dtype).tobytes())
+            os.replace(path + ".tmp", path)
+        self._write_meta(symbol, {"rows": len(days), "refreshed_at": time.time()})
+        self.counters["full_downloads"] += 1
+
+    def _write_tail(self, symbol: str, first_row: int, days: np.ndarray, values: Dict[str, np.ndarray]) -> None:
+        # Writes bars over the column files from `first_row` (the last stored bar, or the row after it) on; the rows
+        # appended after the stored ones only become visible once meta.json counts them. Files are written in place and
+        # never shrink below the stored rows, which readers may have memory-mapped.
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(self._dir(symbol), f"{name}.bin")
+            with open(path, "r+b") as f:
+                f.seek(first_row * np.dtype(dtype).itemsize)
+                f.write(np.ascontiguousarray(days if name == "date" else values[name], dtype=dtype).tobytes())
+                f.truncate(f.tell()) # Drops the bytes of an append that never got counted.
+
+
+_price_store: Optional[PriceStore] = None
+_price_store_lock = threading.Lock()
+
+def get_price_store() -> PriceStore:
+    """Returns the process wide PriceStore."""
+    global _price_store
+    if _price_store is None:
+        with _price_store_lock:
+            if _price_store is None:
+                _price_store = PriceStore()
+    return _price_store
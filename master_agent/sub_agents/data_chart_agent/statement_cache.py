@@ -0,0 +1,439 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+import pandas as pd
+
+from services.resilience import get_upstream
+from config.settings import (FUNDAMENTALS_CACHE_PATH, FUNDAMENTALS_CACHE_MAX_BYTES, FUNDAMENTALS_CACHE_TTLS,
+                             EARNINGS_REPORT_LAG_DAYS, STATEMENT_REVALIDATE_SECONDS, STATEMENT_EMPTY_BLOCK_TTL_SECONDS)
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60 # Used for statement blocks that have no entry in FUNDAMENTALS_CACHE_TTLS.
+# Blocks that only change when the company reports results. They follow the report calendar of the ticker instead of a TTL.
+REPORTED_STATEMENTS = (
+    "financials", "balance_sheet", "cashflow", "income_stmt",
+    "quarterly_financials", "quarterly_balance_sheet", "quarterly_cashflow", "quarterly_income_stmt",
+)
+# Block fetched to check whether a company has published a newer period, per frequency of the statement asked for.
+REVALIDATION_PROBES = {"annual": "income_stmt", "quarterly": "quarterly_income_stmt"}
+# Length of a reporting period of each frequency.
+FISCAL_PERIOD_SECONDS = {"annual": 365 * 24 * 60 * 60, "quarterly": 92 * 24 * 60 * 60}
+# Keys of `info` holding the announced earnings date, in order of preference (epoch seconds).
+EARNINGS_DATE_KEYS = ("earningsTimestampStart", "earningsTimestamp")
+
+
+def newest_period(frame: Any) -> Optional[float]:
+    """Returns the newest period end date (epoch seconds) of a statement DataFrame, or None when it has no periods."""
+    if not isinstance(frame, pd.DataFrame) or frame.empty:
+        return None
+    periods = pd.to_datetime(frame.columns, errors="coerce").dropna()
+    return float(periods.max().timestamp()) if len(periods) else None
+
+def announced_report(info: Any) -> Optional[float]:
+    """Returns the earnings date Yahoo announced in a ticker's `info` (epoch seconds), or None."""
+    if not isinstance(info, dict):
+        return None
+    for key in EARNINGS_DATE_KEYS:
+        if isinstance(info.get(key), (int, float)) and info[key] > 0:
+            return float(info[key])
+    return None
+
+def frequency(statement: str) -> str:
+    """Reporting frequency of a statement block: "quarterly" or "annual"."""
+    return "quarterly" if statement.startswith("quarterly_") else "annual"
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp)) if timestamp else None
+
+
+class StatementCache:
+    """
+    On-disk cache of yfinance statement blocks keyed by (ticker, statement).
+
+    The cache is a single SQLite file in WAL mode, so it survives process restarts and is shared by
+    every Streamlit session and process on the host. Each statement block has its own TTL, the file is
+    kept under `max_bytes` by evicting the least recently used entries, and hits/misses are counted both
+    for this process and host-wide.
+
+    Financial statements only change when a company reports, so each ticker has a report calendar: the newest
+    annual and quarterly period seen so far and, per frequency, the next expected report date (the earnings date
+    Yahoo announced, else `report_lag_days` after the end of the next fiscal quarter, or year for annual statements).
+    Statements stay valid until the report date of their frequency, and never for less than their TTL. Once it has
+    passed, `revalidate` fetches the income statement of that frequency alone and compares its newest period: when
+    nothing new was published the stored statements are served for another `revalidate_seconds`, otherwise they
+    are all refetched. Tickers without a calendar yet (and `info`) only use the TTLs.
+
+    Expired entries are kept until evicted: `get_stale` serves them while Yahoo is unavailable. Blocks Yahoo returned
+    empty are not stored but remembered for `empty_ttl_seconds` (`is_known_empty`), so the prefetcher does not ask
+    for them on every pass. Lookups made with `count=False` (the prefetcher's) are counted apart from user lookups.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttls: Dict[str, int],
+                 report_lag_days: int = EARNINGS_REPORT_LAG_DAYS,
+                 revalidate_seconds: float = STATEMENT_REVALIDATE_SECONDS,
+                 empty_ttl_seconds: float = STATEMENT_EMPTY_BLOCK_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls)
+        self.report_lag_seconds = report_lag_days * 24 * 60 * 60
+        self.revalidate_seconds = revalidate_seconds
+        self.empty_ttl_seconds = empty_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.warm_lookups = 0 # Lookups of the prefetcher, not counted as hits or misses.
+        self.revalidated = 0 # Revalidations that found no newer period: the stored statements were kept.
+        self.invalidated = 0 # Revalidations that found a newer period: the stored statements were refetched.
+        self.stale_serves = 0
+        self._lock = threading.Lock()
+        self._ticker_locks: Dict[str, threading.Lock] = dict()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # isolation_level=None puts sqlite3 in autocommit mode; transactions are opened explicitly below.
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS statements (
+                ticker TEXT NOT NULL,
+                statement TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (ticker, statement)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_statements_accessed_at ON statements (accessed_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # Period dates are epoch seconds, per frequency. <frequency>_checked_at is when its newest period was last
+        # confirmed, <frequency>_changed_at when a newer period than the known one was first seen: reported statements
+        # of that frequency stored before it are out of date.
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS report_calendar (
+                ticker TEXT PRIMARY KEY,
+                last_annual REAL,
+                last_quarterly REAL,
+                announced_report REAL,
+                annual_checked_at REAL NOT NULL DEFAULT 0,
+                annual_changed_at REAL NOT NULL DEFAULT 0,
+                quarterly_checked_at REAL NOT NULL DEFAULT 0,
+                quarterly_changed_at REAL NOT NULL DEFAULT 0
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS empty_blocks (
+                ticker TEXT NOT NULL,
+                statement TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (ticker, statement)
+            )"""
+        )
+
+    def ttl_for(self, statement: str) -> int:
+        """Returns the time-to-live in seconds of a statement block."""
+        return self.ttls.get(statement, DEFAULT_TTL_SECONDS)
+
+    def get(self, ticker: str, statement: str, count: bool = True) -> Optional[Any]:
+        """
+        Returns the cached block for (ticker, statement) or None when it is missing or expired.
+        With `count=False` (lookups of the prefetcher) the lookup is counted as a warm lookup, not as a hit or miss.
+        """
+        ticker = ticker.strip().upper()
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, stored_at FROM statements WHERE ticker = ? AND statement = ?",
+                (ticker, statement),
+            ).fetchone()
+            fresh = row is not None and self._is_fresh(statement, row[1], self._calendar(ticker), now)
+            if not count:
+                self.warm_lookups += 1
+                self._bump_counter("warm_lookups")
+            elif not fresh:
+                self.misses += 1
+                self._bump_counter("misses")
+            if not fresh:
+                return None
+            with self._transaction():
+                self._conn.execute(
+                    "UPDATE statements SET accessed_at = ? WHERE ticker = ? AND statement = ?",
+                    (now, ticker, statement),
+                )
+                if count:
+                    self.hits += 1
+                    self._bump_counter("hits")
+        return pickle.loads(row[0])
+
+    def get_stale(self, ticker: str, statement: str) -> Optional[Any]:
+        """Returns the stored block for (ticker, statement) however old it is, or None. Used when Yahoo fails."""
+        ticker = ticker.strip().upper()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM statements WHERE ticker = ? AND statement = ?", (ticker, statement)
+            ).fetchone()
+            if row is None:
+                return None
+            self.stale_serves += 1
+            self._bump_counter("stale_serves")
+        return pickle.loads(row[0])
+
+    def is_fresh(self, ticker: str, statement: str) -> bool:
+        """Whether (ticker, statement) is stored and fresh, without counting a lookup (used by the prefetcher)."""
+        ticker = ticker.strip().upper()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at FROM statements WHERE ticker = ? AND statement = ?", (ticker, statement)
+            ).fetchone()
+            return row is not None and self._is_fresh(statement, row[0], self._calendar(ticker), time.time())
+
+    def record_empty(self, ticker: str, statement: str) -> None:
+        """Remembers that Yahoo returned (ticker, statement) empty, see `is_known_empty`."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO empty_blocks (ticker, statement, seen_at) VALUES (?, ?, ?)",
+                (ticker.strip().upper(), statement, time.time()),
+            )
+
+    def is_known_empty(self, ticker: str, statement: str) -> bool:
+        """Whether Yahoo returned (ticker, statement) empty within the last `empty_ttl_seconds` and nothing was stored since."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM empty_blocks WHERE ticker = ? AND statement = ? AND seen_at >= ?",
+                (ticker.strip().upper(), statement, time.time() - self.empty_ttl_seconds),
+            ).fetchone() is not None
+
+    def put(self, ticker: str, statement: str, value: Any) -> None:
+        """
+        Stores a block for (ticker, statement) and evicts least recently used entries if the cache is full.
+        """
+        ticker = ticker.strip().upper()
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock, self._transaction("IMMEDIATE"):
+            self._conn.execute(
+                "INSERT OR REPLACE INTO statements (ticker, statement, payload, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (ticker, statement, sqlite3.Binary(payload), len(payload), now, now),
+            )
+            self._conn.execute("DELETE FROM empty_blocks WHERE ticker = ? AND statement = ?", (ticker, statement))
+            if statement in REPORTED_STATEMENTS:
+                self._record_period(ticker, statement, newest_period(value), now)
+            elif statement == "info" and announced_report(value) is not None:
+                self._conn.execute(
+                    "INSERT INTO report_calendar (ticker, announced_report) VALUES (?, ?) "
+                    "ON CONFLICT(ticker) DO UPDATE SET announced_report = excluded.announced_report",
+                    (ticker, announced_report(value)),
+                )
+            self._evict()
+
+    def revalidate(self, ticker: Any, statement: str) -> bool:
+        """
+        Called when a reported statement of the ticker is stored but past its report date: fetches the income
+        statement of the same frequency alone (REVALIDATION_PROBES) and compares its newest period with the last one
+        seen. Concurrent calls for one ticker share a single check.
+
+        Args:
+            ticker: yfinance Ticker (or any object exposing `ticker` and the statement attributes).
+            statement: The block that was asked for.
+
+        Returns:
+            True when the stored statements are still current (`get` serves them again), False when the block has
+            to be fetched: nothing is stored, no period of its frequency is known or a newer period is out.
+        """
+        symbol = ticker.ticker.strip().upper()
+        if statement not in REPORTED_STATEMENTS:
+            return False
+        period = frequency(statement)
+        probe_block = REVALIDATION_PROBES[period]
+        with self._lock:
+            lock = self._ticker_locks.setdefault(symbol, threading.Lock())
+        with lock:
+            now = time.time()
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT stored_at FROM statements WHERE ticker = ? AND statement = ?", (symbol, statement)
+                ).fetchone()
+                calendar = self._calendar(symbol)
+            if row is None or calendar is None or calendar[f"last_{period}"] is None:
+                return False
+            if now - calendar[f"{period}_checked_at"] < self.revalidate_seconds: # Checked by another caller meanwhile.
+                return self._is_fresh(statement, row[0], calendar, now)
+            try:
+                probe = get_upstream("yfinance").call(getattr, ticker, probe_block)
+            except Exception as e:
+                print(f"Warning: could not revalidate the statements of {symbol}: {type(e).__name__}: {e}")
+                return False
+            newest = newest_period(probe)
+            if newest is None:
+                return False
+            if newest > calendar[f"last_{period}"]:
+                self.put(symbol, probe_block, probe) # Records the new period, which invalidates the other statements.
+                with self._lock:
+                    self.invalidated += 1
+                    self._bump_counter("invalidated")
+                return False
+            with self._lock:
+                self._conn.execute(f"UPDATE report_calendar SET {period}_checked_at = ? WHERE ticker = ?", (now, symbol))
+                self.revalidated += 1
+                self._bump_counter("revalidated")
+            return True
+
+    def report_calendar(self, ticker: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the last reported periods, the next expected report date (the earliest of the known frequencies) and
+        the next expected annual report of a ticker as ISO dates, or None when unknown.
+        """
+        with self._lock:
+            calendar = self._calendar(ticker.strip().upper())
+        if calendar is None:
+            return None
+        upcoming = [(calendar[f"next_{period}_report"], calendar[f"next_{period}_source"])
+                    for period in ("quarterly", "annual") if calendar[f"next_{period}_report"] is not None]
+        if not upcoming:
+            return None
+        next_report, source = min(upcoming)
+        return {
+            "last_annual_period": _iso(calendar["last_annual"]),
+            "last_quarterly_period": _iso(calendar["last_quarterly"]),
+            "next_expected_report": _iso(next_report),
+            "next_report_source": source,
+            "next_annual_report": _iso(calendar["next_annual_report"]),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters of this process and of the whole host along with the cache size."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM statements").fetchone()
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "host_hits": counters.get("hits", 0),
+            "host_misses": counters.get("misses", 0),
+            "warm_lookups": self.warm_lookups,
+            "host_warm_lookups": counters.get("warm_lookups", 0),
+            "evictions": counters.get("evictions", 0),
+            "revalidated": self.revalidated,
+            "invalidated": self.invalidated,
+            "host_revalidated": counters.get("revalidated", 0),
+            "host_invalidated": counters.get("invalidated", 0),
+            "stale_serves": self.stale_serves,
+            "host_stale_serves": counters.get("stale_serves", 0),
+            "entries": entries,
+            "bytes": size,
+        }
+
+    @contextmanager
+    def _transaction(self, mode: str = "") -> Iterator[None]:
+        # Must be called with self._lock held. An error rolls the transaction back instead of leaving it open.
+        self._conn.execute(f"BEGIN {mode}")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _bump_counter(self, name: str, amount: int = 1) -> None:
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def _calendar(self, ticker: str) -> Optional[Dict[str, Any]]:
+        # Must be called with self._lock held.
+        columns = ("last_annual", "last_quarterly", "announced_report", "annual_checked_at", "annual_changed_at",
+                   "quarterly_checked_at", "quarterly_changed_at")
+        row = self._conn.execute(f"SELECT {', '.join(columns)} FROM report_calendar WHERE ticker = ?", (ticker,)).fetchone()
+        if row is None:
+            return None
+        calendar = dict(zip(columns, row))
+        for period in ("annual", "quarterly"):
+            last = calendar[f"last_{period}"]
+            calendar[f"next_{period}_report"], calendar[f"next_{period}_source"] = None, None
+            if last is None:
+                continue
+            # An announced date is the next report of this frequency only if it falls after the end of the period that
+            # follows the last reported one; otherwise it is the date of results already stored (or a quarterly report
+            # that does not change the annual statements).
+            announced = calendar["announced_report"]
+            if announced and announced > last + FISCAL_PERIOD_SECONDS[period]:
+                calendar[f"next_{period}_report"], calendar[f"next_{period}_source"] = announced, "announced"
+            else:
+                calendar[f"next_{period}_report"] = last + FISCAL_PERIOD_SECONDS[period] + self.report_lag_seconds
+                calendar[f"next_{period}_source"] = "estimated"
+        return calendar
+
+    def _is_fresh(self, statement: str, stored_at: float, calendar: Optional[Dict[str, Any]], now: float) -> bool:
+        # A newer period of the block's frequency seen since it was stored makes it out of date. Otherwise the calendar
+        # only extends the TTL: until the next report of that frequency, then for `revalidate_seconds` after each
+        # revalidation.
+        reported = statement in REPORTED_STATEMENTS and calendar is not None
+        period = frequency(statement)
+        if reported and stored_at < calendar[f"{period}_changed_at"]:
+            return False
+        if now - stored_at <= self.ttl_for(statement):
+            return True
+        if not reported:
+            return False
+        if calendar[f"next_{period}_report"] is None:
+            return False
+        if now < calendar[f"next_{period}_report"]:
+            return True
+        return now - max(stored_at, calendar[f"{period}_checked_at"]) < self.revalidate_seconds
+
+    def _record_period(self, ticker: str, statement: str, newest: Optional[float], now: float) -> None:
+        # Must be called inside a write transaction. A freshly fetched statement also confirms the newest period of
+        # its frequency is current.
+        if newest is None:
+            return
+        period = frequency(statement)
+        column, checked_column, changed_column = f"last_{period}", f"{period}_checked_at", f"{period}_changed_at"
+        row = self._conn.execute(f"SELECT {column} FROM report_calendar WHERE ticker = ?", (ticker,)).fetchone()
+        changed = row is not None and row[0] is not None and newest > row[0]
+        self._conn.execute(
+            f"INSERT INTO report_calendar (ticker, {column}, {checked_column}) VALUES (?, ?, ?) "
+            f"ON CONFLICT(ticker) DO UPDATE SET {column} = MAX(COALESCE({column}, 0), excluded.{column}), "
+            f"{checked_column} = MAX({checked_column}, excluded.{checked_column}), "
+            f"{changed_column} = CASE WHEN ? THEN ? ELSE {changed_column} END",
+            (ticker, newest, now, changed, now),
+        )
+
+    def _evict(self) -> None:
+        # Must be called inside a write transaction.
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM statements").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for ticker, statement, size in self._conn.execute(
+            "SELECT ticker, statement, size FROM statements ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM statements WHERE ticker = ? AND statement = ?", (ticker, statement))
+            total -= size
+            evicted += 1
+        self._bump_counter("evictions", evicted)
+
+
+_statement_cache: Optional[StatementCache] = None
+_statement_cache_lock = threading.Lock()
+
+def get_statement_cache() -> StatementCache:
+    """Returns the process wide StatementCache, opening the SQLite file on first use."""
+    global _statement_cache
+    if _statement_cache is None:
+        with _statement_cache_lock:
+            if _statement_cache is None:
+                _statement_cache = StatementCache(
+                    path=FUNDAMENTALS_CACHE_PATH,
+                    max_bytes=FUNDAMENTALS_CACHE_MAX_BYTES,
+                    ttls=FUNDAMENTALS_CACHE_TTLS,
+                    report_lag_days=EARNINGS_REPORT_LAG_DAYS,
+                    revalidate_seconds=STATEMENT_REVALIDATE_SECONDS,
+                )
+    return _statement_cache
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import contextvars
+import threading
+import time
+import pandas as pd
+import yfinance as yf
+
+from config.settings import STATEMENT_FETCH_WORKERS, STATEMENT_BLOCK_TIMEOUT_SECONDS
+from services.resilience import get_upstream, remaining
+from services.single_flight import get_single_flight
+from services.tracing import get_tracer
+from .statement_cache import get_statement_cache
+
+# yfinance blocks returned by `get_data_tables`. Each one is a separate round trip to Yahoo.
+STATEMENT_BLOCKS = ("info", "financials", "balance_sheet", "cashflow", "income_stmt")
+QUARTERLY_STATEMENT_BLOCKS = ("info", "quarterly_financials", "quarterly_balance_sheet", "quarterly_cashflow", "quarterly_income_stmt")
+FREQUENCY_BLOCKS = {"annual": STATEMENT_BLOCKS, "quarterly": QUARTERLY_STATEMENT_BLOCKS}
+
+# Shared by all tool calls of the process so the number of concurrent Yahoo requests stays bounded.
+_fetch_pool = ThreadPoolExecutor(max_workers=STATEMENT_FETCH_WORKERS, thread_name_prefix="statement_fetch")
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Returns the HTTP session shared by every Ticker the tools create, so cookies, crumb and connections are reused.
+    Returns None (yfinance's own default session) when curl_cffi, which yfinance sessions require, is unavailable.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                try:
+                    from curl_cffi import requests as curl_requests
+                    _http_session = curl_requests.Session(impersonate="chrome")
+                except ImportError:
+                    return None
+    return _http_session
+
+def make_ticker(symbol: str) -> yf.Ticker:
+    """Creates a yfinance Ticker on the shared HTTP session."""
+    return yf.Ticker(symbol.strip().upper(), session=get_http_session())
+
+
+def _fetch_block(ticker: yf.Ticker, block: str, count: bool = True) -> Tuple[Any, bool]:
+    # Revalidates or fetches a block the cache could not serve. Returns (value, revalidated).
+    cache = get_statement_cache()
+    if cache.is_fresh(ticker.ticker, block): # Stored by an identical fetch that finished just before this one started.
+        return cache.get(ticker.ticker, block, count), False
+    if cache.revalidate(ticker, block):
+        value = cache.get(ticker.ticker, block, count)
+        if value is not None:
+            return value, True
+    try:
+        value = get_upstream("yfinance").call(getattr, ticker, block)
+        failure = None if value is not None and len(value) > 0 else "empty block" # Yahoo often fails with empty data.
+    except Exception as e:
+        value, failure = None, f"{type(e).__name__}: {e}"
+    if failure is None:
+        cache.put(ticker.ticker, block, value)
+        return value, False
+    if value is not None:
+        cache.record_empty(ticker.ticker, block)
+    stale = cache.get_stale(ticker.ticker, block)
+    if stale is not None:
+        print(f"Warning: serving the stored '{block}' of {ticker.ticker}, Yahoo failed: {failure}")
+        return stale, False
+    if value is None:
+        raise RuntimeError(failure)
+    return value, False
+
+def load_block(ticker: yf.Ticker, block: str, count: bool = True):
+    """
+    Returns a yfinance block (`info`, `financials`, ...) of the ticker, served from the on-disk cache when fresh.
+    A stored statement past the company's expected report date is first revalidated against the newest period of
+    its frequency, which costs one small request instead of a refetch of every statement. Concurrent loads of the same
+    block (e.g. several sessions asking about one company) share a single upstream request.
+
+    Empty blocks are not cached so that a transient upstream failure is retried on the next turn; they are only
+    remembered for the prefetcher (`StatementCache.is_known_empty`). The prefetcher loads with `count=False` so that
+    its lookups do not count as cache hits or misses of user turns.
+    """
+    with get_tracer().span("fetch", block, ticker=ticker.ticker) as span:
+        value = get_statement_cache().get(ticker.ticker, block, count)
+        if span:
+            span.attributes["cache_hit"] = value is not None
+        if value is None:
+            value, revalidated = get_single_flight("statements").do((ticker.ticker, block), _fetch_block, ticker, block, count)
+            if span:
+                span.attributes["revalidated"] = revalidated
+        return value
+
+def fetch_blocks(ticker: yf.Ticker,
+                 blocks: Iterable[str] = STATEMENT_BLOCKS,
+                 timeout: float = STATEMENT_BLOCK_TIMEOUT_SECONDS,
+                 executor: Optional[ThreadPoolExecutor] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Fetches the blocks of a ticker concurrently on a bounded thread pool.
+
+    Args:
+        ticker: yfinance Ticker (or any object exposing the same attributes).
+        blocks: Names of the blocks to fetch.
+        timeout: Seconds each block may take, counted from the moment all blocks are submitted.
+        executor: Thread pool to use, defaults to the process wide statement pool.
+
+    Returns:
+        A tuple (fetched, missing): `fetched` maps block name to its value and `missing` maps the name of every
+        block that timed out or failed to the reason. A slow block never holds back the others.
+    """
+    return fetch_many([ticker], blocks, timeout, executor)[ticker.ticker]
+
+def fetch_many(tickers: List[yf.Ticker],
+               blocks: Iterable[str] = STATEMENT_BLOCKS,
+               timeout: float = STATEMENT_BLOCK_TIMEOUT_SECONDS,
+               executor: Optional[ThreadPoolExecutor] = None) -> Dict[str, Tuple[Dict[str, Any], Dict[str, str]]]:
+    """
+    Same as `fetch_blocks` for several tickers at once: every (ticker, block) pair is submitted to the pool up
+    front, so the wall time of a batch is that of its slowest block rather than the sum over tickers.
+    The timeout is cut to what is left of the turn's deadline.
+
+    Returns:
+        A dict mapping each ticker symbol to its (fetched, missing) tuple.
+    """
+    executor = executor or _fetch_pool
+    blocks = tuple(blocks)
+    timeout = min(timeout, remaining(timeout))
+    # Each fetch runs in a copy of the caller's context so its trace span is nested under the calling tool.
+    futures = {
+        (ticker.ticker, block): executor.submit(contextvars.copy_context().run, load_block, ticker, block)
+        for ticker in tickers for block in blocks
+    }
+    deadline = time.monotonic() + timeout
+
+    results = {ticker.ticker: (dict(), dict()) for ticker in tickers}
+    for (symbol, block), future in futures.items():
+        fetched, missing = results[symbol]
+        try:
+            fetched[block] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            future.cancel() # Only succeeds if the block is still queued; a running fetch finishes in the background.
+            missing[block] = f"timed out after {timeout}s"
+        except Exception as e:
+            missing[block] = f"{type(e).__name__}: {e}"
+    return results
+
+def align_statements(frames: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+    """
+    Merges one statement (e.g. `financials`) of several tickers into a single table aligned on fiscal year.
+
+    yfinance statements have line items as rows and period end dates as columns. Companies close their books on
+    different dates (March for most Indian companies, December for most US ones), so periods are aligned on the
+    calendar year of the period end and labelled "FY<year>".
+
+    Args:
+        frames: Statement DataFrame of each ticker symbol.
+
+    Returns:
+        {"periods": ["FY2025", ...], "line_items": {"Total Revenue": {"<ticker>": [value per period, ...]}, ...}}
+        Periods are newest first and values missing for a ticker or period are None.
+    """
+    by_year = dict()
+    for symbol, frame in frames.items():
+        if frame is None or frame.empty:
+            continue
+        frame = frame.T.groupby(pd.to_datetime(frame.columns).year).first().T # One column per fiscal year.
+        by_year[symbol] = frame
+
+    years = sorted({year for frame in by_year.values() for year in frame.columns}, reverse=True)
+    line_items = dict()
+    for symbol, frame in by_year.items():
+        frame = frame.reindex(columns=years)
+        for item, values in frame.iterrows():
+            line_items.setdefault(item, dict())[symbol] = [None if pd.isna(v) else float(v) for v in values]
+    return {
+        "periods": [f"FY{year}" for year in years],
+        "line_items": line_items,
+    }
@@ -2,50 +2,103 @@ from google.adk.agents import LlmAgent
 from google.adk.agents.callback_context import CallbackContext
 from google.genai import types
 
-from pydantic import BaseModel, Field
 from typing import Optional
 import json
 
-class QueryKeyParams(BaseModel):
-    query_key_params: dict[str,str] = Field(
-        description="Dictionary containing key params from user query."
+from config.settings import PREFILTER_ENABLED
+from services.resilience import ResilientGemini
+from services.symbol_index import get_symbol_index
+from services.tracing import traced_callback
+from .params import QueryKeyParams, get_query_key_params, parse_query_key_params, parse_stats
+from .prefilter import get_prefilter
+
+def _user_query(callback_context: CallbackContext) -> str:
+    user_content = callback_context.user_content
+    return " ".join(part.text for part in user_content.parts if part.text) if user_content and user_content.parts else ""
+
+def prefilter_user_query(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Callback that settles clear on-topic and off-topic user queries with the local pre-filter classifier and skips
+    the agent, so that only ambiguous queries pay for a model call.
+
+    Args:
+        callback_context: Contains state and context information.
+
+    Returns:
+        None to continue with normal agent processing (ambiguous query).
+        types.Content with the pre-filled query_key_params to skip the agent processing.
+    """
+    if not PREFILTER_ENABLED:
+        return None
+    state = callback_context.state
+    agent_name = callback_context.agent_name
+    user_query = _user_query(callback_context)
+
+    prefilter = get_prefilter()
+    decision = prefilter.classify(user_query)
+    print(f"Info: [Callback] {agent_name} pre-filter: {decision.label} (p={decision.probability:.3f}), counts {dict(prefilter.counts)}")
+    if decision.label == "ambiguous":
+        return None
+
+    query_key_params = QueryKeyParams.model_validate(prefilter.query_key_params(user_query, decision)).to_state()
+    state["query_key_params"] = query_key_params
+    return types.Content(
+        parts=[types.Part(text=json.dumps(query_key_params))],
+        role="model" # Assign model role to the overriding response
     )
 
-def irrelevant_user_query(callback_context: CallbackContext) -> Optional[types.Content]:
+def parse_query_key_params_once(callback_context: CallbackContext) -> Optional[types.Content]:
     """
-    Callback that handles irrelevant user_query response.
+    Callback that parses and validates the JSON written by the model into QueryKeyParams, once for the whole turn,
+    and stores it in state as a dict: later stages read it with `get_query_key_params` instead of parsing JSON again.
+    Truncated or wrapped JSON is repaired; when nothing can be recovered the turn goes on as a plain relevant query.
 
     Args:
         callback_context: Contains state and context information.
 
     Returns:
-        None to continue with normal agent processing.
-        Dict for interrupting the SequentialAgent Pipeline.
+        None, state["query_key_params"] holds the parsed dict.
     """
-    curr_state = callback_context.state
-    query_key_params = json.loads(curr_state["query_key_params"].strip().removeprefix("```json").removesuffix("```").strip())
+    state = callback_context.state
+    agent_name = callback_context.agent_name
+    query_key_params, outcome = parse_query_key_params(state.get("query_key_params"), fallback_query=_user_query(callback_context))
+    if outcome != "parsed":
+        print(f"Warning: [Callback] {agent_name} query_key_params {outcome}, parse stats {parse_stats()}")
+    state["query_key_params"] = query_key_params.to_state()
+    return None
 
-    if "relevance" not in query_key_params.keys():
-        print("Warning: relevance NOT in state['query_key_params']")
+def resolve_company_tickers(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Callback that resolves the "companies" of query_key_params to exchange tickers with the local symbol index,
+    so that data_chart_agent does not have to guess symbols (and the ".NS" suffix) with a model round trip.
+
+    Args:
+        callback_context: Contains state and context information.
 
-    relevance = query_key_params.get("relevance", "yes")
-    if relevance.lower().strip() == "yes":
+    Returns:
+        None, query_key_params in state is updated with "tickers" (and "unresolved_companies" if any).
+    """
+    state = callback_context.state
+    agent_name = callback_context.agent_name
+    query_key_params = get_query_key_params(state)
+    if query_key_params is None:
+        print("Warning: query_key_params not found in ADK state.")
         return None
-    else:
-        print("---User Query is outside the App's capabilities---")
-        # return {
-        #     "status": "aborted",
-        #     "error": "user_query is outside the App's capabilities"
-        # }
-        return {
-            "status": "aborted",
-            "error": "user_query is outside the App's capabilities"
-        }
-    
+
+    index = get_symbol_index()
+    resolved = {company: index.resolve(company) for company in query_key_params.companies}
+    tickers = [ticker for ticker in resolved.values() if ticker]
+    if tickers:
+        query_key_params.tickers = list(dict.fromkeys(tickers))
+    query_key_params.unresolved_companies = [company for company, ticker in resolved.items() if not ticker]
+    print(f"Info: [Callback] {agent_name} resolved companies to tickers: {resolved}")
+    state["query_key_params"] = query_key_params.to_state()
+    return None
+
 
 query_input_agent = LlmAgent(
     name="query_input_agent",
-    model="gemini-2.5-flash",
+    model=ResilientGemini(model="gemini-2.5-flash"),
     description="Agent that greets users and receives query from user.",
     instruction="""You are a helpful assistant that understands the user query.
     You will receive the user query related to market research and company/business information.
@@ -78,5 +131,7 @@ query_input_agent = LlmAgent(
     """,
     output_key="query_key_params",
     # output_schema=QueryKeyParams,
-    # after_agent_callback=irrelevant_user_query,
+    before_agent_callback=traced_callback(prefilter_user_query),
+    # The model output is parsed once here; every later stage reads the validated dict from state.
+    after_agent_callback=[traced_callback(parse_query_key_params_once), traced_callback(resolve_company_tickers)],
 )
\ No newline at end of file
@@ -0,0 +1,181 @@
+from collections import Counter
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import json
+import threading
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+
+class QueryKeyParams(BaseModel):
+    """
+    Key params of the user query produced by query_input_agent (or the pre-filter) and read by every later stage.
+
+    Only "user_query" and "relevance" are always known. The model may add keys of its own (the prompt says the keys
+    are non-exhaustive): they are kept as extra fields.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    user_query: str = Field(default="", description="The user query, verbatim.")
+    relevance: str = Field(default="yes", description='"no" when the query is outside the capabilities of the app.')
+    country: List[str] = Field(default_factory=list, description="Countries the query is about.")
+    market: List[str] = Field(default_factory=list, description="Markets or industries the query is about.")
+    companies: List[str] = Field(default_factory=list, description="Companies named in the query.")
+    metrics: List[str] = Field(default_factory=list, description="Financial metrics asked for.")
+    tickers: List[str] = Field(default_factory=list, description="Exchange tickers the companies resolved to.")
+    unresolved_companies: List[str] = Field(default_factory=list, description="Companies no ticker was found for.")
+
+    @field_validator("relevance", mode="before")
+    @classmethod
+    def _normalise_relevance(cls, value: Any) -> str:
+        return "no" if str(value).strip().lower() == "no" else "yes"
+
+    @field_validator("country", "market", "companies", "metrics", "tickers", "unresolved_companies", mode="before")
+    @classmethod
+    def _as_list(cls, value: Any) -> List[str]:
+        if value is None or value == "":
+            return []
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        return [str(item).strip() for item in value if item is not None and str(item).strip()]
+
+    @field_validator("user_query", mode="before")
+    @classmethod
+    def _as_text(cls, value: Any) -> str:
+        return "" if value is None else str(value)
+
+    @property
+    def is_relevant(self) -> bool:
+        return self.relevance == "yes"
+
+    def to_state(self) -> Dict[str, Any]:
+        """The JSON-serialisable dict stored in state["query_key_params"], without the empty optional fields."""
+        return {key: value for key, value in self.model_dump().items()
+                if key in ("user_query", "relevance") or value not in (None, "", [], {})}
+
+
+# Outcomes of parse_query_key_params: "parsed", "repaired" (truncated or wrapped JSON) or "failed" (fallback used).
+_parse_counts = Counter()
+_parse_counts_lock = threading.Lock()
+
+def parse_stats() -> Dict[str, Any]:
+    """Returns the number of payloads parsed, repaired and failed since start-up, and the failure rate."""
+    with _parse_counts_lock:
+        counts = {outcome: _parse_counts[outcome] for outcome in ("parsed", "repaired", "failed")}
+    total = sum(counts.values())
+    counts["failure_rate"] = round(counts["failed"] / total, 4) if total else 0.0
+    return counts
+
+def _strip_fences(text: str) -> str:
+    return text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+
+def repair_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Recovers a JSON object from model output that is wrapped in prose or truncated (e.g. by the output token limit).
+
+    The object starting at the first "{" is decoded, ignoring anything after it. A truncated object is closed: the
+    text is cut back to the last complete member (or array element) before the open arrays and objects are closed.
+    A value cut off while being written is dropped, not kept: `"companies": ["TCS", "Inf` gives ["TCS"], never a
+    company "Inf" that the symbol index would resolve to some ticker. Returns None when no object can be recovered.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text)
+        return value if isinstance(value, dict) else None
+    except ValueError:
+        pass
+
+    # Scan the truncated text, remembering the open brackets at each point a member (or element) is complete or starts.
+    stack, cut_points = list(), list()
+    in_string = escaped = False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            cut_points.append((position + 1, "".join(reversed(stack))))
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            cut_points.append((position + 1, "".join(reversed(stack))))
+        elif char == ",":
+            cut_points.append((position, "".join(reversed(stack))))
+    candidates = list()
+    tail = text.rstrip().rstrip(",").rstrip()
+    # The text ends on a complete value (a closed string, array or object, true, false or null), not a partial number.
+    if not in_string and tail.endswith(('"', "]", "}", "true", "false", "null")):
+        candidates.append(tail + "".join(reversed(stack)))
+    candidates += [text[:position] + closers for position, closers in reversed(cut_points)]
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+def parse_query_key_params(raw: Any, fallback_query: str = "") -> Tuple[QueryKeyParams, str]:
+    """
+    Parses and validates the query_key_params written by query_input_agent. Never raises.
+
+    Args:
+        raw: Model output (fenced JSON string), or an already parsed dict.
+        fallback_query: User query used when nothing can be recovered, so the turn degrades to a plain relevant query.
+
+    Returns:
+        A tuple (params, outcome), outcome being "parsed", "repaired" or "failed". Outcomes are counted, see parse_stats.
+    """
+    outcome = "parsed"
+    if isinstance(raw, Mapping):
+        payload = dict(raw)
+    else:
+        text = _strip_fences(str(raw or ""))
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = repair_json_object(text)
+            outcome = "repaired"
+        if not isinstance(payload, dict):
+            payload, outcome = None, "failed"
+
+    params = None
+    if payload is not None:
+        try:
+            params = QueryKeyParams.model_validate(payload)
+        except ValidationError as e:
+            print(f"Error: query_key_params failed validation: {e}")
+            outcome = "failed"
+    if params is None:
+        params = QueryKeyParams(user_query=fallback_query)
+    elif not params.user_query:
+        params.user_query = fallback_query
+
+    with _parse_counts_lock:
+        _parse_counts[outcome] += 1
+    return params, outcome
+
+def get_query_key_params(state: Mapping[str, Any]) -> Optional[QueryKeyParams]:
+    """
+    Returns the QueryKeyParams of the turn, from the dict query_input_agent stored in state, or None when there is none.
+    A raw string (a session written before parsing moved to query_input_agent) is parsed on the fly.
+    """
+    value = state.get("query_key_params")
+    if not value:
+        return None
+    if isinstance(value, Mapping):
+        try:
+            return QueryKeyParams.model_validate(dict(value))
+        except ValidationError as e:
+            print(f"Error: query_key_params in state failed validation: {e}")
+            return None
+    return parse_query_key_params(value)[0]
@@ -0,0 +1,149 @@
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import csv
+import math
+import random
+import re
+import threading
+import zlib
+
+from config.settings import PREFILTER_SEED_PATH, PREFILTER_ON_TOPIC_THRESHOLD, PREFILTER_OFF_TOPIC_THRESHOLD
+from services.symbol_index import SymbolIndex, get_symbol_index
+
+# Lexicon of terms that make a query clearly about business/finance, matched on whole words.
+FINANCE_TERMS = {
+    "revenue", "revenues", "sales", "profit", "profits", "net profit", "net income", "income", "earnings", "eps",
+    "margin", "margins", "operating margin", "gross margin", "ebitda", "ebit", "cash flow", "free cash flow",
+    "balance sheet", "income statement", "assets", "total assets", "liabilities", "debt", "debt to equity", "equity",
+    "roe", "roa", "return on equity", "return on assets", "valuation", "market cap", "market capitalisation",
+    "market capitalization", "market share", "share price", "stock price", "stock", "shares", "dividend", "dividends",
+    "p/e", "pe ratio", "npa", "gross npa", "net npa", "asset quality", "loan growth", "deposits", "net interest margin",
+    "nim", "arpu", "capex", "quarterly results", "results", "guidance", "growth", "financials", "fiscal", "quarter",
+}
+# Lexicon of terms that make a query clearly off-topic.
+OFF_TOPIC_TERMS = {
+    "score", "live score", "match", "cricket", "football", "ipl", "world cup", "weather", "recipe", "cook", "movie",
+    "song", "lyrics", "music", "joke", "poem", "hello", "hi", "hey", "how are you", "thanks", "bye", "homework",
+    "translate", "flight", "calories", "oscar", "actor",
+}
+N_FEATURES = 2 ** 18 # Hashing space of the n-gram features.
+LEXICON_WEIGHT = 1.5 # Logit added per finance term found (subtracted per off-topic term).
+COMPANY_WEIGHT = 1.0 # Logit added when a listed company is mentioned.
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9&/']+", text.lower())
+
+def _find_terms(words: List[str], lexicon: Iterable[str]) -> List[str]:
+    padded = f" {' '.join(words)} "
+    return sorted(term for term in lexicon if f" {term} " in padded)
+
+def hashed_features(text: str) -> Dict[int, float]:
+    """Word unigrams and bigrams hashed (stable crc32) into N_FEATURES buckets and L2 normalised."""
+    words = _words(text)
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    counts = Counter(zlib.crc32(gram.encode("utf-8")) % N_FEATURES for gram in grams)
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {index: value / norm for index, value in counts.items()}
+
+
+class HashedLogisticModel:
+    """Logistic regression over hashed n-gram features, trained with plain SGD (deterministic seed)."""
+
+    def __init__(self):
+        self.weights: Dict[int, float] = dict()
+        self.bias = 0.0
+
+    def logit(self, features: Dict[int, float]) -> float:
+        return self.bias + sum(self.weights.get(index, 0.0) * value for index, value in features.items())
+
+    def fit(self, samples: List[Tuple[str, int]], epochs: int = 40, learning_rate: float = 0.5, l2: float = 1e-4) -> "HashedLogisticModel":
+        rows = [(hashed_features(text), label) for text, label in samples]
+        rng = random.Random(0)
+        for _ in range(epochs):
+            rng.shuffle(rows)
+            for features, label in rows:
+                error = 1.0 / (1.0 + math.exp(-self.logit(features))) - label
+                self.bias -= learning_rate * error
+                for index, value in features.items():
+                    weight = self.weights.get(index, 0.0)
+                    self.weights[index] = weight - learning_rate * (error * value + l2 * weight)
+        return self
+
+    @classmethod
+    def from_csv(cls, path: str) -> "HashedLogisticModel":
+        """Trains a model from a CSV file with the columns label (1 = on-topic, 0 = off-topic) and text."""
+        with open(path, newline="", encoding="utf-8") as f:
+            samples = [(row["text"], int(row["label"])) for row in csv.DictReader(f)]
+        return cls().fit(samples)
+
+
+class PrefilterDecision(NamedTuple):
+    label: str # "relevant", "irrelevant" or "ambiguous" (left to the LLM).
+    probability: float # Probability of the query being on-topic.
+    companies: List[Tuple[str, str]] # (official name, ticker) of the companies mentioned.
+    finance_terms: List[str]
+    off_topic_terms: List[str]
+
+
+class QueryPrefilter:
+    """
+    In-process classifier that settles obviously on-topic and off-topic queries before query_input_agent.
+
+    The on-topic probability combines a hashed n-gram logistic model with a keyword lexicon and the companies
+    found by the symbol index. A query is only settled locally when the lexicon agrees with the model, everything
+    else is "ambiguous" and goes to the LLM.
+    """
+
+    def __init__(self, model: HashedLogisticModel, index: SymbolIndex,
+                 on_topic_threshold: float = PREFILTER_ON_TOPIC_THRESHOLD,
+                 off_topic_threshold: float = PREFILTER_OFF_TOPIC_THRESHOLD):
+        self.model = model
+        self.index = index
+        self.on_topic_threshold = on_topic_threshold
+        self.off_topic_threshold = off_topic_threshold
+        self.counts = Counter() # Number of decisions per label.
+
+    def classify(self, text: str) -> PrefilterDecision:
+        words = _words(text)
+        finance_terms = _find_terms(words, FINANCE_TERMS)
+        off_topic_terms = _find_terms(words, OFF_TOPIC_TERMS)
+        companies = [(self.index.names[symbol], symbol) for _, symbol in self.index.find_in_text(text)]
+
+        logit = self.model.logit(hashed_features(text))
+        logit += LEXICON_WEIGHT * (len(finance_terms) - len(off_topic_terms)) + (COMPANY_WEIGHT if companies else 0.0)
+        probability = 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, logit))))
+
+        if companies and finance_terms and not off_topic_terms and probability >= self.on_topic_threshold:
+            label = "relevant"
+        elif not companies and not finance_terms and probability <= self.off_topic_threshold:
+            label = "irrelevant"
+        else:
+            label = "ambiguous"
+        self.counts[label] += 1
+        return PrefilterDecision(label, probability, companies, finance_terms, off_topic_terms)
+
+    def query_key_params(self, text: str, decision: PrefilterDecision) -> Dict:
+        """The query_key_params that query_input_agent would have produced for a settled query."""
+        if decision.label == "irrelevant":
+            return {"user_query": text, "relevance": "no"}
+        return {
+            "user_query": text,
+            "relevance": "yes",
+            "companies": [name for name, _ in decision.companies],
+            "tickers": [symbol for _, symbol in decision.companies],
+            "metrics": decision.finance_terms,
+        }
+
+
+_prefilter: Optional[QueryPrefilter] = None
+_prefilter_lock = threading.Lock()
+
+def get_prefilter() -> QueryPrefilter:
+    """Returns the process wide QueryPrefilter, training its model from PREFILTER_SEED_PATH on first use."""
+    global _prefilter
+    if _prefilter is None:
+        with _prefilter_lock:
+            if _prefilter is None:
+                _prefilter = QueryPrefilter(HashedLogisticModel.from_csv(PREFILTER_SEED_PATH), get_symbol_index())
+    return _prefilter
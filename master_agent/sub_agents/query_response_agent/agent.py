@@ -1,8 +1,87 @@
 from google.adk.agents import LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
+from typing import Optional
+import json
+
+from services.resilience import ResilientGemini
+from services.tracing import traced_callback
+from .budget import budget_context, summarize_chart
+from ..query_input_agent.params import get_query_key_params
+from ..data_chart_agent.encoding import estimate_tokens
+
+# Sent instead of a model written answer when query_input_agent marks the query as irrelevant.
+IRRELEVANT_QUERY_RESPONSE = """Thank you for your question! Unfortunately, it is outside of what I can help with.
+
+I am a business analytics assistant and can answer questions about:
+- companies' financial performance (revenue, profit, margins, balance sheet, cash flow)
+- markets, market share and industry trends
+- business and finance news about companies
+
+Please feel free to ask me anything along those lines."""
+
+def irrelevant_user_query_response(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Callback that answers irrelevant user queries with a templated decline instead of a model call.
+
+    Args:
+        callback_context: Contains state and context information.
+
+    Returns:
+        None to continue with normal agent processing.
+        types.Content with the decline message to skip the agent processing.
+    """
+    state = callback_context.state
+    agent_name = callback_context.agent_name
+
+    query_key_params = get_query_key_params(state)
+    if query_key_params is None:
+        print("Warning: query_key_params not found in ADK state.")
+        return None
+    if query_key_params.is_relevant:
+        print(f"Info: [Callback] State condition not met: Proceeding with agent {agent_name}.")
+        return None
+
+    print(f"Info: User Query is outside the App's capabilities.\nAnswering with the templated decline in {agent_name}.")
+    state["query_response"] = IRRELEVANT_QUERY_RESPONSE
+    return types.Content(
+        parts=[types.Part(text=IRRELEVANT_QUERY_RESPONSE)],
+        role="model" # Assign model role to the overriding response
+    )
+
+def budget_response_context(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Callback that fits the outputs of the research agents into the prompt budget of the agent: the search content is
+    chunked, de-duplicated, ranked against query_key_params and packed up to RESPONSE_CONTEXT_TOKEN_BUDGET tokens
+    (state["response_context"]), and the chart option is replaced by a summary of its series (state["chart_summary"]).
+
+    Args:
+        callback_context: Contains state and context information.
+
+    Returns:
+        None to continue with normal agent processing.
+    """
+    state = callback_context.state
+    agent_name = callback_context.agent_name
+    query_key_params = get_query_key_params(state)
+    context = budget_context(state.get("retrieved_content") or "", query_key_params.to_state() if query_key_params else dict())
+    chart_objects = state.get("chart_objects") or ""
+    chart_summary = summarize_chart(chart_objects)
+    state["response_context"] = context.text
+    state["chart_summary"] = chart_summary or "No chart was built for this query."
+
+    chart_tokens = estimate_tokens(chart_objects if isinstance(chart_objects, str) else json.dumps(chart_objects))
+    before = context.tokens_before + chart_tokens
+    after = context.tokens_after + estimate_tokens(state["chart_summary"])
+    print(f"Info: [Callback] {agent_name} prompt context {before} -> {after} tokens (saved {before - after}): "
+          f"search content {context.tokens_before} -> {context.tokens_after} ({context.chunks} chunks, "
+          f"{context.duplicates} near-duplicates, {context.dropped} over budget), chart {chart_tokens} -> {estimate_tokens(state['chart_summary'])}")
+    return None
+
 
 query_response_agent = LlmAgent(
     name="query_response_agent",
-    model="gemini-2.0-flash",
+    model=ResilientGemini(model="gemini-2.0-flash"),
     description="Agent that gives well-drafted response to the user query based on content of previous agents.",
     instruction="""You're are a helpful agent that is good at writing well-structured answer to user_query based on given context.
     Be polite, friednly and professional. Maintain a helpful tone.
@@ -13,19 +92,20 @@ query_response_agent = LlmAgent(
     {query_key_params}
     
     # CONTENT RECEIVED FROM ONLINE SOURCES:
-    {retrieved_content}
+    {response_context}
 
-    # CHART OBJECTS:
-    {chart_objects}
+    # CHART SHOWN TO THE USER:
+    {chart_summary}
 
     Response Format:
     ```
     Answer to the query in short paragraphs.
     Use bullet points wherever required.
     ```
-
-    Exception:
-    If the user_query is not relevant and the query_input_agent deems it fit then use the query_input_agent response as your response and alert the user that the user is irrelvant to app's capabilities.
     """,
     output_key="query_response",
+    # Irrelevant queries are declined here without a model call; the two research agents skip themselves as well,
+    # so an off-topic turn costs the single classification call of query_input_agent.
+    # The search content and the chart are budgeted into response_context / chart_summary before the prompt is built.
+    before_agent_callback=[traced_callback(irrelevant_user_query_response), traced_callback(budget_response_context)],
 )
\ No newline at end of file
@@ -0,0 +1,184 @@
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple
+import json
+import math
+import re
+
+from config.settings import RESPONSE_CONTEXT_TOKEN_BUDGET, RESPONSE_CHUNK_MAX_TOKENS, RESPONSE_DEDUP_MIN_SIMILARITY
+from ..data_chart_agent.encoding import estimate_tokens
+
+BM25_K1 = 1.5 # Term frequency saturation.
+BM25_B = 0.75 # Document length normalisation.
+SHINGLE_SIZE = 3 # Words per shingle of the near-duplicate check.
+CHART_SUMMARY_MAX_VALUES = 12 # Longer series (e.g. daily prices) are summarised by their first, lowest, highest and last value.
+# Words that carry no relevance for ranking.
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "at", "to", "and", "or", "is", "are", "was", "were", "be", "been", "it",
+    "its", "this", "that", "with", "by", "from", "as", "what", "how", "which", "me", "tell", "show", "about", "please",
+    "give", "their", "has", "have", "had", "do", "does", "did", "over", "last", "yes", "no",
+}
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", text.lower().replace("'s", ""))
+
+def _terms(text: str) -> List[str]:
+    return [word for word in _words(text) if word not in STOPWORDS]
+
+
+class BudgetedContext(NamedTuple):
+    text: str
+    tokens_before: int
+    tokens_after: int
+    chunks: int
+    duplicates: int
+    dropped: int
+
+
+def split_chunks(text: str, max_tokens: int = RESPONSE_CHUNK_MAX_TOKENS) -> List[str]:
+    """
+    Splits text into passages: paragraphs and list items, with passages longer than `max_tokens` split on sentence
+    boundaries into chunks of about that size.
+    """
+    passages = [p.strip() for p in re.split(r"\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)])\s)", text) if p.strip()]
+    chunks = list()
+    for passage in passages:
+        if estimate_tokens(passage) <= max_tokens:
+            chunks.append(passage)
+            continue
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", passage):
+            if current and estimate_tokens(current + " " + sentence) > max_tokens:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}".strip()
+        if current:
+            chunks.append(current)
+    return chunks
+
+def _shingles(text: str) -> set:
+    words = _words(text)
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def drop_near_duplicates(chunks: List[str], min_similarity: float = RESPONSE_DEDUP_MIN_SIMILARITY) -> List[int]:
+    """
+    Returns the indices of the chunks to keep: a chunk is dropped when its word shingles overlap those of an earlier
+    kept chunk by at least `min_similarity` (Jaccard), or are contained in them (a passage repeated within a longer one).
+    """
+    kept, kept_shingles = list(), list()
+    for index, chunk in enumerate(chunks):
+        shingles = _shingles(chunk)
+        duplicate = False
+        for other in kept_shingles:
+            common = len(shingles & other)
+            if common / len(shingles | other) >= min_similarity or common / len(shingles) >= 0.9:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(index)
+            kept_shingles.append(shingles)
+    return kept
+
+def bm25_scores(query_terms: List[str], documents: List[List[str]], k1: float = BM25_K1, b: float = BM25_B) -> List[float]:
+    """Okapi BM25 score of each tokenised document for the query terms, with the documents themselves as the corpus."""
+    if not documents:
+        return []
+    average_length = sum(len(document) for document in documents) / len(documents) or 1.0
+    document_frequency = Counter(term for document in documents for term in set(document))
+    idf = {
+        term: math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+        for term in set(query_terms)
+    }
+    scores = list()
+    for document in documents:
+        frequencies = Counter(document)
+        norm = k1 * (1 - b + b * len(document) / average_length)
+        scores.append(sum(
+            idf[term] * frequencies[term] * (k1 + 1) / (frequencies[term] + norm)
+            for term in idf if frequencies[term]
+        ))
+    return scores
+
+def query_terms(query_key_params: Dict[str, Any]) -> List[str]:
+    """Ranking terms of a turn: the words of every value of query_key_params (tickers without their exchange suffix)."""
+    values = list()
+    for key, value in query_key_params.items():
+        if key == "relevance":
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            item = str(item)
+            values.append(item.rsplit(".", 1)[0] if key == "tickers" else item)
+    return _terms(" ".join(values))
+
+def budget_context(retrieved_content: str, query_key_params: Dict[str, Any],
+                   budget_tokens: int = RESPONSE_CONTEXT_TOKEN_BUDGET) -> BudgetedContext:
+    """
+    Fits the search content of a turn into `budget_tokens`: the content is split into chunks, near-duplicates are
+    dropped, the rest is ranked against query_key_params with BM25 and the best chunks are packed greedily up to the
+    budget. Packed chunks keep their original order so the context still reads as written.
+    """
+    tokens_before = estimate_tokens(retrieved_content) if retrieved_content else 0
+    chunks = split_chunks(retrieved_content or "")
+    kept = drop_near_duplicates(chunks)
+    scores = bm25_scores(query_terms(query_key_params), [_terms(chunks[i]) for i in kept])
+
+    packed, used = list(), 0
+    for score, index in sorted(zip(scores, kept), key=lambda pair: (-pair[0], pair[1])):
+        tokens = estimate_tokens(chunks[index])
+        if used + tokens <= budget_tokens:
+            packed.append(index)
+            used += tokens
+    text = "\n\n".join(chunks[index] for index in sorted(packed))
+    return BudgetedContext(
+        text=text,
+        tokens_before=tokens_before,
+        tokens_after=estimate_tokens(text) if text else 0,
+        chunks=len(chunks),
+        duplicates=len(chunks) - len(kept),
+        dropped=len(kept) - len(packed),
+    )
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return "n/a"
+    return f"{value:,.2f}".rstrip("0").rstrip(".") if isinstance(value, float) else str(value)
+
+def summarize_chart(chart_objects: Any) -> str:
+    """
+    Compact text of the chart shown to the user: title, unit, periods and the values of each series, in place of
+    the whole echarts option (styling, tooltip, legend, ...). Returns "" when there is no chart.
+    """
+    option = chart_objects
+    if isinstance(option, str):
+        option = option.strip().removeprefix("```json").removesuffix("```").strip()
+        try:
+            option = json.loads(option) if option else {}
+        except ValueError:
+            return ""
+    if not isinstance(option, dict) or not option.get("series"):
+        return ""
+
+    x_axis, y_axis = option.get("xAxis") or {}, option.get("yAxis") or {}
+    category_axis, value_axis = (y_axis, x_axis) if y_axis.get("type") == "category" else (x_axis, y_axis)
+    title = (option.get("title") or {}).get("text", "")
+    lines = [f"Chart: {title}" + (f" (values in {value_axis['name']})" if value_axis.get("name") else "")]
+    periods = category_axis.get("data") or []
+    if len(periods) > CHART_SUMMARY_MAX_VALUES:
+        lines.append(f"Periods: {periods[0]} to {periods[-1]} ({len(periods)} points)")
+    elif periods:
+        lines.append(f"Periods: {', '.join(str(period) for period in periods)}")
+    for series in option["series"]:
+        values = series.get("data") or []
+        numbers = [v for v in values if isinstance(v, (int, float))]
+        if len(values) > CHART_SUMMARY_MAX_VALUES and numbers:
+            line = (f"- {series.get('name', '')} ({series.get('type', '')}): first {_format_value(numbers[0])}, "
+                    f"low {_format_value(min(numbers))}, high {_format_value(max(numbers))}, last {_format_value(numbers[-1])}")
+        else:
+            line = f"- {series.get('name', '')} ({series.get('type', '')}): {', '.join(_format_value(v) for v in values)}"
+        if len(numbers) > 1 and numbers[0]:
+            line += f" (change {(numbers[-1] - numbers[0]) / abs(numbers[0]):+.1%})"
+        lines.append(line)
+    return "\n".join(lines)
@@ -1,91 +1,332 @@
-from google.adk.sessions import InMemorySessionService
+from google.adk.events import Event, EventActions
+from google.adk.sessions import BaseSessionService, Session
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai import types
 import streamlit as st
-import streamlit_echarts
 import uuid
 import asyncio
+import contextlib
+import queue
+import threading
+import time
+from typing import Any, AsyncGenerator, Coroutine, Iterator, NamedTuple, Optional
 from master_agent import root_agent
-from config.settings import APP_NAME_FOR_ADK, USER_ID, INITIAL_STATE, ADK_SESSION_KEY
+from master_agent.sub_agents.query_response_agent.agent import IRRELEVANT_QUERY_RESPONSE
+from config.settings import (
+    APP_NAME_FOR_ADK, INITIAL_STATE, ADK_SESSION_KEY, ADK_USER_KEY, ADK_TURN_TIMEOUT_SECONDS, ANSWER_CACHE_ENABLED,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS, TRACING_ENABLED
+)
+from services.admission import AdmissionRejected, get_admission_controller
+from services.answer_cache import CachedAnswer, get_answer_cache
+from services.prefetch import start_prefetcher
+from services.resilience import set_deadline
+from services.session_store import SqliteSessionService
+from services.tracing import TracingPlugin, get_tracer, start_metrics_server
 
-async def create_adk_session(session_service: InMemorySessionService, session_id: str):
+# Stage shown in the UI while each agent runs, in pipeline order.
+PIPELINE_STAGES = {
+    "query_input_agent": "Classifying the question",
+    "content_retriever_agent": "Searching the web",
+    "data_chart_agent": "Fetching financial data",
+    "query_response_agent": "Writing the answer",
+}
+DEFAULT_ERROR_RESPONSE = "[Agent encountered an issue]"
+TIMEOUT_RESPONSE = "[The assistant took too long to answer, please try again]"
+BUSY_RESPONSE = "[The assistant is busy with other questions right now, please try again in a minute]"
+
+class TurnUpdate(NamedTuple):
+    """
+    One update of a streamed turn: ("queued", position in the waiting line), ("stage", label), ("text", answer so far),
+    ("chart", chart option JSON) or ("done", (answer, chart option JSON)).
+    """
+    kind: str
+    value: Any
+
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the process wide event loop every ADK coroutine runs on, started on a dedicated daemon thread on first use.
+    Keeping a single loop alive lets the Gemini client and the tools reuse their HTTP/gRPC connections across
+    turns and sessions, which a fresh `asyncio.run` loop per call would close.
+    """
+    global _event_loop
+    if _event_loop is None:
+        with _event_loop_lock:
+            if _event_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="adk_event_loop", daemon=True).start()
+                _event_loop = loop
+    return _event_loop
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = ADK_TURN_TIMEOUT_SECONDS):
+    """
+    Runs a coroutine on the background event loop and waits for its result.
+
+    Raises:
+        concurrent.futures.TimeoutError: The coroutine did not finish within `timeout` seconds; it is cancelled.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout=timeout)
+    finally:
+        future.cancel() # No-op once finished; otherwise (timeout, interrupted caller) the coroutine is cancelled on the loop.
+
+async def create_adk_session(session_service: BaseSessionService, user_id: str, session_id: str):
     await session_service.create_session(
         app_name=APP_NAME_FOR_ADK,
-        user_id=USER_ID,
+        user_id=user_id,
         session_id=session_id,
         state=INITIAL_STATE
     )
 
 @st.cache_resource
-def initialize_adk():
+def get_runner() -> Runner:
     """
-    Initializes the Google ADK Runner and manages the ADK session.
-    Uses Streamlit's cache_resource decorator to ensure this runs only once per app load.
+    Creates the Google ADK Runner shared by every browser session, traced by the TracingPlugin, and starts the
+    metrics endpoint and the watchlist prefetcher. Uses Streamlit's cache_resource decorator to ensure this runs
+    only once per app load.
     """
-    session_service = InMemorySessionService()
-    runner = Runner(
+    session_service = SqliteSessionService() # Durable and bounded: sessions survive restarts, idle ones leave memory.
+    start_metrics_server()
+    start_prefetcher() # Warms the caches of the watchlist tickers in the background, yielding to interactive turns.
+    return Runner(
         app_name=APP_NAME_FOR_ADK,
         agent=root_agent,
-        session_service=session_service
+        session_service=session_service,
+        plugins=[TracingPlugin()] if TRACING_ENABLED else []
     )
 
+def initialize_adk():
+    """
+    Returns the shared ADK Runner and the ADK user and session IDs of the current browser session.
+    Each browser session gets its own user ID and ADK session, kept in Streamlit's session state across reruns.
+    """
+    runner = get_runner()
+    if ADK_USER_KEY not in st.session_state:
+        st.session_state[ADK_USER_KEY] = f"streamlit_user_{uuid.uuid4()}"
+    user_id = st.session_state[ADK_USER_KEY]
+
     # Check if an ADK session ID already exists in Streamlit's session state.
     if ADK_SESSION_KEY not in st.session_state:
         # If not, create a new unique session ID and store it.
         session_id = f"streamlit_adk_session_{uuid.uuid4()}"
         st.session_state[ADK_SESSION_KEY] = session_id
         # Create a new session in ADK's session service.
-        asyncio.run(create_adk_session(session_service=session_service, session_id=session_id))
+        run_coroutine(create_adk_session(session_service=runner.session_service, user_id=user_id, session_id=session_id))
+        print(f"Info: created ADK session {session_id} for {user_id}")
     else:
         # If an ADK session ID already exists (e.g., on a Streamlit rerun), retrieve it.
         session_id = st.session_state[ADK_SESSION_KEY]
-        # Verify if the session still exists in the ADK session service.
-        # This handles cases where the service might reset (less common with cache_resource, but good practice).
-        if not session_service.get_session(app_name=APP_NAME_FOR_ADK, user_id=USER_ID, session_id=session_id):
-            # If the session was lost (e.g., full app restart without clearing cache), recreate it.
-            asyncio.run(create_adk_session(session_service=session_service, session_id=session_id))
+        # Verify if the session still exists in the ADK session service (it may have expired).
+        if not run_coroutine(runner.session_service.get_session(app_name=APP_NAME_FOR_ADK, user_id=user_id, session_id=session_id)):
+            # If the session was lost, recreate it.
+            run_coroutine(create_adk_session(session_service=runner.session_service, user_id=user_id, session_id=session_id))
+    return runner, user_id, session_id
 
-    print(f"session_id returned from initialize_adk(): {session_id}")
-    return runner, session_id
+def _current_stage(finished: set) -> str:
+    if "query_input_agent" not in finished:
+        return PIPELINE_STAGES["query_input_agent"]
+    research = [PIPELINE_STAGES[name] for name in ("content_retriever_agent", "data_chart_agent") if name not in finished]
+    return " · ".join(research) if research else PIPELINE_STAGES["query_response_agent"]
 
-async def run_adk_async(runner: Runner, session_id: str, user_message_text: str):
+async def _record_cached_turn(runner: Runner, session: Session, content: types.Content, cached: CachedAnswer) -> None:
     """
-    Asynchronously runs a single turn of the ADK agent conversation.
+    Appends a turn answered from the answer cache to the session, as the pipeline would have: the user's message and the
+    answer of query_response_agent, so that the follow-up questions of this session see it.
+    """
+    invocation_id = f"e-{uuid.uuid4()}"
+    await runner.session_service.append_event(session, Event(invocation_id=invocation_id, author="user", content=content))
+    await runner.session_service.append_event(session, Event(
+        invocation_id=invocation_id,
+        author="query_response_agent",
+        content=types.Content(role="model", parts=[types.Part(text=cached.response)]),
+        actions=EventActions(state_delta={"query_response": cached.response, "chart_objects": cached.chart_objects or ""}),
+    ))
+
+async def stream_adk_async(runner: Runner, user_id: str, session_id: str, user_message_text: str,
+                           timeout: float = ADK_TURN_TIMEOUT_SECONDS) -> AsyncGenerator[TurnUpdate, None]:
+    """
+    Asynchronously runs a single turn of the ADK agent conversation, yielding TurnUpdates as soon as they are known:
+    the running stage, the chart once data_chart_agent has built it and the partial text of query_response_agent.
+    The last update is always ("done", (final_response_text, chart_objects)). `timeout` is the time left to the
+    turn, its outbound calls give up rather than outlive it.
     """
-    session = await runner.session_service.get_session(app_name=APP_NAME_FOR_ADK,user_id=USER_ID,session_id=session_id)
+    session = await runner.session_service.get_session(app_name=APP_NAME_FOR_ADK,user_id=user_id,session_id=session_id)
     if not session:
-        return "Error: ADK session not found."
+        yield TurnUpdate("done", ("Error: ADK session not found.", None))
+        return
+    started = time.perf_counter()
+    # Retries and rate limit waits of the outbound calls of this turn give up rather than outlive it.
+    set_deadline(timeout)
     # Prepare the user's message in the format expected by ADK/Gemini.
     content = types.Content(role='user', parts=[types.Part(text=user_message_text)])
-    final_response_text = "[Agent encountered an issue]" # Default error message
+    # Repeated and near-duplicate questions are answered from the cache without running the pipeline.
+    answer_cache = get_answer_cache()
+    if ANSWER_CACHE_ENABLED:
+        cached = answer_cache.lookup(user_message_text)
+        if cached:
+            print(f"Info: answer cache {cached.match} hit, saved {cached.latency:.2f}s. Stats: {answer_cache.stats()}")
+            await _record_cached_turn(runner, session, content, cached)
+            get_tracer().observe("turn", "answer_cache_hit", time.perf_counter() - started, match=cached.match)
+            yield TurnUpdate("done", (cached.response, cached.chart_objects))
+            return
+    final_response_text = DEFAULT_ERROR_RESPONSE
     chart_objects = None
-    
-    # Iterate through the asynchronous events generated by the ADK runner.
-    # ADK can yield multiple events (e.g., tool calls, interim responses) before the final response.
-    async for event in runner.run_async(
-        user_id=USER_ID,
-        session_id=session_id,
-        new_message=content
-        ):
-        
-        if hasattr(event,"author") and event.author == "data_chart_agent":
-            if event.is_final_response():
-                if event.content and event.content.parts and hasattr(event.content.parts[0], 'text'):
-                    chart_objects = event.content.parts[0].text
-                    if chart_objects == "```json {}```":
-                        chart_objects = None
-
-        if hasattr(event,"author") and event.author == "query_response_agent":
-            if event.is_final_response(): # Check for the final response from the agent.
-                if event.content and event.content.parts and hasattr(event.content.parts[0], 'text'):
-                    final_response_text = event.content.parts[0].text
-                print(f"capturing final response from {event.author}")
-                break # Exit the loop once the final response is received.
-    return final_response_text, chart_objects
-
-def run_adk_sync(runner: Runner, session_id: str, user_message_text: str) -> str:
+    partial_text = ""
+    first_output_at = None
+    finished = set() # Agents whose final response has been seen.
+    stage = _current_stage(finished)
+    yield TurnUpdate("stage", stage)
+
+    # Iterate through the asynchronous events generated by the ADK runner. With SSE streaming, model output
+    # arrives as partial events followed by one non-partial event holding the whole text.
+    invocation_id = None
+    try:
+        # The event stream is closed on every exit (final answer, cancellation): the runner's cleanup and context
+        # detaching then run in this task, instead of whenever the abandoned generator is garbage collected.
+        async with contextlib.aclosing(runner.run_async(
+            user_id=user_id,
+            session_id=session_id,
+            new_message=content,
+            run_config=RunConfig(streaming_mode=StreamingMode.SSE)
+        )) as events:
+            async for event in events:
+                invocation_id = event.invocation_id
+
+                if event.author == "data_chart_agent":
+                    # The chart option is written to state by the `build_chart` tool (or reset by the skip callback).
+                    if event.actions and event.actions.state_delta and "chart_objects" in event.actions.state_delta:
+                        chart_objects = event.actions.state_delta["chart_objects"] or None
+                        if chart_objects == "```json {}```":
+                            chart_objects = None
+                        if chart_objects:
+                            first_output_at = first_output_at or time.perf_counter()
+                            yield TurnUpdate("chart", chart_objects)
+
+                if event.author == "query_response_agent":
+                    if event.partial:
+                        if event.content and event.content.parts:
+                            partial_text += "".join(part.text or "" for part in event.content.parts if not part.thought)
+                            first_output_at = first_output_at or time.perf_counter()
+                            yield TurnUpdate("text", partial_text)
+                        continue
+                    # The state-only event of the budgeting callback looks final too, the answer is the one with content.
+                    if event.is_final_response() and event.content: # Check for the final response from the agent.
+                        if event.content and event.content.parts and hasattr(event.content.parts[0], 'text'):
+                            final_response_text = event.content.parts[0].text
+                        print(f"capturing final response from {event.author}")
+                        break # Exit the loop once the final response is received.
+
+                # Callbacks that only write state also yield final-looking events, without content: they do not end a stage.
+                if event.author in PIPELINE_STAGES and event.is_final_response() and event.content:
+                    finished.add(event.author)
+                    if _current_stage(finished) != stage:
+                        stage = _current_stage(finished)
+                        yield TurnUpdate("stage", stage)
+    finally:
+        # Leaving the event stream early (final answer, cancellation) skips the runner's after_run_callback.
+        tracing_plugin = runner.plugin_manager.get_plugin("tracing")
+        if tracing_plugin and invocation_id:
+            tracing_plugin.finish_trace(invocation_id)
+
+    if first_output_at:
+        print(f"Info: first visible output after {first_output_at - started:.2f}s, turn took {time.perf_counter() - started:.2f}s")
+        get_tracer().observe("turn", "first_visible_output", first_output_at - started, trace_id=invocation_id)
+    # Only real answers are cached: declines are already cheap and failures must be retried.
+    if ANSWER_CACHE_ENABLED and final_response_text not in (DEFAULT_ERROR_RESPONSE, IRRELEVANT_QUERY_RESPONSE):
+        answer_cache.store(user_message_text, final_response_text, chart_objects, time.perf_counter() - started)
+    yield TurnUpdate("done", (final_response_text, chart_objects))
+
+async def run_adk_async(runner: Runner, user_id: str, session_id: str, user_message_text: str):
+    """
+    Asynchronously runs a single turn of the ADK agent conversation.
+    Returns the final response text and the chart option JSON (None when there is no chart).
+    """
+    async for update in stream_adk_async(runner, user_id, session_id, user_message_text):
+        if update.kind == "done":
+            return update.value
+    return DEFAULT_ERROR_RESPONSE, None
+
+def run_adk_sync(runner: Runner, user_id: str, session_id: str, user_message_text: str) -> str:
     """
     Synchronous wrapper for running ADK, as Streamlit does not directly support async calls in the main thread.
+    The turn waits for an admission slot, runs on the background event loop and is cancelled after
+    ADK_TURN_TIMEOUT_SECONDS.
     """
-    # Runs the asynchronous function in a new event loop.
-    return asyncio.run(run_adk_async(runner, session_id, user_message_text))    
\ No newline at end of file
+    for update in stream_adk_sync(runner, user_id, session_id, user_message_text):
+        if update.kind == "done":
+            return update.value
+    return DEFAULT_ERROR_RESPONSE, None
+
+async def _forward_updates(updates: AsyncGenerator[TurnUpdate, None], sink: queue.Queue):
+    try:
+        async for update in updates:
+            sink.put(update)
+    finally:
+        sink.put(None) # End of the turn, also when it fails or is cancelled.
+
+def stream_adk_sync(runner: Runner, user_id: str, session_id: str, user_message_text: str,
+                    timeout: float = ADK_TURN_TIMEOUT_SECONDS) -> Iterator[TurnUpdate]:
+    """
+    Synchronous counterpart of `stream_adk_async` for Streamlit, yielding each TurnUpdate as soon as it is produced.
+
+    The turn first waits for a slot of the admission controller, reporting its position in the line with
+    ("queued", position) updates, so that concurrent users share a bounded number of pipeline runs and a session
+    never runs two turns at once. It then runs on the background event loop; a turn still running `timeout` seconds
+    after it was submitted (time spent in the queue included), or whose caller stops reading (e.g. a Streamlit
+    rerun), is cancelled.
+    """
+    submitted_at = time.monotonic()
+    deadline = submitted_at + timeout
+    try:
+        ticket = get_admission_controller().enqueue(f"{user_id}/{session_id}")
+    except AdmissionRejected as e:
+        print(f"Error: turn rejected by admission control: {e}")
+        yield TurnUpdate("done", (BUSY_RESPONSE, None))
+        return
+    try:
+        position = 0
+        queue_timeout = min(ADMISSION_QUEUE_TIMEOUT_SECONDS, timeout)
+        while not ticket.wait(timeout=0.5):
+            if time.monotonic() > submitted_at + queue_timeout:
+                print(f"Error: turn gave up after waiting {queue_timeout}s for a slot.")
+                yield TurnUpdate("done", (BUSY_RESPONSE, None))
+                return
+            if ticket.position != position:
+                position = ticket.position
+                yield TurnUpdate("queued", position)
+        get_tracer().observe("queue", "admission", time.monotonic() - submitted_at)
+
+        sink = queue.Queue()
+        # The turn only has the part of its budget the queue left, not a fresh `timeout`.
+        future = asyncio.run_coroutine_threadsafe(
+            _forward_updates(stream_adk_async(runner, user_id, session_id, user_message_text,
+                                              timeout=max(0.0, deadline - time.monotonic())), sink),
+            get_event_loop(),
+        )
+        update = object()
+        try:
+            while update is not None:
+                try:
+                    update = sink.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    print(f"Error: turn cancelled after {timeout}s.")
+                    yield TurnUpdate("done", (TIMEOUT_RESPONSE, None))
+                    return
+                if update is not None:
+                    yield update
+            future.result() # Re-raises an error of the turn.
+        finally:
+            future.cancel()
+            # The slot is only freed once a cancelled turn has stopped writing to its session.
+            wait_until = time.monotonic() + 5
+            while update is not None and time.monotonic() < wait_until:
+                try:
+                    update = sink.get(timeout=max(0.0, wait_until - time.monotonic()))
+                except queue.Empty:
+                    break
+    finally:
+        ticket.release()
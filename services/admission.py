@@ -0,0 +1,128 @@
+from collections import Counter
+from typing import Dict, List, Optional
+import itertools
+import threading
+
+from config.settings import ADMISSION_MAX_CONCURRENT_TURNS, ADMISSION_MAX_QUEUE
+
+
+class AdmissionRejected(Exception):
+    """Raised when the waiting line is full and a turn cannot even be queued."""
+
+
+class Ticket:
+    """Place of one turn in the waiting line of an AdmissionController."""
+
+    def __init__(self, controller: "AdmissionController", key: str, number: int):
+        self.controller = controller
+        self.key = key
+        self.number = number
+        self.admitted = False
+        self.released = False
+
+    @property
+    def position(self) -> int:
+        """1-based position in the waiting line, 0 once admitted."""
+        return self.controller.position(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits up to `timeout` seconds to be admitted. Returns whether the ticket is admitted."""
+        return self.controller.wait(self, timeout)
+
+    def release(self) -> None:
+        """Frees the slot (or leaves the line when not admitted yet). Safe to call more than once."""
+        self.controller.release(self)
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a fair waiting line for pipeline runs.
+
+    At most `max_concurrent` turns run at once and at most `max_queue` wait. Waiting turns are admitted in arrival
+    order, except that a session never has two turns running at the same time: a second turn of a busy session
+    (e.g. sent again after a Streamlit rerun) waits for the first one to finish without holding back other sessions.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT_TURNS, max_queue: int = ADMISSION_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._waiting: List[Ticket] = list()
+        self._running: Counter = Counter() # Session key -> number of running turns (0 or 1).
+        self._numbers = itertools.count()
+        self._condition = threading.Condition()
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "abandoned": 0}
+
+    def enqueue(self, key: str) -> Ticket:
+        """
+        Puts a turn of the session `key` in the waiting line; it may be admitted right away.
+
+        Raises:
+            AdmissionRejected: The waiting line is full.
+        """
+        with self._condition:
+            if len(self._waiting) >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise AdmissionRejected(f"{len(self._waiting)} turns are already waiting.")
+            ticket = Ticket(self, key, next(self._numbers))
+            self._waiting.append(ticket)
+            self._dispatch()
+            if not ticket.admitted:
+                self.counters["queued"] += 1
+            return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        with self._condition:
+            if ticket.admitted or ticket.released:
+                return 0
+            return self._waiting.index(ticket) + 1
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: ticket.admitted, timeout)
+
+    def release(self, ticket: Ticket) -> None:
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self._running[ticket.key] -= 1
+                if self._running[ticket.key] <= 0:
+                    del self._running[ticket.key]
+            else:
+                self._waiting.remove(ticket)
+                self.counters["abandoned"] += 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters and the number of running and waiting turns."""
+        with self._condition:
+            return {**self.counters, "running": sum(self._running.values()), "waiting": len(self._waiting)}
+
+    def _dispatch(self) -> None:
+        # Must be called with the condition held. Admits waiting turns in order while slots are free.
+        running = sum(self._running.values())
+        for ticket in list(self._waiting):
+            if running >= self.max_concurrent:
+                break
+            if self._running[ticket.key]:
+                continue # The session already has a turn running.
+            self._waiting.remove(ticket)
+            self._running[ticket.key] += 1
+            ticket.admitted = True
+            running += 1
+            self.counters["admitted"] += 1
+        self._condition.notify_all()
+
+
+_admission_controller: Optional[AdmissionController] = None
+_admission_controller_lock = threading.Lock()
+
+def get_admission_controller() -> AdmissionController:
+    """Returns the process wide AdmissionController shared by every Streamlit session."""
+    global _admission_controller
+    if _admission_controller is None:
+        with _admission_controller_lock:
+            if _admission_controller is None:
+                _admission_controller = AdmissionController()
+    return _admission_controller
@@ -0,0 +1,198 @@
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+import random
+import re
+import threading
+import time
+import zlib
+
+from config.settings import ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MIN_SIMILARITY
+from services.symbol_index import SymbolIndex, get_symbol_index
+
+# Words that carry no meaning for telling two questions apart.
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "at", "to", "and", "or", "is", "are", "was", "were", "be", "what", "whats",
+    "how", "has", "have", "had", "did", "does", "do", "me", "show", "tell", "about", "please", "give", "its", "their",
+    "this", "that", "these", "those", "with", "by", "from", "as", "can", "you", "i", "my", "which", "compare", "vs",
+    "versus", "between", "company", "companies", "bank", "ltd", "limited", "inc", "current", "latest", "recent",
+}
+# Spellings of the same word. Distinct metrics (income, earnings, profit) and periods are never folded together.
+SYNONYMS = {
+    "quarterly": "quarter", "qtr": "quarter", "annually": "annual", "yearly": "annual",
+    "profits": "profit", "revenues": "revenue", "margins": "margin", "npas": "npa", "shares": "share",
+}
+# Words that refer back to an earlier turn ("what is its revenue growth?"): the answer depends on the conversation.
+# "it" is left out, it is also the IT sector.
+FOLLOW_UP_WORDS = {"its", "they", "them", "their", "theirs", "same", "above", "previous", "former", "latter"}
+# Period words (q4, h1, fy2024, fy24, 2023) are kept verbatim and must match exactly: a Q4 question never gets a Q1 answer.
+PERIOD_PATTERN = re.compile(r"(q[1-4]|h[12]|fy\d{2}|fy\d{4}|(19|20)\d{2})")
+NUM_PERMUTATIONS = 64 # MinHash signature length.
+BANDS = 16 # LSH bands of NUM_PERMUTATIONS // BANDS rows; near-duplicates share at least one band.
+_PRIME = (1 << 61) - 1
+
+
+class CachedAnswer(NamedTuple):
+    response: str
+    chart_objects: Optional[str]
+    latency: float # Seconds the pipeline took to produce the answer, i.e. the time saved by each hit.
+    match: str # "exact" or "similar".
+
+
+class _Entry:
+    __slots__ = ("key", "tickers", "signature", "bands", "response", "chart_objects", "latency", "stored_at")
+
+
+class AnswerCache:
+    """
+    Cache of final answers (`query_response` and `chart_objects`) keyed on the normalised query parameters.
+
+    Only questions that name their own companies are cached: a question that resolves no tickers or refers back to an
+    earlier turn ("what is its revenue growth?") is about whatever the conversation was about, and is never served
+    nor stored.
+    A question is normalised into the tickers of the companies it mentions, its periods (q4, fy2024, 2023, ...) and its
+    remaining terms (market, country, metric words, with stopwords removed and spellings folded). Exact keys are
+    served directly; otherwise a question about the same tickers and periods whose MinHash-estimated Jaccard
+    similarity reaches `min_similarity` is served.
+    Entries expire after `ttl_seconds` and the least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, index: SymbolIndex,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 min_similarity: float = ANSWER_CACHE_MIN_SIMILARITY):
+        self.index = index
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], set] = defaultdict(set)
+        self._lock = threading.Lock()
+        rng = random.Random(0)
+        self._permutations = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+        self.counters = {"lookups": 0, "exact_hits": 0, "similar_hits": 0, "misses": 0, "skipped": 0, "stores": 0, "evictions": 0}
+        self.saved_latency_seconds = 0.0
+
+    def normalise(self, user_query: str) -> Tuple[Tuple[str, ...], Tuple[str, ...], FrozenSet[str]]:
+        """Returns the (sorted tickers, sorted periods, terms) a question is keyed on."""
+        mentions = self.index.find_in_text(user_query)
+        company_words = {word for name, _ in mentions for word in name.split()}
+        # "FY 2024" is the same period as "FY2024".
+        text = re.sub(r"\bfy\s+(\d{2,4})\b", r"fy\1", user_query.lower().replace("'s", ""))
+        periods, terms = set(), set()
+        for word in re.findall(r"[a-z0-9/]+", text):
+            if PERIOD_PATTERN.fullmatch(word):
+                periods.add(word)
+                continue
+            word = SYNONYMS.get(word, word)
+            if word not in STOPWORDS and word not in company_words:
+                terms.add(word)
+        return tuple(sorted(symbol for _, symbol in mentions)), tuple(sorted(periods)), frozenset(terms)
+
+    @staticmethod
+    def _cacheable(user_query: str, tickers: Tuple[str, ...]) -> bool:
+        """Whether a question stands on its own: it names its companies and does not refer back to an earlier turn."""
+        return bool(tickers) and not FOLLOW_UP_WORDS.intersection(re.findall(r"[a-z]+", user_query.lower()))
+
+    @staticmethod
+    def _key(tickers: Tuple[str, ...], periods: Tuple[str, ...], terms: FrozenSet[str]) -> str:
+        return f"{'|'.join(tickers)}#{'|'.join(periods)}#{' '.join(sorted(terms))}"
+
+    def _signature(self, terms: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(term.encode("utf-8")) for term in terms] or [0]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._permutations)
+
+    def _bands(self, tickers: Tuple[str, ...], periods: Tuple[str, ...], signature: Tuple[int, ...]) -> List[Tuple]:
+        # Buckets are keyed on the tickers and periods too, so only questions about the same ones are compared.
+        rows = NUM_PERMUTATIONS // BANDS
+        return [(band, tickers, periods, signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def lookup(self, user_query: str) -> Optional[CachedAnswer]:
+        """Returns the cached answer of the same or a near-duplicate question, or None (always for follow-up questions)."""
+        tickers, periods, terms = self.normalise(user_query)
+        key = self._key(tickers, periods, terms)
+        now = time.time()
+        with self._lock:
+            self.counters["lookups"] += 1
+            if not self._cacheable(user_query, tickers):
+                self.counters["skipped"] += 1
+                return None
+            entry, match = self._entries.get(key), "exact"
+            if entry is not None and now - entry.stored_at > self.ttl_seconds:
+                self._remove(entry)
+                entry = None
+            if entry is None:
+                match = "similar"
+                signature = self._signature(terms)
+                candidates = set().union(*(self._buckets.get(band, set()) for band in self._bands(tickers, periods, signature)))
+                best = 0.0
+                for candidate_key in candidates:
+                    candidate = self._entries[candidate_key]
+                    if now - candidate.stored_at > self.ttl_seconds:
+                        continue
+                    similarity = sum(a == b for a, b in zip(signature, candidate.signature)) / NUM_PERMUTATIONS
+                    if similarity >= self.min_similarity and similarity > best:
+                        entry, best = candidate, similarity
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(entry.key)
+            self.counters[f"{match}_hits"] += 1
+            self.saved_latency_seconds += entry.latency
+            return CachedAnswer(entry.response, entry.chart_objects, entry.latency, match)
+
+    def store(self, user_query: str, response: str, chart_objects: Optional[str], latency: float) -> None:
+        """Caches the answer of a question along with the time the pipeline took to produce it, unless it is a follow-up."""
+        tickers, periods, terms = self.normalise(user_query)
+        if not self._cacheable(user_query, tickers):
+            return
+        entry = _Entry()
+        entry.key = self._key(tickers, periods, terms)
+        entry.tickers = tickers
+        entry.signature = self._signature(terms)
+        entry.bands = self._bands(tickers, periods, entry.signature)
+        entry.response, entry.chart_objects, entry.latency = response, chart_objects, latency
+        entry.stored_at = time.time()
+        with self._lock:
+            if entry.key in self._entries:
+                self._remove(self._entries[entry.key])
+            self._entries[entry.key] = entry
+            for band in entry.bands:
+                self._buckets[band].add(entry.key)
+            self.counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries.values())))
+                self.counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the counters, hit rate, total saved latency and number of cached answers."""
+        with self._lock:
+            hits = self.counters["exact_hits"] + self.counters["similar_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / self.counters["lookups"] if self.counters["lookups"] else 0.0,
+                "saved_latency_seconds": round(self.saved_latency_seconds, 3),
+                "entries": len(self._entries),
+            }
+
+    def _remove(self, entry: _Entry) -> None:
+        # Must be called with the lock held.
+        self._entries.pop(entry.key, None)
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry.key)
+                if not bucket:
+                    del self._buckets[band]
+
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    """Returns the process wide AnswerCache shared by every Streamlit session."""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache(get_symbol_index())
+    return _answer_cache
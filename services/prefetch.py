@@ -0,0 +1,240 @@
+from typing import Any, Callable, Dict, List, Optional
+import os
+import threading
+import time
+
+from google import genai
+from google.genai import types
+
+from config.settings import (
+    PREFETCH_ENABLED, PREFETCH_WATCHLIST_PATH, PREFETCH_INTERVAL_SECONDS, PREFETCH_REQUESTS_PER_MINUTE,
+    PREFETCH_MAX_RUNNING_TURNS, PREFETCH_SEARCH_ENABLED, PREFETCH_SEARCH_QUERY, PREFETCH_SEARCH_LOCALES, get_api_key
+)
+from master_agent.sub_agents.content_retriever_agent.agent import content_retriever_agent
+from master_agent.sub_agents.content_retriever_agent.search_cache import get_search_cache
+from master_agent.sub_agents.data_chart_agent.price_store import get_price_store
+from master_agent.sub_agents.data_chart_agent.statement_cache import get_statement_cache
+from master_agent.sub_agents.data_chart_agent.statements import QUARTERLY_STATEMENT_BLOCKS, STATEMENT_BLOCKS, load_block, make_ticker
+from services.admission import get_admission_controller
+from services.resilience import get_upstream
+from services.single_flight import single_flight_stats
+from services.tracing import get_tracer
+
+# Statement blocks warmed per ticker: the annual and quarterly tables of get_data_tables and get_financial_metrics.
+PREFETCH_BLOCKS = tuple(dict.fromkeys(STATEMENT_BLOCKS + QUARTERLY_STATEMENT_BLOCKS))
+IDLE_POLL_SECONDS = 1.0 # How often a paused warmer checks whether the interactive turns are done.
+
+
+def read_watchlist(path: str) -> List[str]:
+    """Tickers of a watchlist file, one per line (text after "#" is a comment), upper-cased and de-duplicated."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        tickers = [line.split("#", 1)[0].strip().upper() for line in f]
+    return list(dict.fromkeys(ticker for ticker in tickers if ticker))
+
+def search_locale(symbol: str) -> str:
+    """Country the warmed search of a ticker is cached under, from its exchange suffix."""
+    for suffix, locale in PREFETCH_SEARCH_LOCALES.items():
+        if symbol.endswith(suffix):
+            return locale
+    return "global"
+
+def gemini_search(query: str) -> str:
+    """Runs a search grounded Gemini call with the prompt of content_retriever_agent and returns its text."""
+    client = genai.Client(api_key=get_api_key())
+    response = get_upstream("google_search").call(
+        client.models.generate_content,
+        model=content_retriever_agent.model.model,
+        contents=query,
+        config=types.GenerateContentConfig(
+            system_instruction=content_retriever_agent.instruction,
+            tools=[types.Tool(google_search=types.GoogleSearch())],
+        ),
+    )
+    return response.text or ""
+
+
+class Prefetcher:
+    """
+    Background warmer of the statement, price and search caches for a watchlist of tickers.
+
+    A daemon thread makes a pass over the watchlist at start-up and then every `interval_seconds`. For each ticker it
+    loads the statement blocks into the StatementCache and refreshes the PriceStore, skipping whatever is still fresh
+    or was recently returned empty. Only interactive turns pay for a cold upstream then. The warmer's cache lookups
+    are counted apart (`warm_lookups`) so that the statement cache hit rate stays that of user turns.
+
+    Search warming is opt-in (`search_enabled`) as every search is a paid Gemini call and results only stay fresh
+    for a fraction of the interval. The first pass runs the watchlist search of every ticker into the SearchCache;
+    later passes only refresh the searches a user turn looked up since the previous pass started.
+
+    The warmer never competes with users: upstream requests are paced to `requests_per_minute`, and it waits while
+    more than `max_running_turns` turns are running or any turn is waiting for a slot. The warm-cache coverage (share
+    of the watchlist that is warm, per kind) is kept in `stats()` and served on /metrics as adk_prefetch_coverage_ratio.
+    """
+
+    def __init__(self, tickers: List[str],
+                 interval_seconds: float = PREFETCH_INTERVAL_SECONDS,
+                 requests_per_minute: float = PREFETCH_REQUESTS_PER_MINUTE,
+                 max_running_turns: int = PREFETCH_MAX_RUNNING_TURNS,
+                 search_query: str = PREFETCH_SEARCH_QUERY,
+                 search_enabled: bool = PREFETCH_SEARCH_ENABLED,
+                 search: Optional[Callable[[str], str]] = None):
+        self.tickers = list(tickers)
+        self.interval_seconds = interval_seconds
+        self.request_interval = 60.0 / requests_per_minute
+        self.max_running_turns = max_running_turns
+        self.search_query = search_query
+        # Search warming costs a Gemini call per ticker, it is also skipped without an API key.
+        self.search = (search or (gemini_search if get_api_key() else None)) if search_enabled and search_query else None
+        self.kinds = ("fundamentals", "prices", "search") if self.search else ("fundamentals", "prices")
+        self.counters = {"passes": 0, "requests": 0, "errors": 0, "paused_seconds": 0, "searches_skipped": 0}
+        self.last_pass_seconds: Optional[float] = None
+        self._pass_started: Optional[float] = None # Wall-clock start of the pass in progress.
+        self._previous_pass_started: Optional[float] = None # And of the one before, None during the first pass.
+        self._warm: Dict[str, set] = {kind: set() for kind in self.kinds}
+        self._next_request = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts the worker thread, once."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Asks the worker to stop after the request in progress."""
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the counters, the duration of the last pass and the warm-cache coverage of each kind (0 to 1)."""
+        with self._lock:
+            coverage = {kind: round(len(warm) / len(self.tickers), 4) if self.tickers else 0.0 for kind, warm in self._warm.items()}
+            return {**self.counters, "tickers": len(self.tickers), "last_pass_seconds": self.last_pass_seconds, "coverage": coverage}
+
+    def run_pass(self) -> None:
+        """Warms every ticker of the watchlist once, then logs the coverage reached."""
+        started = time.monotonic()
+        self._previous_pass_started, self._pass_started = self._pass_started, time.time()
+        for symbol in self.tickers:
+            if self._stop.is_set():
+                return
+            self.warm(symbol)
+        with self._lock:
+            self.counters["passes"] += 1
+            self.last_pass_seconds = round(time.monotonic() - started, 1)
+        # Loads of the warmer and of user turns coalesce, the single flight stats show how often they overlapped.
+        print(f"Info: prefetch pass over {len(self.tickers)} tickers done in {self.last_pass_seconds}s. Stats: {self.stats()}, "
+              f"single flight: {single_flight_stats()}")
+
+    def warm(self, symbol: str) -> None:
+        """Brings the caches of one ticker up to date and records which kinds are warm."""
+        ticker = make_ticker(symbol)
+        statement_cache = get_statement_cache()
+        # Blocks Yahoo recently returned empty (e.g. no quarterly cash flow for many Indian tickers) are skipped and
+        # count as warm: refetching them every pass would only cost requests.
+        def settled(block: str) -> bool:
+            return statement_cache.is_fresh(symbol, block) or statement_cache.is_known_empty(symbol, block)
+        with get_tracer().span("prefetch", "fundamentals", ticker=symbol):
+            for block in PREFETCH_BLOCKS:
+                if not settled(block):
+                    self._request(f"{symbol} {block}", load_block, ticker, block, False)
+        self._record("fundamentals", symbol, all(settled(block) for block in PREFETCH_BLOCKS))
+
+        price_store = get_price_store()
+        with get_tracer().span("prefetch", "prices", ticker=symbol):
+            if not price_store.is_fresh(symbol):
+                self._request(f"{symbol} prices", price_store.refresh, ticker)
+        self._record("prices", symbol, price_store.is_fresh(symbol))
+
+        if self.search:
+            search_cache = get_search_cache()
+            query = self.search_query.format(company=symbol.rsplit(".", 1)[0])
+            locale = search_locale(symbol)
+            with get_tracer().span("prefetch", "search", ticker=symbol):
+                if not search_cache.is_fresh(query, locale, [symbol]):
+                    if self._search_wanted(search_cache.looked_up_at(query, locale, [symbol])):
+                        text = self._request(f"{symbol} search", self.search, f"{query} {symbol}")
+                        if text:
+                            search_cache.store(query, text, locale, [symbol])
+                    else:
+                        with self._lock:
+                            self.counters["searches_skipped"] += 1
+            self._record("search", symbol, search_cache.is_fresh(query, locale, [symbol]))
+
+    def _search_wanted(self, looked_up_at: Optional[float]) -> bool:
+        # A warmed search is only worth its paid call again if a user turn asked for it since the previous pass.
+        if self._previous_pass_started is None:
+            return True
+        return looked_up_at is not None and looked_up_at >= self._previous_pass_started
+
+    def _request(self, label: str, function: Callable, *args) -> Any:
+        # Runs one upstream request once the pace and the interactive load allow it. Errors are logged, not raised.
+        self._wait_for_idle()
+        delay = self._next_request - time.monotonic()
+        if delay > 0 and self._stop.wait(delay):
+            return None
+        self._next_request = time.monotonic() + self.request_interval
+        with self._lock:
+            self.counters["requests"] += 1
+        try:
+            return function(*args)
+        except Exception as e:
+            with self._lock:
+                self.counters["errors"] += 1
+            print(f"Error in prefetch of {label}: {type(e).__name__}: {e}")
+            return None
+
+    def _wait_for_idle(self) -> None:
+        admission = get_admission_controller()
+        while not self._stop.is_set():
+            load = admission.stats()
+            if load["running"] <= self.max_running_turns and not load["waiting"]:
+                return
+            self._stop.wait(IDLE_POLL_SECONDS)
+            with self._lock:
+                self.counters["paused_seconds"] += IDLE_POLL_SECONDS
+
+    def _record(self, kind: str, symbol: str, warm: bool) -> None:
+        with self._lock:
+            if warm:
+                self._warm[kind].add(symbol)
+            else:
+                self._warm[kind].discard(symbol)
+            ratio = len(self._warm[kind]) / len(self.tickers)
+        get_tracer().set_gauge("adk_prefetch_coverage_ratio", round(ratio, 4), "Share of the prefetch watchlist whose cache is warm.", kind=kind)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_pass()
+            except Exception as e:
+                print(f"Error in prefetch pass: {type(e).__name__}: {e}")
+            self._stop.wait(max(0.0, self.interval_seconds - (time.monotonic() - started)))
+
+
+_prefetcher: Optional[Prefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+def start_prefetcher(path: str = PREFETCH_WATCHLIST_PATH) -> Optional[Prefetcher]:
+    """
+    Starts the process wide Prefetcher over the watchlist file, once per process.
+    Returns None when prefetching is disabled or the watchlist is empty.
+    """
+    global _prefetcher
+    if not PREFETCH_ENABLED:
+        return None
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            tickers = read_watchlist(path)
+            if not tickers:
+                print(f"Info: prefetch watchlist {path} is empty or missing, nothing is warmed.")
+                return None
+            _prefetcher = Prefetcher(tickers)
+            _prefetcher.start()
+            print(f"Info: warming the caches of {len(tickers)} watchlist tickers ({', '.join(_prefetcher.kinds)}) in the background")
+    return _prefetcher
@@ -0,0 +1,332 @@
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Callable, Dict, Optional
+import asyncio
+import random
+import threading
+import time
+
+from google.adk.models import Gemini, LlmRequest, LlmResponse
+
+from config.settings import (
+    UPSTREAM_LIMITS, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+from services.tracing import get_tracer
+
+# HTTP statuses worth retrying: the request timed out, was throttled or the upstream had a transient failure.
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+THROTTLED_STATUSES = {429}
+MIN_RATE_FRACTION = 0.1 # A throttled bucket never slows below this share of its configured rate.
+RATE_RECOVERY_FRACTION = 0.05 # Share of the configured rate a bucket regains after each success.
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call (or waiting for it) would not finish before the deadline of the turn."""
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+# Monotonic time by which the current turn must be done, set for the task running the turn (see set_deadline).
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+def set_deadline(seconds: Optional[float]) -> None:
+    """
+    Sets the deadline of the current context `seconds` from now (None removes it). Set at the start of a turn, it
+    is inherited by the tasks, threads (asyncio.to_thread, fetch_many) and upstream calls the turn starts.
+    """
+    _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the deadline of the current context, or `default` when there is none."""
+    deadline = _deadline.get()
+    return default if deadline is None else max(0.0, deadline - time.monotonic())
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an upstream error (google.genai APIError, HTTP responses), or None."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    code = getattr(getattr(error, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+def is_throttled(error: BaseException) -> bool:
+    return status_code(error) in THROTTLED_STATUSES or "RateLimit" in type(error).__name__
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is transient: throttling, a 5xx, a timeout or a dropped connection (not an open circuit)."""
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    if is_throttled(error) or status_code(error) in RETRYABLE_STATUSES:
+        return True
+    return isinstance(error, (TimeoutError, ConnectionError)) or any(
+        word in type(error).__name__ for word in ("Timeout", "Connection"))
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the request rate to an upstream, shared by threads and asyncio tasks.
+
+    A caller reserves a token and waits until it is available, so waits are served in order. The rate adapts: it is
+    halved each time the upstream throttles (down to MIN_RATE_FRACTION of `rate`) and grows back slowly on success.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how long to wait (seconds) before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self) -> None:
+        """Gives back a reserved token that will not be used (e.g. the wait would exceed the deadline)."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+
+    def recover(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY_FRACTION)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing: after `failure_threshold` consecutive transient failures the
+    circuit opens and calls fail fast (callers serve stale cache) for `reset_seconds`. Then one trial call is let
+    through (half-open): its success closes the circuit, its failure opens it again. A trial that ends without an
+    outcome (a non-transient error, a cancelled call) is released so that the next call becomes the trial.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go through now. In half-open state only one trial call is allowed at a time."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state, self.failures, self._trial_running = "closed", 0, False
+
+    def record_failure(self) -> bool:
+        """Counts a transient failure. Returns True when it opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state, self._opened_at = "open", time.monotonic()
+                return True
+            return False
+
+    def release(self) -> None:
+        """Ends a trial call that neither succeeded nor failed transiently (e.g. a 400), keeping the state."""
+        with self._lock:
+            self._trial_running = False
+
+
+class Upstream:
+    """
+    Resilience policy of one outbound dependency ("gemini", "google_search", "yfinance"): a TokenBucket, retries
+    with full-jitter exponential backoff on transient errors and a CircuitBreaker. Every wait is bounded by the
+    deadline of the turn, so a call gives up instead of outliving the turn it serves.
+    """
+
+    def __init__(self, name: str, rate_per_second: float, burst: int,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY_SECONDS,
+                 max_delay: float = RETRY_MAX_DELAY_SECONDS):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.breaker = CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "throttled": 0, "rejected": 0, "circuit_opened": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry `attempt` (0-based): uniform between 0 and the capped exponential delay ("full jitter")."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def admit(self) -> float:
+        """
+        Checks the circuit and reserves a token. Returns the wait (seconds) before the call may be made.
+
+        Raises:
+            CircuitOpenError: The circuit is open.
+            DeadlineExceeded: The wait would outlast the deadline of the turn.
+        """
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open), retrying in up to {self.breaker.reset_seconds}s.")
+        wait = self.bucket.reserve()
+        left = remaining()
+        if left is not None and wait >= left:
+            self.bucket.refund()
+            self.breaker.release()
+            raise DeadlineExceeded(f"{self.name} rate limit wait of {wait:.1f}s exceeds the {left:.1f}s left in the turn.")
+        self._count("calls")
+        return wait
+
+    def on_failure(self, error: BaseException, attempt: int, can_retry: bool = True) -> Optional[float]:
+        """Records failed attempt `attempt` (0-based). Returns the delay before the next one, or None to raise the error."""
+        if not is_retryable(error):
+            self.breaker.release()
+            return None
+        self._count("failures")
+        if is_throttled(error):
+            self._count("throttled")
+            self.bucket.throttle()
+        if self.breaker.record_failure():
+            self._count("circuit_opened")
+            print(f"Warning: circuit of {self.name} opened after {self.breaker.failures} failures: {type(error).__name__}: {error}")
+            get_tracer().set_gauge("adk_upstream_circuit_open", 1, "1 while the circuit breaker of an upstream is open.", upstream=self.name)
+            return None
+        delay = self.backoff(attempt)
+        left = remaining()
+        if not can_retry or attempt + 1 >= self.max_attempts or (left is not None and delay >= left):
+            return None
+        self._count("retries")
+        return delay
+
+    def on_success(self) -> None:
+        if self.breaker.state != "closed":
+            get_tracer().set_gauge("adk_upstream_circuit_open", 0, "1 while the circuit breaker of an upstream is open.", upstream=self.name)
+        self.breaker.record_success()
+        self.bucket.recover()
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        """Calls `function(*args, **kwargs)` under the policy, from a worker thread."""
+        attempt = 0
+        while True:
+            wait = self.admit()
+            try:
+                time.sleep(wait)
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self.on_failure(e, attempt)
+                if delay is None:
+                    raise
+                print(f"Info: retrying {self.name} in {delay:.2f}s after {type(e).__name__}: {e}")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release() # Interrupted: a half-open trial gives way to the next call.
+                raise
+            self.on_success()
+            return result
+
+    async def call_async(self, function: Callable, *args, **kwargs) -> Any:
+        """Same as `call` for a coroutine function, without blocking the event loop."""
+        attempt = 0
+        while True:
+            wait = self.admit()
+            try:
+                await asyncio.sleep(wait)
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                delay = self.on_failure(e, attempt)
+                if delay is None:
+                    raise
+                print(f"Info: retrying {self.name} in {delay:.2f}s after {type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release() # Cancelled, e.g. with its turn: a half-open trial gives way to the next call.
+                raise
+            self.on_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the counters, the current rate and the state of the circuit."""
+        with self._lock:
+            return {**self.counters, "rate_per_second": round(self.bucket.rate, 3), "circuit": self.breaker.state}
+
+
+_upstreams: Dict[str, Upstream] = dict()
+_upstreams_lock = threading.Lock()
+
+def get_upstream(name: str) -> Upstream:
+    """Returns the process wide Upstream policy `name`, configured from UPSTREAM_LIMITS."""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, **UPSTREAM_LIMITS[name])
+        return _upstreams[name]
+
+def upstream_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns the stats of every Upstream used so far."""
+    with _upstreams_lock:
+        upstreams = dict(_upstreams)
+    return {name: upstream.stats() for name, upstream in sorted(upstreams.items())}
+
+
+class ResilientGemini(Gemini):
+    """
+    Gemini model whose calls go through the Upstream policy `upstream`. A call is retried only until its first
+    response has been yielded: a stream that fails half way is not replayed to the agent.
+    """
+    upstream: str = "gemini"
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        policy = get_upstream(self.upstream)
+        attempt = 0
+        while True:
+            wait = policy.admit()
+            yielded = False
+            try:
+                await asyncio.sleep(wait)
+                async for llm_response in super().generate_content_async(llm_request, stream):
+                    yielded = True
+                    yield llm_response
+            except Exception as e:
+                delay = policy.on_failure(e, attempt, can_retry=not yielded)
+                if delay is None:
+                    raise
+                print(f"Info: retrying {self.upstream} ({self.model}) in {delay:.2f}s after {type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled, or closed by the agent (GeneratorExit). A model that already answered is up; otherwise a
+                # half-open trial gives way to the next call.
+                if yielded:
+                    policy.on_success()
+                else:
+                    policy.breaker.release()
+                raise
+            policy.on_success()
+            return
@@ -0,0 +1,412 @@
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import atexit
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.errors.session_not_found_error import SessionNotFoundError
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+
+from config.settings import (
+    SESSION_STORE_PATH, SESSION_CACHE_MAX_SESSIONS, SESSION_MAX_EVENTS_IN_MEMORY, SESSION_TTL_SECONDS,
+    SESSION_STORE_BATCH_SIZE, SESSION_STORE_FLUSH_INTERVAL_SECONDS
+)
+
+SessionKey = Tuple[str, str, str] # (app_name, user_id, session_id)
+
+
+def _split_state(state: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """Splits a state (delta) into its app, user and session scoped parts. Temporary keys are dropped."""
+    app, user, session = dict(), dict(), dict()
+    for key, value in state.items():
+        if key.startswith(State.APP_PREFIX):
+            app[key.removeprefix(State.APP_PREFIX)] = value
+        elif key.startswith(State.USER_PREFIX):
+            user[key.removeprefix(State.USER_PREFIX)] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session[key] = value
+    return app, user, session
+
+def _dumps(state: Dict[str, Any]) -> str:
+    return json.dumps(state, default=str)
+
+
+class SqliteSessionService(BaseSessionService):
+    """
+    ADK session service backed by an SQLite file in WAL mode, so sessions survive restarts and are shared by the
+    processes of the host.
+
+    Memory stays bounded as the number of users grows: only the `max_sessions` most recently used sessions are kept
+    in memory (the others are evicted and reloaded from disk on their next turn), and of each one only its last
+    `max_events` events. Writes are queued and flushed in batches, every `flush_interval` seconds or as soon as
+    `batch_size` writes are pending; a session written several times within a batch is only written once.
+    Sessions idle for more than `ttl_seconds` are expired. The app and user scoped states are only kept in memory
+    while one of their sessions is.
+
+    The async methods do their SQLite I/O (and wait for the lock a flush may hold) in a worker thread, so a slow disk
+    never stalls the event loop the turns of every user run on.
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH,
+                 max_sessions: int = SESSION_CACHE_MAX_SESSIONS,
+                 max_events: int = SESSION_MAX_EVENTS_IN_MEMORY,
+                 ttl_seconds: float = SESSION_TTL_SECONDS,
+                 batch_size: int = SESSION_STORE_BATCH_SIZE,
+                 flush_interval: float = SESSION_STORE_FLUSH_INTERVAL_SECONDS):
+        self.max_sessions = max_sessions
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self._hot: "OrderedDict[SessionKey, Session]" = OrderedDict()
+        self._app_state: Dict[str, Dict[str, Any]] = dict()
+        self._user_state: Dict[Tuple[str, str], Dict[str, Any]] = dict()
+        self._hot_per_user: Counter = Counter() # (app_name, user_id) -> hot sessions, to drop their state with the last one.
+        # Pending writes: new events in order, and the keys of sessions / app / user states whose row is outdated.
+        self._pending_events: List[Tuple[SessionKey, Event]] = list()
+        self._dirty_sessions: set = set()
+        self._dirty_app_states: set = set()
+        self._dirty_user_states: set = set()
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                app_name TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                last_update_time REAL NOT NULL,
+                PRIMARY KEY (app_name, user_id, session_id)
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_update ON sessions (last_update_time);
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                app_name TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_session ON events (app_name, user_id, session_id, seq);
+            CREATE TABLE IF NOT EXISTS app_states (app_name TEXT PRIMARY KEY, state TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS user_states (
+                app_name TEXT NOT NULL, user_id TEXT NOT NULL, state TEXT NOT NULL, PRIMARY KEY (app_name, user_id)
+            );
+            """
+        )
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                         name="session_store_flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    async def create_session(self, *, app_name: str, user_id: str,
+                             state: Optional[Dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        return await asyncio.to_thread(self._create_session, app_name, user_id, state, session_id)
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        return await asyncio.to_thread(self._get_session, app_name, user_id, session_id, config)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await asyncio.to_thread(self._list_sessions, app_name, user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await asyncio.to_thread(self._delete_session, (app_name, user_id, session_id.strip()))
+
+    async def get_user_state(self, *, app_name: str, user_id: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._get_user_state, app_name, user_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        key = (session.app_name, session.user_id, session.id)
+        if await asyncio.to_thread(self._is_appended, key, event):
+            return event # Re-delivery of an event that was already appended.
+        event = await super().append_event(session=session, event=event) # Updates the caller's copy of the session.
+        session.last_update_time = event.timestamp
+        await asyncio.to_thread(self._append_event, key, event)
+        return event
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self._flush_locked)
+
+    def _create_session(self, app_name: str, user_id: str, state: Optional[Dict[str, Any]], session_id: Optional[str]) -> Session:
+        session_id = session_id.strip() if session_id else str(uuid.uuid4())
+        app_delta, user_delta, session_state = _split_state(state or {})
+        key = (app_name, user_id, session_id)
+        with self._lock:
+            if self._load(key) is not None:
+                raise AlreadyExistsError(f"Session with id {session_id} already exists.")
+            self._update_scoped_state(app_name, user_id, app_delta, user_delta)
+            session = Session(app_name=app_name, user_id=user_id, id=session_id,
+                              state=copy.deepcopy(session_state), last_update_time=time.time())
+            self._remember(key, session)
+            self._dirty_sessions.add(key)
+            self._maybe_flush()
+            return self._copy_with_scoped_state(session)
+
+    def _get_session(self, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig]) -> Optional[Session]:
+        with self._lock:
+            session = self._load((app_name, user_id, session_id.strip()))
+            if session is None:
+                return None
+            events = session.events
+            if config and config.num_recent_events is not None:
+                events = events[-config.num_recent_events:] if config.num_recent_events else []
+            if config and config.after_timestamp is not None:
+                events = [event for event in events if event.timestamp >= config.after_timestamp]
+            copied = self._copy_with_scoped_state(session)
+            copied.events = list(events)
+            return copied
+
+    def _list_sessions(self, app_name: str, user_id: Optional[str]) -> ListSessionsResponse:
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute(
+                """SELECT user_id, session_id, state, last_update_time FROM sessions
+                   WHERE app_name = ? AND (? IS NULL OR user_id = ?) AND last_update_time >= ?
+                   ORDER BY last_update_time, user_id, session_id""",
+                (app_name, user_id, user_id, time.time() - self.ttl_seconds),
+            ).fetchall()
+            sessions = [
+                self._copy_with_scoped_state(Session(app_name=app_name, user_id=uid, id=sid,
+                                                     state=json.loads(state), last_update_time=updated))
+                for uid, sid, state, updated in rows
+            ]
+        return ListSessionsResponse(sessions=sessions)
+
+    def _delete_session(self, key: SessionKey) -> None:
+        with self._lock:
+            self._expire_one(key)
+
+    def _get_user_state(self, app_name: str, user_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return copy.deepcopy(self._scoped_state(app_name, user_id)[1])
+
+    def _is_appended(self, key: SessionKey, event: Event) -> bool:
+        with self._lock:
+            stored = self._load(key)
+            if stored is None:
+                raise SessionNotFoundError(f"Session {key[2]} not found.")
+            return any(e == event for e in stored.events if e.id == event.id)
+
+    def _append_event(self, key: SessionKey, event: Event) -> None:
+        with self._lock:
+            stored = self._load(key)
+            if stored is None:
+                raise SessionNotFoundError(f"Session {key[2]} not found.")
+            stored.events.append(event)
+            stored.last_update_time = event.timestamp
+            if len(stored.events) > self.max_events:
+                del stored.events[:len(stored.events) - self.max_events]
+            if event.actions and event.actions.state_delta:
+                app_delta, user_delta, session_delta = _split_state(event.actions.state_delta)
+                self._update_scoped_state(key[0], key[1], app_delta, user_delta)
+                stored.state.update(session_delta) # App and user scoped keys live in their own tables.
+
+            self._pending_events.append((key, event))
+            self._dirty_sessions.add(key)
+            self._maybe_flush()
+
+    def _flush_locked(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def expire(self) -> int:
+        """Deletes the sessions idle for longer than the TTL, from memory and disk. Returns how many were deleted."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._flush()
+            for key in [key for key, session in self._hot.items() if session.last_update_time < cutoff]:
+                self._forget(key)
+            keys = self._conn.execute(
+                "SELECT app_name, user_id, session_id FROM sessions WHERE last_update_time < ?", (cutoff,)
+            ).fetchall()
+            if keys:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._delete_rows(keys)
+                self._conn.execute("COMMIT")
+        if keys:
+            print(f"Info: session store expired {len(keys)} idle sessions.")
+        return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of sessions and user states in memory, of sessions on disk and of writes waiting to be flushed."""
+        with self._lock:
+            return {
+                "hot_sessions": len(self._hot),
+                "hot_user_states": len(self._user_state),
+                "stored_sessions": self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                "pending_writes": len(self._pending_events) + len(self._dirty_sessions),
+            }
+
+    def close(self) -> None:
+        """Stops the background flusher and writes everything still pending."""
+        self._stop.set()
+        with self._lock:
+            self._flush()
+
+    # Everything below must be called with the lock held.
+
+    def _load(self, key: SessionKey) -> Optional[Session]:
+        """Returns the stored copy of a live session from memory, or from disk (and makes it hot), or None."""
+        session = self._hot.get(key)
+        if session is not None and time.time() - session.last_update_time <= self.ttl_seconds:
+            self._hot.move_to_end(key)
+            return session
+        row = None if session is not None else self._conn.execute(
+            "SELECT state, last_update_time FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+        ).fetchone()
+        if session is not None or (row is not None and time.time() - row[1] > self.ttl_seconds):
+            self._expire_one(key) # Expired: a session created again under the same id starts empty.
+            return None
+        if row is None:
+            return None
+        payloads = self._conn.execute(
+            "SELECT payload FROM events WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq DESC LIMIT ?",
+            key + (self.max_events,),
+        ).fetchall()
+        session = Session(app_name=key[0], user_id=key[1], id=key[2], state=json.loads(row[0]),
+                          events=[Event.model_validate_json(payload) for payload, in reversed(payloads)],
+                          last_update_time=row[1])
+        self._remember(key, session)
+        return session
+
+    def _remember(self, key: SessionKey, session: Session) -> None:
+        if key not in self._hot:
+            self._hot_per_user[key[:2]] += 1
+        self._hot[key] = session
+        self._hot.move_to_end(key)
+        if len(self._hot) > self.max_sessions:
+            self._flush() # Evicted sessions must be on disk before they leave memory.
+            while len(self._hot) > self.max_sessions:
+                evicted, _ = self._hot.popitem(last=False)
+                self._left_memory(evicted)
+
+    def _forget(self, key: SessionKey) -> None:
+        if self._hot.pop(key, None) is not None:
+            self._left_memory(key)
+        self._dirty_sessions.discard(key)
+        self._pending_events = [(k, event) for k, event in self._pending_events if k != key]
+
+    def _left_memory(self, key: SessionKey) -> None:
+        self._hot_per_user[key[:2]] -= 1
+        if self._hot_per_user[key[:2]] <= 0:
+            del self._hot_per_user[key[:2]]
+
+    def _prune_scoped_state(self) -> None:
+        """Drops the written app and user states no hot session uses: they are reloaded with the next one."""
+        hot_apps = {app_name for app_name, _ in self._hot_per_user}
+        for key in [key for key in self._user_state if key not in self._hot_per_user and key not in self._dirty_user_states]:
+            del self._user_state[key]
+        for app_name in [app_name for app_name in self._app_state if app_name not in hot_apps and app_name not in self._dirty_app_states]:
+            del self._app_state[app_name]
+
+    def _expire_one(self, key: SessionKey) -> None:
+        self._forget(key)
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._delete_rows([key])
+        self._conn.execute("COMMIT")
+
+    def _delete_rows(self, keys: List[SessionKey]) -> None:
+        self._conn.executemany("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", keys)
+        self._conn.executemany("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", keys)
+
+    def _scoped_state(self, app_name: str, user_id: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if app_name not in self._app_state:
+            row = self._conn.execute("SELECT state FROM app_states WHERE app_name = ?", (app_name,)).fetchone()
+            self._app_state[app_name] = json.loads(row[0]) if row else dict()
+        if (app_name, user_id) not in self._user_state:
+            row = self._conn.execute(
+                "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?", (app_name, user_id)
+            ).fetchone()
+            self._user_state[(app_name, user_id)] = json.loads(row[0]) if row else dict()
+        return self._app_state[app_name], self._user_state[(app_name, user_id)]
+
+    def _update_scoped_state(self, app_name: str, user_id: str, app_delta: Dict[str, Any], user_delta: Dict[str, Any]) -> None:
+        app_state, user_state = self._scoped_state(app_name, user_id)
+        if app_delta:
+            app_state.update(app_delta)
+            self._dirty_app_states.add(app_name)
+        if user_delta:
+            user_state.update(user_delta)
+            self._dirty_user_states.add((app_name, user_id))
+
+    def _copy_with_scoped_state(self, session: Session) -> Session:
+        """Copy handed to callers: its own events list and state, with the app and user state merged in."""
+        copied = session.model_copy(deep=False)
+        copied.events = list(session.events)
+        copied.state = copy.deepcopy(session.state)
+        app_state, user_state = self._scoped_state(session.app_name, session.user_id)
+        copied.state.update({State.APP_PREFIX + k: copy.deepcopy(v) for k, v in app_state.items()})
+        copied.state.update({State.USER_PREFIX + k: copy.deepcopy(v) for k, v in user_state.items()})
+        return copied
+
+    def _maybe_flush(self) -> None:
+        if len(self._pending_events) + len(self._dirty_sessions) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending_events or self._dirty_sessions or self._dirty_app_states or self._dirty_user_states:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._pending_events.clear()
+            self._dirty_sessions.clear()
+            self._dirty_app_states.clear()
+            self._dirty_user_states.clear()
+        self._prune_scoped_state()
+
+    def _write_pending(self) -> None:
+        self._conn.executemany(
+            "INSERT INTO events (app_name, user_id, session_id, timestamp, payload) VALUES (?, ?, ?, ?, ?)",
+            [key + (event.timestamp, event.model_dump_json(exclude_none=True)) for key, event in self._pending_events],
+        )
+        self._conn.executemany(
+            """INSERT INTO sessions (app_name, user_id, session_id, state, last_update_time) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (app_name, user_id, session_id)
+               DO UPDATE SET state = excluded.state, last_update_time = excluded.last_update_time""",
+            [key + (_dumps(self._hot[key].state), self._hot[key].last_update_time)
+             for key in self._dirty_sessions if key in self._hot],
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO app_states (app_name, state) VALUES (?, ?)",
+            [(app_name, _dumps(self._app_state[app_name])) for app_name in self._dirty_app_states],
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO user_states (app_name, user_id, state) VALUES (?, ?, ?)",
+            [key + (_dumps(self._user_state[key]),) for key in self._dirty_user_states],
+        )
+
+    def _flush_periodically(self, interval: float) -> None:
+        sweep_every = max(1, int(60 / interval)) if interval > 0 else 60 # Expiry runs about once a minute.
+        ticks = 0
+        while not self._stop.wait(interval):
+            try:
+                with self._lock:
+                    self._flush()
+                ticks += 1
+                if ticks % sweep_every == 0:
+                    self.expire()
+            except Exception as e:
+                print(f"Error in session store flush: {e}")
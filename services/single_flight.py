@@ -0,0 +1,97 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import threading
+import time
+
+from services.tracing import get_tracer
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight, later callers with the same key wait
+    for its result (or exception) instead of making their own upstream request.
+
+    Calls are keyed on a hashable key and share a `concurrent.futures.Future`, so worker threads (`do`) and asyncio
+    tasks on any event loop (awaiting the wrapped future) coalesce with each other. Work that is started and finished
+    in different places, e.g. a model call between a before and an after callback, uses `claim` and `resolve`
+    instead; a claim that is never resolved is given up after `abandon_after` seconds.
+    Calls, executions and coalesced calls are counted, the latter also on /metrics as adk_single_flight_coalesced.
+    """
+
+    def __init__(self, name: str, abandon_after: Optional[float] = None):
+        self.name = name
+        self.abandon_after = abandon_after
+        self.counters = {"calls": 0, "executed": 0, "coalesced": 0}
+        self._calls: Dict[Hashable, Tuple[Future, float]] = dict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        Joins the call in flight for `key`, or starts one.
+
+        Returns:
+            A tuple (future, leader). The leader must make the call and `resolve` the future; the others wait on it.
+        """
+        with self._lock:
+            self.counters["calls"] += 1
+            entry = self._calls.get(key)
+            if entry is not None and not entry[0].done() and (
+                    self.abandon_after is None or time.monotonic() - entry[1] < self.abandon_after):
+                self.counters["coalesced"] += 1
+                coalesced = self.counters["coalesced"]
+                future, leader = entry[0], False
+            else:
+                future, leader = Future(), True
+                self._calls[key] = (future, time.monotonic())
+                self.counters["executed"] += 1
+        if not leader:
+            get_tracer().set_gauge("adk_single_flight_coalesced", coalesced,
+                                   "Calls served by an identical call already in flight.", flight=self.name)
+        return future, leader
+
+    def resolve(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """Completes the call of a leader with its result or exception and lets later calls for `key` start afresh."""
+        with self._lock:
+            if self._calls.get(key, (None,))[0] is future:
+                del self._calls[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, function: Callable, *args, **kwargs) -> Any:
+        """Calls `function(*args, **kwargs)`, or waits for the identical call in flight, and returns its result."""
+        future, leader = self.claim(key)
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+        self.resolve(key, future, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters and the number of calls in flight."""
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._calls)}
+
+
+_flights: Dict[str, SingleFlight] = dict()
+_flights_lock = threading.Lock()
+
+def get_single_flight(name: str, abandon_after: Optional[float] = None) -> SingleFlight:
+    """Returns the process wide SingleFlight group `name` (e.g. "statements"), created on first use."""
+    with _flights_lock:
+        if name not in _flights:
+            _flights[name] = SingleFlight(name, abandon_after)
+        return _flights[name]
+
+def single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """Returns the stats of every SingleFlight group."""
+    with _flights_lock:
+        flights = dict(_flights)
+    return {name: flight.stats() for name, flight in sorted(flights.items())}
@@ -0,0 +1,150 @@
+import bisect
+import csv
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config.settings import SYMBOL_LISTING_PATH, SYMBOL_MATCH_MIN_SCORE, SYMBOL_MATCH_MIN_CHARS
+
+# Words that do not help telling companies apart: "HDFC Bank Ltd." and "HDFC Bank Limited" are the same company.
+CORPORATE_SUFFIXES = {"ltd", "limited", "inc", "incorporated", "corp", "corporation", "plc", "co", "company", "the", "group", "holdings"}
+# Country and market words are not company names: "India" must not resolve to Indian Oil, nor "America" to American Express.
+NON_COMPANY_WORDS = {
+    "india", "indian", "us", "usa", "united states", "america", "american", "uk", "global", "world",
+    "nse", "bse", "nyse", "nasdaq", "nifty", "nifty 50", "sensex", "market", "stock market", "stock", "stocks", "shares",
+}
+
+
+def normalise_name(name: str) -> str:
+    """Lower-cases a company name, drops punctuation and corporate suffixes: "Larsen & Toubro Ltd." -> "larsen and toubro"."""
+    name = name.lower().replace("&", " and ").replace("'", "")
+    words = re.sub(r"[^a-z0-9]+", " ", name).split()
+    return " ".join(word for word in words if word not in CORPORATE_SUFFIXES)
+
+def name_variants(name: str) -> List[str]:
+    """
+    Splits a name with a parenthesised alias into all its variants:
+    "State Bank of India (SBI)" -> ["state bank of india sbi", "state bank of india", "sbi"].
+    """
+    variants = [name]
+    for alias in re.findall(r"\(([^)]*)\)", name):
+        variants.append(alias)
+    variants.append(re.sub(r"\([^)]*\)", " ", name))
+    return list(dict.fromkeys(v for v in map(normalise_name, variants) if v))
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymbolIndex:
+    """
+    In-memory index from company names, aliases and symbols to exchange tickers.
+
+    Lookups try, in order: an exact match of the normalised name, a unique match of its leading words (binary search
+    over the sorted keys) and a trigram similarity match through an inverted index. Names shorter than `min_chars`
+    only match exactly and country or market words (NON_COMPANY_WORDS) never match. All of them are in-process and
+    answer in well under a millisecond for listings of a few thousand companies.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, List[str]]], min_score: float = SYMBOL_MATCH_MIN_SCORE,
+                 min_chars: int = SYMBOL_MATCH_MIN_CHARS):
+        self.min_score = min_score
+        self.min_chars = min_chars
+        self.names: Dict[str, str] = dict() # symbol -> official name
+        self._exact: Dict[str, str] = dict() # normalised key -> symbol
+        for symbol, name, aliases in entries:
+            symbol = symbol.strip().upper()
+            self.names[symbol] = name
+            for key in [normalise_name(symbol), normalise_name(symbol.split(".")[0])] + name_variants(name) + [normalise_name(a) for a in aliases]:
+                if key:
+                    self._exact.setdefault(key, symbol) # The first listing claiming an alias keeps it.
+        self._keys = sorted(self._exact)
+        self._trigram_index: Dict[str, List[int]] = defaultdict(list)
+        self._key_trigrams = [_trigrams(key) for key in self._keys]
+        for position, grams in enumerate(self._key_trigrams):
+            for gram in grams:
+                self._trigram_index[gram].append(position)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "SymbolIndex":
+        """Loads a listing file with the columns symbol, name and aliases (separated by "|")."""
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        return cls((row["symbol"], row["name"], [a for a in (row.get("aliases") or "").split("|") if a.strip()]) for row in rows)
+
+    def lookup(self, query: str, limit: int = 3) -> List[Tuple[str, float]]:
+        """
+        Returns up to `limit` (symbol, score) candidates for a company name, best first. Exact and prefix
+        matches score 1.0, fuzzy matches score their trigram Jaccard similarity.
+        A prefix match is on whole words: "State Bank" matches "state bank of india", "Inf" does not match "infosys".
+        """
+        if normalise_name(query) in NON_COMPANY_WORDS:
+            return []
+        for variant in name_variants(query):
+            if variant in self._exact:
+                return [(self._exact[variant], 1.0)]
+
+        key = normalise_name(re.sub(r"\([^)]*\)", " ", query)) or normalise_name(query)
+        if len(key) < self.min_chars or key in NON_COMPANY_WORDS:
+            return []
+        start = bisect.bisect_left(self._keys, key)
+        prefixed = {self._exact[k] for k in self._keys[start:start + 16] if k.startswith(key + " ")}
+        if len(prefixed) == 1:
+            return [(prefixed.pop(), 1.0)]
+
+        grams = _trigrams(key)
+        common = defaultdict(int)
+        for gram in grams:
+            for position in self._trigram_index.get(gram, ()):
+                common[position] += 1
+        scores = dict()
+        for position, shared in common.items():
+            score = shared / (len(grams) + len(self._key_trigrams[position]) - shared)
+            symbol = self._exact[self._keys[position]]
+            if score >= self.min_score and score > scores.get(symbol, 0.0):
+                scores[symbol] = score
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def find_in_text(self, text: str, max_words: int = 5) -> List[Tuple[str, str]]:
+        """
+        Finds company names, aliases and symbols mentioned in free text by exact matching of its word n-grams,
+        longest first: "compare HDFC Bank and State Bank of India" -> [("hdfc bank", "HDFCBANK.NS"), ...].
+        Keys of less than 3 characters ("c", "ma", ...) are ignored because they collide with ordinary words.
+
+        Returns:
+            A list of (matched normalised name, symbol) in order of appearance, one entry per symbol.
+        """
+        words = normalise_name(text).split()
+        found, seen, i = list(), set(), 0
+        while i < len(words):
+            for n in range(min(max_words, len(words) - i), 0, -1):
+                key = " ".join(words[i:i + n])
+                if len(key) >= 3 and key in self._exact:
+                    if self._exact[key] not in seen:
+                        seen.add(self._exact[key])
+                        found.append((key, self._exact[key]))
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def resolve(self, query: str) -> Optional[str]:
+        """Returns the best ticker for a company name, or None when nothing matches well enough."""
+        candidates = self.lookup(query, limit=1)
+        return candidates[0][0] if candidates else None
+
+
+_symbol_index: Optional[SymbolIndex] = None
+_symbol_index_lock = threading.Lock()
+
+def get_symbol_index() -> SymbolIndex:
+    """Returns the process wide SymbolIndex built from SYMBOL_LISTING_PATH on first use."""
+    global _symbol_index
+    if _symbol_index is None:
+        with _symbol_index_lock:
+            if _symbol_index is None:
+                _symbol_index = SymbolIndex.from_csv(SYMBOL_LISTING_PATH)
+    return _symbol_index
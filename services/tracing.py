@@ -0,0 +1,466 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+
+from google.adk.plugins.base_plugin import BasePlugin
+
+from config.settings import (
+    TRACING_ENABLED, TRACE_JSONL_PATH, TRACE_JSONL_MAX_BYTES, TRACING_RESERVOIR_SIZE, TRACING_METRICS_PORT,
+    TRACING_METRICS_HOST, TRACE_EXPORT_FLUSH_INTERVAL_SECONDS, TRACE_EXPORT_MAX_PENDING
+)
+
+# Upper bounds (seconds) of the Prometheus histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Span:
+    """One timed step of a turn: the turn itself, an agent, an LLM call, a tool call, a callback or a fetch."""
+    __slots__ = ("trace_id", "span_id", "parent_id", "kind", "name", "start", "end", "attributes")
+
+    def __init__(self, kind: str, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "kind": self.kind,
+            "name": self.name, "start": self.start, "duration_s": round(self.duration, 6), "attributes": self.attributes,
+        }
+
+
+# Span the current task (or a thread started with a copy of its context) is working under.
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _LatencyStats:
+    __slots__ = ("count", "total", "buckets", "recent")
+
+    def __init__(self, reservoir_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.recent = deque(maxlen=reservoir_size) # Most recent durations, the percentiles are computed over them.
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class Tracer:
+    """
+    Records spans of the agent pipeline without any outside collector.
+
+    Finished spans are appended to a JSONL file (rotated once it exceeds `max_bytes`) and their durations are
+    aggregated per (kind, name) into a histogram and a reservoir of recent values, exposed as Prometheus text with
+    p50/p95/p99 per stage. LLM token counts are aggregated per model. A disabled tracer records nothing.
+
+    Spans mostly end on the event loop, so they are only queued there: a background thread writes them in batches
+    every `flush_interval` seconds. At most `max_pending` spans wait, later ones are dropped and counted.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = TRACE_JSONL_PATH,
+                 max_bytes: int = TRACE_JSONL_MAX_BYTES,
+                 reservoir_size: int = TRACING_RESERVOIR_SIZE,
+                 enabled: bool = TRACING_ENABLED,
+                 flush_interval: float = TRACE_EXPORT_FLUSH_INTERVAL_SECONDS,
+                 max_pending: int = TRACE_EXPORT_MAX_PENDING):
+        self.jsonl_path = jsonl_path
+        self.max_bytes = max_bytes
+        self.reservoir_size = reservoir_size
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped_spans = 0
+        self._pending: deque = deque() # Dicts of finished spans waiting to be written.
+        self._export_lock = threading.Lock() # Serialises writes to the JSONL file.
+        self._stop = threading.Event()
+        self._exporter: Optional[threading.Thread] = None
+        self._open: Dict[str, Span] = dict()
+        self._stats: Dict[Tuple[str, str], _LatencyStats] = dict()
+        self._tokens: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._gauges: Dict[str, Tuple[str, Dict[Tuple[Tuple[str, str], ...], float]]] = dict() # Name -> (help, labels -> value).
+        self._lock = threading.Lock()
+        if jsonl_path:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+
+    def start_span(self, kind: str, name: str, trace_id: Optional[str] = None, parent: Optional[Span] = None,
+                   **attributes) -> Optional[Span]:
+        """Starts a span, by default a child of the current span (and in its trace)."""
+        if not self.enabled:
+            return None
+        parent = parent or _current_span.get()
+        trace_id = trace_id or (parent.trace_id if parent else uuid.uuid4().hex)
+        span = Span(kind, name, trace_id, parent.span_id if parent and parent.trace_id == trace_id else None, attributes)
+        with self._lock:
+            self._open[span.span_id] = span
+        return span
+
+    def end_span(self, span: Optional[Span], **attributes) -> None:
+        """Ends a span, exports it and adds its duration to the stats of its stage. Ending it twice is a no-op."""
+        if span is None:
+            return
+        with self._lock:
+            if self._open.pop(span.span_id, None) is None:
+                return
+            span.end = time.time()
+            span.attributes.update(attributes)
+            key = (span.kind, span.name)
+            if key not in self._stats:
+                self._stats[key] = _LatencyStats(self.reservoir_size)
+            self._stats[key].add(span.duration)
+            self._export(span)
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Context manager timing a block as a child of the current span; exceptions are recorded on the span."""
+        span = self.start_span(kind, name, **attributes)
+        token = _current_span.set(span) if span else None
+        try:
+            yield span
+        except BaseException as e:
+            if span:
+                span.attributes["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if token:
+                _current_span.reset(token)
+            self.end_span(span)
+
+    def observe(self, kind: str, name: str, seconds: float, trace_id: Optional[str] = None, **attributes) -> None:
+        """Records a step measured elsewhere (e.g. time to first token) as a span that ends now."""
+        span = self.start_span(kind, name, trace_id=trace_id, **attributes)
+        if span:
+            span.start = time.time() - seconds
+            self.end_span(span)
+
+    def add_tokens(self, model: str, input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+        with self._lock:
+            self._tokens[(model, "input")] += input_tokens or 0
+            self._tokens[(model, "output")] += output_tokens or 0
+
+    def set_gauge(self, name: str, value: float, description: str = "", **labels) -> None:
+        """Sets a gauge served on /metrics next to the stage latencies, e.g. the warm-cache coverage of the prefetcher."""
+        with self._lock:
+            _, values = self._gauges.setdefault(name, (description, dict()))
+            values[tuple(sorted(labels.items()))] = value
+
+    def finish_trace(self, trace_id: str, keep: Optional[Span] = None) -> None:
+        """Ends every span of a trace still open (except `keep`), e.g. agents skipped by a callback or a turn left early."""
+        with self._lock:
+            spans = [span for span in self._open.values() if span.trace_id == trace_id and span is not keep]
+        for span in sorted(spans, key=lambda s: s.start, reverse=True): # Children before their parents.
+            self.end_span(span, closed_with_turn=True)
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """Returns count and p50/p95/p99 (seconds) of each "kind/name" stage."""
+        with self._lock:
+            return {
+                f"{kind}/{name}": {"count": stats.count, **{f"p{int(q * 100)}": round(stats.quantile(q), 4) for q in QUANTILES}}
+                for (kind, name), stats in sorted(self._stats.items())
+            }
+
+    def prometheus_text(self) -> str:
+        """Renders the stage latencies and token counts in the Prometheus text exposition format."""
+        lines = [
+            "# HELP adk_stage_duration_seconds Duration of the pipeline stages (turn, agent, llm, tool, callback, fetch).",
+            "# TYPE adk_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stats = sorted(self._stats.items())
+            tokens = sorted(self._tokens.items())
+            quantiles = {key: [(q, s.quantile(q)) for q in QUANTILES] for key, s in stats}
+            gauges = {name: (description, dict(values)) for name, (description, values) in sorted(self._gauges.items())}
+            dropped_spans = self.dropped_spans
+        for (kind, name), s in stats:
+            labels = f'kind="{_escape(kind)}",name="{_escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                cumulative += count
+                lines.append(f'adk_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'adk_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {s.count}')
+            lines.append(f"adk_stage_duration_seconds_sum{{{labels}}} {s.total:.6f}")
+            lines.append(f"adk_stage_duration_seconds_count{{{labels}}} {s.count}")
+        lines += [
+            "# HELP adk_stage_duration_quantile_seconds p50/p95/p99 of the most recent durations of each stage.",
+            "# TYPE adk_stage_duration_quantile_seconds gauge",
+        ]
+        for (kind, name), values in quantiles.items():
+            for q, value in values:
+                lines.append(f'adk_stage_duration_quantile_seconds{{kind="{_escape(kind)}",name="{_escape(name)}",quantile="{q}"}} {value:.6f}')
+        lines += ["# HELP adk_llm_tokens_total Tokens sent to and received from each model.", "# TYPE adk_llm_tokens_total counter"]
+        for (model, direction), count in tokens:
+            lines.append(f'adk_llm_tokens_total{{model="{_escape(model)}",direction="{direction}"}} {count}')
+        lines += [
+            "# HELP adk_trace_spans_dropped_total Finished spans not written to the JSONL file because the export queue was full.",
+            "# TYPE adk_trace_spans_dropped_total counter",
+            f"adk_trace_spans_dropped_total {dropped_spans}",
+        ]
+        for name, (description, values) in gauges.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            for labels, value in sorted(values.items()):
+                label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Writes the spans waiting to be exported to the JSONL file now."""
+        with self._export_lock:
+            with self._lock:
+                spans, self._pending = self._pending, deque()
+            if not spans:
+                return
+            try:
+                if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) > self.max_bytes:
+                    os.replace(self.jsonl_path, self.jsonl_path + ".1")
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(span, default=str) + "\n" for span in spans))
+            except OSError as e:
+                print(f"Error in trace export: {e}")
+
+    def close(self) -> None:
+        """Stops the background exporter and writes everything still pending."""
+        self._stop.set()
+        self.flush()
+
+    def _export(self, span: Span) -> None:
+        # Must be called with the lock held. Only queues the span, the exporter thread writes it.
+        if not self.jsonl_path:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped_spans += 1
+            return
+        self._pending.append({**span.to_dict(), "attributes": dict(span.attributes)}) # Attributes set later are not exported.
+        if self._exporter is None:
+            self._exporter = threading.Thread(target=self._export_periodically, name="trace_export", daemon=True)
+            self._exporter.start()
+            atexit.register(self.close)
+
+    def _export_periodically(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in trace export: {e}")
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+def get_tracer() -> Tracer:
+    """Returns the process wide Tracer."""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer()
+    return _tracer
+
+
+def traced_callback(callback):
+    """
+    Decorator timing an agent callback as a "callback" span of the agent it belongs to. Works for sync and async
+    callbacks and keeps their keyword-only interface.
+    """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        with get_tracer().span("callback", callback.__name__):
+            return callback(*args, **kwargs)
+
+    @functools.wraps(callback)
+    async def async_wrapper(*args, **kwargs):
+        with get_tracer().span("callback", callback.__name__):
+            return await callback(*args, **kwargs)
+
+    return async_wrapper if inspect.iscoroutinefunction(callback) else wrapper
+
+
+class TracingPlugin(BasePlugin):
+    """
+    ADK plugin opening a span for the turn, each agent, each LLM call and each tool call of a Runner.
+
+    LLM spans carry the model name, the input and output token counts and the time to first token (the first
+    partial response when streaming); a google_search grounded call also lists the search queries the model made,
+    since that built-in tool runs inside the model call. The span being worked under is kept in a context variable,
+    so callbacks and statement fetches started from a tool are nested under it.
+    """
+
+    def __init__(self, tracer: Optional[Tracer] = None):
+        super().__init__(name="tracing")
+        self.tracer = tracer or get_tracer()
+        self._spans: Dict[Tuple[str, ...], Span] = dict()
+
+    def _start(self, key: Tuple[str, ...], kind: str, name: str, trace_id: str, parent: Optional[Span], **attributes) -> None:
+        span = self.tracer.start_span(kind, name, trace_id=trace_id, parent=parent, **attributes)
+        if span:
+            self._spans[key] = span
+            _current_span.set(span)
+
+    def _end(self, key: Tuple[str, ...], **attributes) -> Optional[Span]:
+        span = self._spans.pop(key, None)
+        if span:
+            self.tracer.end_span(span, **attributes)
+            parent = next((s for s in self._spans.values() if s.span_id == span.parent_id), None)
+            _current_span.set(parent)
+        return span
+
+    async def before_run_callback(self, *, invocation_context):
+        self._start((invocation_context.invocation_id,), "turn", "turn", invocation_context.invocation_id, None,
+                    session_id=invocation_context.session.id)
+        return None
+
+    async def after_run_callback(self, *, invocation_context):
+        self.finish_trace(invocation_context.invocation_id)
+
+    async def before_agent_callback(self, *, agent, callback_context):
+        invocation_id = callback_context.invocation_id
+        parent_agent = getattr(agent, "parent_agent", None)
+        parent = self._spans.get((invocation_id, "agent", parent_agent.name)) if parent_agent else None
+        self._start((invocation_id, "agent", agent.name), "agent", agent.name, invocation_id,
+                    parent or self._spans.get((invocation_id,)))
+        return None
+
+    async def after_agent_callback(self, *, agent, callback_context):
+        # A model call answered by a before_model_callback (e.g. a cache) never reaches after_model_callback.
+        self._end((callback_context.invocation_id, "llm", agent.name), served_by="before_model_callback")
+        self._end((callback_context.invocation_id, "agent", agent.name))
+        return None
+
+    async def on_event_callback(self, *, invocation_context, event):
+        # An agent answered by its own before_agent_callback (e.g. the pre-filter) never reaches after_agent_callback.
+        if event.is_final_response() and event.content and not event.partial:
+            self._end((invocation_context.invocation_id, "llm", event.author), served_by="callback")
+            self._end((invocation_context.invocation_id, "agent", event.author))
+        return None
+
+    async def before_model_callback(self, *, callback_context, llm_request):
+        invocation_id, agent_name = callback_context.invocation_id, callback_context.agent_name
+        self._start((invocation_id, "llm", agent_name), "llm", llm_request.model or agent_name, invocation_id,
+                    self._spans.get((invocation_id, "agent", agent_name)), agent=agent_name)
+        return None
+
+    async def after_model_callback(self, *, callback_context, llm_response):
+        key = (callback_context.invocation_id, "llm", callback_context.agent_name)
+        span = self._spans.get(key)
+        if span is None:
+            return None
+        if "ttft_s" not in span.attributes:
+            span.attributes["ttft_s"] = round(span.duration, 4)
+            self.tracer.observe("ttft", span.name, span.duration, trace_id=span.trace_id, agent=callback_context.agent_name)
+        if llm_response.partial:
+            return None
+        attributes = dict()
+        usage = llm_response.usage_metadata
+        if usage:
+            attributes["input_tokens"] = usage.prompt_token_count
+            attributes["output_tokens"] = usage.candidates_token_count
+            self.tracer.add_tokens(span.name, usage.prompt_token_count, usage.candidates_token_count)
+        if llm_response.grounding_metadata and llm_response.grounding_metadata.web_search_queries:
+            attributes["google_search_queries"] = list(llm_response.grounding_metadata.web_search_queries)
+        if llm_response.error_code:
+            attributes["error"] = f"{llm_response.error_code}: {llm_response.error_message}"
+        self._end(key, **attributes)
+        return None
+
+    async def on_model_error_callback(self, *, callback_context, llm_request, error):
+        self._end((callback_context.invocation_id, "llm", callback_context.agent_name), error=f"{type(error).__name__}: {error}")
+        return None
+
+    async def before_tool_callback(self, *, tool, tool_args, tool_context):
+        invocation_id = tool_context.invocation_id
+        self._start((invocation_id, "tool", tool_context.function_call_id or tool.name), "tool", tool.name, invocation_id,
+                    self._spans.get((invocation_id, "agent", tool_context.agent_name)),
+                    args={k: v for k, v in tool_args.items() if k != "tool_context"})
+        return None
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context, result):
+        status = result.get("status") if isinstance(result, dict) else None
+        self._end((tool_context.invocation_id, "tool", tool_context.function_call_id or tool.name), status=status)
+        return None
+
+    async def on_tool_error_callback(self, *, tool, tool_args, tool_context, error):
+        self._end((tool_context.invocation_id, "tool", tool_context.function_call_id or tool.name),
+                  error=f"{type(error).__name__}: {error}")
+        return None
+
+    def finish_trace(self, invocation_id: str) -> None:
+        """Ends the turn span and those of its steps still open: agents skipped by a callback, or a turn left early."""
+        turn = self._spans.get((invocation_id,))
+        for key in [key for key in self._spans if key[0] == invocation_id and len(key) > 1]:
+            self._spans.pop(key, None)
+        self.tracer.finish_trace(invocation_id, keep=turn)
+        self._end((invocation_id,))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body, content_type = get_tracer().prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path.split("?")[0] == "/percentiles":
+            body, content_type = json.dumps(get_tracer().percentiles(), indent=2).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes are not worth a console line.
+
+_metrics_server: Optional[ThreadingHTTPServer] = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = TRACING_METRICS_PORT, host: str = TRACING_METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Serves /metrics (Prometheus text) and /percentiles (JSON) on a daemon thread, once per process, on `host`
+    (loopback only by default).
+    Returns None when disabled (port 0) or when the port is taken, e.g. by another app process.
+    """
+    global _metrics_server
+    if not port or not TRACING_ENABLED:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Error in start_metrics_server: {host}:{port} unavailable ({e}), metrics are not served.")
+                return None
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics_server", daemon=True).start()
+            print(f"Info: serving pipeline metrics on http://{host}:{port}/metrics")
+    return _metrics_server
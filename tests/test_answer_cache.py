@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+import asyncio
+
+from google.adk.sessions import InMemorySessionService
+
+from config.settings import APP_NAME_FOR_ADK
+from services import adk_service
+from services.answer_cache import AnswerCache
+from services.symbol_index import SymbolIndex
+
+
+def make_cache() -> AnswerCache:
+    index = SymbolIndex([
+        ("HDFCBANK.NS", "HDFC Bank Limited", ["HDFC"]),
+        ("ICICIBANK.NS", "ICICI Bank Limited", ["ICICI"]),
+    ])
+    return AnswerCache(index, ttl_seconds=60, max_entries=16, min_similarity=0.7)
+
+
+def test_different_quarter_is_not_an_exact_hit():
+    cache = make_cache()
+    cache.store("HDFC Bank Q1 results", "Q1 answer", None, 1.0)
+
+    assert cache.lookup("HDFC Bank Q4 results") is None
+    assert cache.lookup("What are HDFC Bank's Q1 results?").response == "Q1 answer"
+
+
+def test_different_fiscal_year_is_not_a_similar_hit():
+    cache = make_cache()
+    cache.store("HDFC Bank net profit, revenue, margin and deposit growth in FY2023", "FY2023 answer", None, 1.0)
+
+    assert cache.lookup("HDFC Bank net profit, revenue, margin and deposit growth in FY2024") is None
+    assert cache.lookup("HDFC Bank net profit, revenue, margin and deposit growth for FY 2024") is None
+    cached = cache.lookup("HDFC Bank net profit, revenue, margin, deposit growth FY2023")
+    assert cached is not None and cached.response == "FY2023 answer"
+
+
+def test_distinct_metrics_are_not_folded():
+    cache = make_cache()
+    tickers, periods, terms = cache.normalise("HDFC Bank operating income and earnings in FY 2024 Q3")
+
+    assert tickers == ("HDFCBANK.NS",)
+    assert periods == ("fy2024", "q3")
+    assert {"income", "earnings"} <= terms
+
+
+def test_follow_up_questions_are_neither_stored_nor_served():
+    cache = make_cache()
+    cache.store("What is its revenue growth?", "TCS revenue grew 5%", None, 1.0)
+    cache.store("HDFC Bank revenue growth", "HDFC Bank revenue grew 10%", None, 1.0)
+
+    assert cache.stats()["entries"] == 1
+    assert cache.lookup("What is its revenue growth?") is None
+    assert cache.lookup("What is their revenue growth compared to HDFC Bank?") is None
+    assert cache.lookup("HDFC Bank revenue growth").response == "HDFC Bank revenue grew 10%"
+
+
+def test_cached_answer_is_recorded_in_the_session(monkeypatch):
+    cache = make_cache()
+    cache.store("HDFC Bank revenue growth", "HDFC Bank revenue grew 10%", None, 1.0)
+    monkeypatch.setattr(adk_service, "get_answer_cache", lambda: cache)
+    runner = SimpleNamespace(session_service=InMemorySessionService())
+
+    async def ask():
+        await adk_service.create_adk_session(runner.session_service, "user", "session")
+        updates = [update async for update in adk_service.stream_adk_async(runner, "user", "session", "HDFC Bank revenue growth")]
+        session = await runner.session_service.get_session(app_name=APP_NAME_FOR_ADK, user_id="user", session_id="session")
+        return updates, session
+
+    updates, session = asyncio.run(ask())
+    assert updates == [adk_service.TurnUpdate("done", ("HDFC Bank revenue grew 10%", None))]
+    assert [(event.author, event.content.parts[0].text) for event in session.events] == [
+        ("user", "HDFC Bank revenue growth"), ("query_response_agent", "HDFC Bank revenue grew 10%"),
+    ]
+    assert session.state["query_response"] == "HDFC Bank revenue grew 10%"
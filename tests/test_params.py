@@ -0,0 +1,14 @@
+from master_agent.sub_agents.query_input_agent.params import parse_query_key_params, repair_json_object
+
+
+def test_value_cut_off_mid_string_is_dropped():
+    params, outcome = parse_query_key_params('```json {"user_query": "compare TCS and Infosys", "companies": ["TCS", "Inf')
+
+    assert outcome == "repaired"
+    assert params.companies == ["TCS"]
+
+
+def test_truncated_payload_keeps_only_complete_members():
+    assert repair_json_object('{"companies": ["TCS", "Infosys"], "year": 202') == {"companies": ["TCS", "Infosys"]}
+    assert repair_json_object('{"companies": ["TCS", "Infosys"') == {"companies": ["TCS", "Infosys"]}
+    assert repair_json_object('{"user_query": "what is the reven') == {}
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from master_agent.sub_agents.data_chart_agent.price_store import PriceStore, days_to_iso
+
+
+class FakeTicker:
+    ticker = "ABC.NS"
+
+    def __init__(self):
+        self.bars = {day: 90.0 + i for i, day in enumerate(pd.date_range("2026-10-05", periods=5, freq="B"))}
+
+    def history(self, start=None, period=None, interval="1d"):
+        days = sorted(day for day in self.bars if start is None or day >= pd.Timestamp(start))
+        closes = [self.bars[day] for day in days]
+        return pd.DataFrame({"Open": closes, "High": closes, "Low": closes, "Close": closes, "Volume": 1.0},
+                            index=pd.DatetimeIndex(days))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PriceStore(str(tmp_path), refresh_seconds=0)
+
+
+def test_live_bar_is_overwritten_and_new_days_appended(store):
+    ticker = FakeTicker()
+    ticker.bars[pd.Timestamp("2026-10-12")] = 100.0 # Live bar of a session still open.
+    store.refresh(ticker)
+    ticker.bars[pd.Timestamp("2026-10-12")] = 101.5
+    ticker.bars[pd.Timestamp("2026-10-13")] = 103.0
+    prices = store.refresh(ticker)
+
+    assert days_to_iso(prices["date"][-3:]) == ["2026-10-09", "2026-10-12", "2026-10-13"]
+    assert prices["close"][-2:].tolist() == [101.5, 103.0]
+    assert store.counters["full_downloads"] == 1 and store.counters["rows_appended"] == 1
+
+
+def test_stored_last_day_missing_upstream_is_kept(store):
+    ticker = FakeTicker()
+    store.refresh(ticker)
+    del ticker.bars[pd.Timestamp("2026-10-09")]
+    ticker.bars[pd.Timestamp("2026-10-12")] = 95.0
+    prices = store.refresh(ticker)
+
+    assert days_to_iso(prices["date"][-2:]) == ["2026-10-09", "2026-10-12"]
+    assert prices["close"][-2:].tolist() == [94.0, 95.0]
+    assert store.counters["rows_appended"] == 1
+
+
+def test_readjusted_history_is_downloaded_again(store):
+    ticker = FakeTicker()
+    store.refresh(ticker)
+    ticker.bars = {day: close * 0.98 for day, close in ticker.bars.items()} # Dividend adjustment of past closes.
+    prices = store.refresh(ticker)
+
+    assert store.counters["full_downloads"] == 2
+    assert prices["close"][0] == pytest.approx(90.0 * 0.98)
+    assert len(prices) == 5
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from google.adk.models import Gemini, LlmRequest, LlmResponse
+
+from services.resilience import ResilientGemini, Upstream, get_upstream
+
+
+def half_open(upstream):
+    upstream.breaker.state = "open"
+    upstream.breaker._opened_at = time.monotonic() - upstream.breaker.reset_seconds
+
+
+def test_cancelled_trial_does_not_keep_the_circuit_half_open():
+    upstream = Upstream("test", rate_per_second=100, burst=10)
+    half_open(upstream)
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(upstream.call_async(asyncio.sleep, 60))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel_trial())
+    assert upstream.breaker.allow()
+
+
+def test_model_trial_closed_or_cancelled_by_the_agent_releases_the_circuit(monkeypatch):
+    async def generate(self, llm_request, stream=False):
+        yield LlmResponse()
+        await asyncio.sleep(60)
+
+    async def never_answers(self, llm_request, stream=False):
+        await asyncio.sleep(60)
+        yield LlmResponse()
+
+    model = ResilientGemini(model="gemini-2.0-flash")
+    policy = get_upstream(model.upstream)
+
+    async def close_after_first_response():
+        responses = model.generate_content_async(LlmRequest())
+        await responses.__anext__()
+        await responses.aclose()
+
+    monkeypatch.setattr(Gemini, "generate_content_async", generate)
+    half_open(policy)
+    asyncio.run(close_after_first_response())
+    assert policy.breaker.state == "closed"
+
+    async def cancel_before_response():
+        task = asyncio.ensure_future(model.generate_content_async(LlmRequest()).__anext__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    monkeypatch.setattr(Gemini, "generate_content_async", never_answers)
+    half_open(policy)
+    asyncio.run(cancel_before_response())
+    assert policy.breaker.allow()
@@ -0,0 +1,56 @@
+import time
+
+from master_agent.sub_agents.content_retriever_agent import search_cache
+from master_agent.sub_agents.content_retriever_agent.search_cache import SearchCache
+from services.symbol_index import SymbolIndex
+
+
+def test_close_search_about_another_company_is_not_served(tmp_path):
+    cache = SearchCache(str(tmp_path / "search.sqlite3"))
+    cache.store("SBI latest news and quarterly results", "SBI news", "india", ["SBIN.NS"])
+
+    assert cache.lookup("ICICI Bank latest news and quarterly results", "india", tickers=["ICICIBANK.NS"]) is None
+    assert cache.lookup("SBI latest news and quarterly results", "india", tickers=["SBIN.NS", "ICICIBANK.NS"]) is None
+    cached = cache.lookup("SBI latest news and quarterly results today", "india", tickers=["SBIN.NS"])
+    assert cached is not None and cached.match == "fulltext" and cached.response == "SBI news"
+
+
+def test_lookups_are_recorded_even_when_the_result_is_too_old_to_serve(tmp_path, monkeypatch):
+    cache = SearchCache(str(tmp_path / "search.sqlite3"), ttl_seconds=60)
+    cache.store("SBI latest news and quarterly results", "SBI news", "india", ["SBIN.NS"])
+    assert cache.looked_up_at("SBI latest news and quarterly results", "india", ["SBIN.NS"]) == 0.0
+    assert cache.looked_up_at("ICICI latest news and quarterly results", "india", ["ICICIBANK.NS"]) is None
+
+    later = time.time() + 120
+    monkeypatch.setattr(search_cache.time, "time", lambda: later)
+    assert cache.lookup("SBI latest news and quarterly results today", "india", tickers=["SBIN.NS"]) is None
+    assert cache.looked_up_at("SBI latest news and quarterly results", "india", ["SBIN.NS"]) == later
+
+    cache.store("SBI latest news and quarterly results", "SBI news again", "india", ["SBIN.NS"])
+    assert cache.looked_up_at("SBI latest news and quarterly results", "india", ["SBIN.NS"]) == later
+
+
+def make_index() -> SymbolIndex:
+    return SymbolIndex([
+        ("HDFCBANK.NS", "HDFC Bank Limited", ["HDFC"]),
+        ("SBIN.NS", "State Bank of India", ["SBI"]),
+    ])
+
+
+def test_different_metric_or_period_is_not_a_fulltext_hit(tmp_path):
+    cache = SearchCache(str(tmp_path / "search.sqlite3"), index=make_index())
+    cache.store("HDFC Bank NPA trend in 2024", "NPA 2024", "india", ["HDFCBANK.NS"])
+
+    assert cache.lookup("HDFC Bank deposit trend in 2024", "india", tickers=["HDFCBANK.NS"]) is None
+    assert cache.lookup("HDFC Bank NPA trend in 2023", "india", tickers=["HDFCBANK.NS"]) is None
+    cached = cache.lookup("latest HDFC NPA trend 2024", "india", tickers=["HDFCBANK.NS"])
+    assert cached is not None and cached.response == "NPA 2024"
+
+
+def test_search_without_tickers_is_not_cached(tmp_path):
+    cache = SearchCache(str(tmp_path / "search.sqlite3"), index=make_index())
+    cache.store("latest news on banking sector", "banking news", "india")
+
+    assert cache.lookup("latest news on IT sector", "india") is None
+    assert cache.lookup("latest news on banking sector", "india") is None
+    assert cache.stats()["entries"] == 0
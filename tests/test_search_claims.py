@@ -0,0 +1,18 @@
+import time
+
+from master_agent.sub_agents.content_retriever_agent import agent
+
+
+def test_claims_of_abandoned_searches_are_released(monkeypatch):
+    future, leader = agent._search_flight.claim("india|sbin|news")
+    assert leader
+    agent._search_claims["abandoned"] = ("india|sbin|news", future, time.monotonic())
+    agent._prune_search_claims()
+    assert "abandoned" in agent._search_claims and not future.done()
+
+    later = time.monotonic() + agent.SINGLE_FLIGHT_SEARCH_WAIT_SECONDS + 1
+    monkeypatch.setattr(agent.time, "monotonic", lambda: later)
+    agent._prune_search_claims()
+    assert "abandoned" not in agent._search_claims
+    assert isinstance(future.exception(), TimeoutError)
+    assert agent._search_flight.stats()["in_flight"] == 0
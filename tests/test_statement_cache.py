@@ -0,0 +1,61 @@
+import time
+
+import pandas as pd
+import pytest
+
+from master_agent.sub_agents.data_chart_agent import statement_cache
+from master_agent.sub_agents.data_chart_agent.statement_cache import StatementCache
+
+DAY = 24 * 60 * 60
+
+
+def annual_income(period_end):
+    return pd.DataFrame([[1.0]], index=["Total Revenue"], columns=pd.to_datetime([period_end], unit="s"))
+
+
+def test_annual_statements_wait_for_the_next_annual_report(tmp_path, monkeypatch):
+    cache = StatementCache(str(tmp_path / "statements.sqlite3"), 10**8, {"income_stmt": DAY})
+    now = time.time()
+    cache.put("ABC.NS", "income_stmt", annual_income(now - 30 * DAY))
+
+    for hours in (7, 23, 25, 24 * 200):
+        monkeypatch.setattr(statement_cache.time, "time", lambda: now + hours * 3600)
+        assert cache.is_fresh("ABC.NS", "income_stmt")
+
+
+def test_statements_past_their_report_date_still_keep_their_ttl(tmp_path, monkeypatch):
+    cache = StatementCache(str(tmp_path / "statements.sqlite3"), 10**8, {"income_stmt": DAY})
+    now = time.time()
+    cache.put("ABC.NS", "income_stmt", annual_income(now - 500 * DAY))
+
+    monkeypatch.setattr(statement_cache.time, "time", lambda: now + 23 * 3600)
+    assert cache.is_fresh("ABC.NS", "income_stmt")
+    monkeypatch.setattr(statement_cache.time, "time", lambda: now + 25 * 3600)
+    assert not cache.is_fresh("ABC.NS", "income_stmt")
+
+
+def test_failed_put_rolls_back_and_leaves_no_transaction_open(tmp_path, monkeypatch):
+    cache = StatementCache(str(tmp_path / "statements.sqlite3"), 10**8, {"income_stmt": DAY})
+
+    def fail():
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(cache, "_evict", fail)
+    with pytest.raises(RuntimeError):
+        cache.put("ABC.NS", "income_stmt", annual_income(time.time() - 30 * DAY))
+    assert cache.get("ABC.NS", "income_stmt") is None and cache.report_calendar("ABC.NS") is None
+
+    monkeypatch.undo()
+    cache.put("ABC.NS", "income_stmt", annual_income(time.time() - 30 * DAY))
+    assert cache.get("ABC.NS", "income_stmt") is not None
+
+
+def test_prefetcher_lookups_and_empty_blocks_are_kept_apart(tmp_path, monkeypatch):
+    cache = StatementCache(str(tmp_path / "statements.sqlite3"), 10**8, {"income_stmt": DAY}, empty_ttl_seconds=60)
+    assert cache.get("ABC.NS", "income_stmt", count=False) is None
+    assert cache.stats()["misses"] == 0 and cache.stats()["warm_lookups"] == 1
+
+    cache.record_empty("ABC.NS", "quarterly_cashflow")
+    assert cache.is_known_empty("ABC.NS", "quarterly_cashflow")
+    now = time.time()
+    monkeypatch.setattr(statement_cache.time, "time", lambda: now + 120)
+    assert not cache.is_known_empty("ABC.NS", "quarterly_cashflow")
@@ -0,0 +1,36 @@
+import pytest
+
+from services.symbol_index import NON_COMPANY_WORDS, SymbolIndex
+
+LISTING = [
+    ("IOC.NS", "Indian Oil Corporation Limited", ["IOC", "Indian Oil"]),
+    ("INFY.NS", "Infosys Limited", ["Infosys"]),
+    ("AXP", "American Express Company", ["Amex"]),
+    ("BANKBARODA.NS", "Bank of Baroda", []),
+    ("TATAMOTORS.NS", "Tata Motors Limited", []),
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SymbolIndex(LISTING, min_score=0.5, min_chars=4)
+
+
+@pytest.mark.parametrize("word", sorted(NON_COMPANY_WORDS))
+def test_country_and_market_words_never_resolve(index, word):
+    assert index.lookup(word) == []
+    assert index.lookup(word.title()) == []
+
+
+@pytest.mark.parametrize("name", ["Inf", "Ban", "Tat", "Ind", "Am"])
+def test_short_names_do_not_resolve_by_prefix_or_trigram(index, name):
+    assert index.lookup(name) == []
+
+
+def test_company_names_still_resolve(index):
+    assert index.lookup("Indian Oil")[0] == ("IOC.NS", 1.0)
+    assert index.lookup("Bank of Baroda")[0] == ("BANKBARODA.NS", 1.0)
+    assert index.lookup("Tata")[0] == ("TATAMOTORS.NS", 1.0) # Leading word of a single company.
+    assert index.lookup("Infosys Ltd.")[0] == ("INFY.NS", 1.0)
+    symbol, score = index.lookup("Infosyss")[0]
+    assert symbol == "INFY.NS" and score < 1.0
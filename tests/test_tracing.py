@@ -0,0 +1,18 @@
+import json
+
+from services.tracing import Tracer
+
+
+def test_spans_are_exported_by_the_background_writer(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(str(path), max_bytes=10**6, enabled=True, flush_interval=60, max_pending=3)
+    for i in range(5):
+        with tracer.span("tool", "get_data_tables", call=i):
+            pass
+
+    assert not path.exists() # Ending a span does no file I/O.
+    assert tracer.dropped_spans == 2
+    tracer.flush()
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["attributes"]["call"] for span in spans] == [0, 1, 2]
+    tracer.close()